@@ -3,7 +3,8 @@ from django.contrib.admin import helpers
 from django.template.response import TemplateResponse
 
 from accounts import admin_forms
-from accounts.models import User
+from accounts.models import PendingAnnouncement, User
+from studies.queries import invalidate_accessible_studies
 
 
 @admin.action(description="Set selected as spam")
@@ -35,6 +36,9 @@ def set_selected_as_spam(modeladmin, request, queryset):
             email_response_questions=False,
             admin_comments=request.POST.get("admin_comments"),
         )
+        # update() skips the signals that keep these up to date.
+        PendingAnnouncement.refresh(user_ids=[user_id])
+        invalidate_accessible_studies()
 
         # Show success message
         modeladmin.message_user(
@@ -0,0 +1,103 @@
+# Generated by Django 5.2.13 on 2026-10-18 22:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BACKFILL_PENDING_ANNOUNCEMENTS = """
+INSERT INTO accounts_pendingannouncement (user_id, child_id, study_id)
+SELECT ac.user_id,
+       ac.id,
+       ss.id
+FROM accounts_child ac
+         INNER JOIN accounts_user au ON au.id = ac.user_id
+         CROSS JOIN studies_study ss
+WHERE ss.state = 'active'
+  AND ss.public = true
+  AND au.is_active = true
+  AND au.email_new_studies = true
+  AND ac.deleted = false
+  AND NOT EXISTS(
+        SELECT 1
+        FROM studies_response sr
+        WHERE sr.child_id = ac.id
+          AND sr.study_id = ss.id
+          AND ((sr.completed_consent_frame = true AND sr.study_type_id = 1)
+            OR sr.study_type_id = 2)
+    )
+  AND NOT EXISTS(
+        SELECT 1
+        FROM accounts_message am
+                 INNER JOIN accounts_message_children_of_interest amcoi ON am.id = amcoi.message_id
+                 INNER JOIN accounts_message_recipients amr ON am.id = amr.message_id
+        WHERE amr.user_id = ac.user_id
+          AND amcoi.child_id = ac.id
+          AND am.related_study_id = ss.id
+          AND am.email_sent_timestamp IS NOT NULL
+    )
+ON CONFLICT DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounts", "0056_is_spam"),
+        ("studies", "0104_add_bucket_kwarg_to_video_cleanup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingAnnouncement",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "child",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pending_announcements",
+                        to="accounts.child",
+                    ),
+                ),
+                (
+                    "study",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pending_announcements",
+                        to="studies.study",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "child", "study"],
+                        name="accounts_pe_user_id_f0b184_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("child", "study"), name="unique_pending_announcement"
+                    )
+                ],
+            },
+        ),
+        migrations.RunSQL(
+            BACKFILL_PENDING_ANNOUNCEMENTS, reverse_sql=migrations.RunSQL.noop
+        ),
+    ]
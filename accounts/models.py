@@ -1,8 +1,11 @@
 import base64
 import hashlib
+import secrets
 import uuid
+from collections import defaultdict
 from io import BytesIO
-from typing import Union
+from typing import NamedTuple, Union
+from urllib.parse import quote
 
 import pydenticon
 import pyotp
@@ -11,30 +14,35 @@ from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.postgres.fields.array import ArrayField
-from django.core.mail.message import EmailMultiAlternatives
 from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.http import HttpRequest
 from django.template.loader import get_template
 from django.urls import reverse
-from django.utils.html import mark_safe
+from django.utils.html import conditional_escape, mark_safe
+from django.utils.http import RFC3986_SUBDELIMS
 from django.utils.text import slugify
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 from django_countries.fields import CountryField
 from guardian.mixins import GuardianUserMixin
 from guardian.shortcuts import get_perms
+from guardian.utils import get_group_obj_perms_model, get_user_obj_perms_model
 from localflavor.us.models import USStateField
 from localflavor.us.us_states import USPS_CHOICES
 from model_utils import Choices
+from more_itertools import map_reduce
 from multiselectfield import MultiSelectField
 from qrcode import make as make_qrcode
 from qrcode.image.svg import SvgPathImage
 
 import studies
-from accounts.queries import BitfieldQuerySet, get_child_eligibility_for_study
+from accounts.queries import ChildQuerySet, invalidate_eligible_studies
+from project.sendgrid_backend import PersonalizedEmailMessage, substitute
 from studies.fields import CONDITIONS, GESTATIONAL_AGE_CHOICES, LANGUAGES
-from studies.helpers import get_absolute_url, send_mail
+from studies.helpers import get_absolute_url, send_personalized_mail
 from studies.permissions import (
     UMBRELLA_LAB_PERMISSION_MAP,
     LabPermission,
@@ -49,6 +57,16 @@ GENDER_CHOICES = Choices(
 )
 
 
+# Bumped whenever object permissions or group memberships change, so that User instances reload
+# the object permissions they've memoized (see User.object_perms).
+_object_perms_generation = 0
+
+
+def invalidate_object_perms():
+    global _object_perms_generation
+    _object_perms_generation += 1
+
+
 class UserManager(BaseUserManager):
     def get_by_natural_key(self, username):
         return self.get(**{self.model.USERNAME_FIELD + "__iexact": username})
@@ -225,10 +243,9 @@ class User(AbstractBaseUser, PermissionsMixin, GuardianUserMixin):
     def has_study_child(self, request: HttpRequest) -> bool:
         study_uuid = request.session.get("study_uuid", None)
         if study_uuid:
-            study = studies.models.Study.objects.get(uuid=study_uuid)
-            children = self.children.filter(deleted=False)
-            return any(
-                get_child_eligibility_for_study(child, study) for child in children
+            study = studies.models.study_cache.get(uuid=study_uuid)
+            return (
+                self.children.filter(deleted=False).eligible_for_study(study).exists()
             )
         else:
             return False
@@ -246,25 +263,65 @@ class User(AbstractBaseUser, PermissionsMixin, GuardianUserMixin):
                     rbw.append(f"rgb({i},{j},{k})")
         return rbw
 
+    def object_perms(self, model) -> dict:
+        """Codenames of the object permissions this user has on model's rows, by row id.
+
+        Covers permissions granted to the user and to their groups, like guardian's checks, but
+        loads them for every row in one query and keeps them on this instance. request.user is
+        loaded per request, so views see each request's permissions. Reloaded after any object
+        permission or group membership change in this process.
+        """
+        if getattr(self, "_object_perms_generation", None) != _object_perms_generation:
+            self._object_perms_cache = {}
+            self._object_perms_generation = _object_perms_generation
+
+        label = model._meta.label
+        if label not in self._object_perms_cache:
+            perms = defaultdict(set)
+            if self.is_active:
+                user_perms = (
+                    get_user_obj_perms_model(model)
+                    .objects.filter(user=self)
+                    .values_list("content_object_id", "permission__codename")
+                )
+                group_perms = (
+                    get_group_obj_perms_model(model)
+                    .objects.filter(group__user=self)
+                    .values_list("content_object_id", "permission__codename")
+                )
+                for object_id, codename in user_perms.union(group_perms):
+                    perms[object_id].add(codename)
+            self._object_perms_cache[label] = perms
+        return self._object_perms_cache[label]
+
     def has_study_perms(self, study_perm: StudyPermission, study) -> bool:
         # 1) Modeled perm should be passed already
         has_all_studies_perm = self.has_perm(study_perm.prefixed_codename)
         if has_all_studies_perm:
             return True
-        has_study_perm = self.has_perm(study_perm.codename, study)
+        has_study_perm = (
+            study_perm.codename in self.object_perms(studies.models.Study)[study.pk]
+        )
         if has_study_perm:
             return True
         else:
             umbrella_lab_perm = UMBRELLA_LAB_PERMISSION_MAP.get(study_perm)
-            lab = study.lab
-            if lab:
-                return self.has_perm(umbrella_lab_perm.codename, study.lab)
+            if study.lab_id:
+                return (
+                    umbrella_lab_perm.codename
+                    in self.object_perms(studies.models.Lab)[study.lab_id]
+                )
             else:
                 return False
 
     def perms_for_study(self, study):
-        user_study_perms = get_perms(self, study)
-        user_lab_perms = get_perms(self, study.lab)
+        if self.is_active and self.is_superuser:
+            # Superusers have every permission; let guardian list them.
+            user_study_perms = get_perms(self, study)
+            user_lab_perms = get_perms(self, study.lab)
+        else:
+            user_study_perms = list(self.object_perms(studies.models.Study)[study.pk])
+            user_lab_perms = self.object_perms(studies.models.Lab)[study.lab_id]
 
         for study_perm, lab_perm in UMBRELLA_LAB_PERMISSION_MAP.items():
             if lab_perm.codename in user_lab_perms:
@@ -384,7 +441,7 @@ class Child(models.Model):
         # although may not be possible depending on Responses already associated
     )
 
-    objects = BitfieldQuerySet.as_manager()
+    objects = ChildQuerySet.as_manager()
 
     def __str__(self):
         return f"<Child: {self.given_name}>"
@@ -420,6 +477,13 @@ class Child(models.Model):
         lookup_field = "uuid"
 
 
+@receiver(post_save, sender=Child)
+@receiver(post_delete, sender=Child)
+def clear_cached_eligible_studies(sender, instance, **kwargs):
+    """Eligible study lists depend on the child's birthday, conditions and languages."""
+    invalidate_eligible_studies(instance.pk)
+
+
 class DemographicData(models.Model):
     RACE_CHOICES = Choices(
         ("white", _("White")),
@@ -634,67 +698,156 @@ class Message(models.Model):
         Side Effects:
             Creates a corresponding message object in the database.
         """
-        subject = create_subject_for_study_notification(study, children)
-        children_string = create_string_listing_children(children)
-        context = {
-            "user": user,
-            "study": study,
-            "children": children,
-            "children_string": children_string,
-            "username": user.username,
-            "token": user.generate_token(),
-        }
+        # Return for testing.
+        return cls.send_announcement_emails([(user, study, children)])[0]
 
-        text_content = get_template("emails/study_announcement.txt").render(context)
-        html_content = get_template("emails/study_announcement.html").render(context)
-        announcement_message = cls.objects.create(
-            subject=subject, body=text_content, related_study=study
-        )
+    @classmethod
+    def send_announcement_emails(cls, targets):
+        """Send announcement emails for many (user, study, children) targets at once.
 
-        announcement_message.recipients.add(user)
-        announcement_message.children_of_interest.add(*children)
+        Targets are grouped by study, and by whether they name one child or several. Each group's
+        templates are rendered once and sent as one personalized email, and its messages are
+        bulk created along with their recipients and children of interest.
 
-        email = EmailMultiAlternatives(
-            subject,
-            text_content,
-            settings.EMAIL_FROM_ADDRESS,
-            [user.username],
-            reply_to=[study.lab.contact_email],
-            headers=cls.email_headers(context),
+        Args:
+            targets: iterable of (User, Study, list of Child) tuples.
+
+        Returns:
+            list: the created Message objects, in the same order as targets.
+        """
+        targets = list(targets)
+        groups = map_reduce(
+            range(len(targets)),
+            keyfunc=lambda i: (targets[i][1].id, len(targets[i][2]) > 1),
         )
-        email.attach_alternative(html_content, "text/html")
-        email.send()
+        announcement_messages = [None] * len(targets)
+
+        for (study_id, plural), indices in groups.items():
+            study = targets[indices[0]][1]
+            keys = SubstitutionKeys.new()
+            context = {
+                "user": {"display_name": keys.display_name},
+                "study": study,
+                "children": [None] * (2 if plural else 1),
+                "children_string": keys.children_string,
+                "username": keys.username,
+                "token": keys.token,
+            }
+            text_content = get_template("emails/study_announcement.txt").render(context)
+            html_content = get_template("emails/study_announcement.html").render(
+                context
+            )
 
-        announcement_message.email_sent_timestamp = now()
-        announcement_message.save()
+            personalizations = []
+            for i in indices:
+                user, study, children = targets[i]
+                subject = create_subject_for_study_notification(study, children)
+                personalization = cls.personalization_for(
+                    user,
+                    keys,
+                    subject=subject,
+                    substitutions={
+                        keys.display_name: conditional_escape(user.display_name),
+                        keys.children_string: conditional_escape(
+                            create_string_listing_children(children)
+                        ),
+                    },
+                )
+                personalizations.append(personalization)
+                announcement_messages[i] = cls(
+                    subject=subject,
+                    body=substitute(text_content, personalization["substitutions"]),
+                    related_study=study,
+                )
 
-        # Return for testing.
-        return announcement_message
+            group_messages = [announcement_messages[i] for i in indices]
+            cls.objects.bulk_create(group_messages)
+            cls.recipients.through.objects.bulk_create(
+                cls.recipients.through(
+                    message_id=announcement_messages[i].id, user_id=targets[i][0].id
+                )
+                for i in indices
+            )
+            cls.children_of_interest.through.objects.bulk_create(
+                cls.children_of_interest.through(
+                    message_id=announcement_messages[i].id, child_id=child.id
+                )
+                for i in indices
+                for child in targets[i][2]
+            )
+
+            email = PersonalizedEmailMessage(
+                personalizations[0]["subject"],
+                text_content,
+                settings.EMAIL_FROM_ADDRESS,
+                personalizations=personalizations,
+                reply_to=[study.lab.contact_email],
+            )
+            email.attach_alternative(html_content, "text/html")
+            email.send()
+
+            sent_timestamp = now()
+            cls.objects.filter(
+                id__in=[message.id for message in group_messages]
+            ).update(email_sent_timestamp=sent_timestamp)
+            for message in group_messages:
+                message.email_sent_timestamp = sent_timestamp
+            PendingAnnouncement.objects.filter(
+                study_id=study.id,
+                child_id__in=[child.id for i in indices for child in targets[i][2]],
+            ).delete()
+
+        return announcement_messages
 
     def send_as_email(self):
+        keys = SubstitutionKeys.new()
         context = {
             "custom_message": mark_safe(self.body),
+            "username": keys.username,
+            "token": keys.token,
         }
 
         lab_email = self.related_study.lab.contact_email
 
-        recipient_email_list = list(self.recipients.values_list("username", flat=True))
-
-        for to_email in recipient_email_list:
-            user = User.objects.get(username=to_email)
-            context.update(token=user.generate_token(), username=to_email)
-            send_mail.delay(
+        personalizations = [
+            self.personalization_for(user, keys)
+            for user in self.recipients.only("username")
+        ]
+        if personalizations:
+            send_personalized_mail.delay(
                 "custom_email",
                 self.subject,
-                to_email,
+                personalizations,
                 reply_to=[lab_email],
-                headers=self.email_headers(context),
                 **context,
             )
 
         self.email_sent_timestamp = now()  # will use UTC now (see USE_TZ in settings)
         self.save()
 
+    @classmethod
+    def personalization_for(cls, user, keys, subject=None, substitutions=None):
+        """Build a user's personalization for a PersonalizedEmailMessage.
+
+        Fills in the username and token substitution keys as they appear in unsubscribe links,
+        and sets the user's List-Unsubscribe headers.
+        """
+        token = user.generate_token()
+        personalization = {
+            "to": user.username,
+            "substitutions": {
+                keys.username: _as_url_substitution(user.username),
+                keys.token: _as_url_substitution(token),
+                **(substitutions or {}),
+            },
+        }
+        if subject:
+            personalization["subject"] = subject
+        headers = cls.email_headers({"token": token, "username": user.username})
+        if headers:
+            personalization["headers"] = headers
+        return personalization
+
     @classmethod
     def email_headers(cls, context):
         token = context.get("token")
@@ -715,6 +868,143 @@ class Message(models.Model):
             return None
 
 
+PENDING_ANNOUNCEMENTS_INSERT = """
+INSERT INTO accounts_pendingannouncement (user_id, child_id, study_id)
+SELECT ac.user_id,
+       ac.id,
+       ss.id
+FROM accounts_child ac
+         INNER JOIN accounts_user au ON au.id = ac.user_id
+         CROSS JOIN studies_study ss
+WHERE ss.state = 'active'
+  AND ss.public = true
+  AND au.is_active = true
+  AND au.email_new_studies = true
+  AND ac.deleted = false
+  AND NOT EXISTS(
+        SELECT 1
+        FROM studies_response sr
+        WHERE sr.child_id = ac.id
+          AND sr.study_id = ss.id
+          AND ((sr.completed_consent_frame = true AND sr.study_type_id = 1)
+            OR sr.study_type_id = 2)
+    )
+  AND NOT EXISTS(
+        SELECT 1
+        FROM accounts_message am
+                 INNER JOIN accounts_message_children_of_interest amcoi ON am.id = amcoi.message_id
+                 INNER JOIN accounts_message_recipients amr ON am.id = amr.message_id
+        WHERE amr.user_id = ac.user_id
+          AND amcoi.child_id = ac.id
+          AND am.related_study_id = ss.id
+          AND am.email_sent_timestamp IS NOT NULL
+    )
+  {scope}
+ON CONFLICT DO NOTHING;
+"""
+
+
+class PendingAnnouncement(models.Model):
+    """A child whose family has not yet been sent an announcement about an active, public study.
+
+    Kept up to date as studies go active or inactive, children and families change, responses
+    come in and announcements are sent, so that the daily announcement job only reads this
+    table. Eligibility for the study is still checked when the announcements are sent.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    child = models.ForeignKey(
+        Child, on_delete=models.CASCADE, related_name="pending_announcements"
+    )
+    study = models.ForeignKey(
+        "studies.Study", on_delete=models.CASCADE, related_name="pending_announcements"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("child", "study"), name="unique_pending_announcement"
+            )
+        ]
+        indexes = [models.Index(fields=("user", "child", "study"))]
+
+    @classmethod
+    def refresh(cls, user_ids=None, child_ids=None, study_ids=None):
+        """Recompute pending announcements, for every row or only those matching the given ids."""
+        scope = models.Q()
+        conditions = []
+        params = []
+        for field, column, ids in (
+            ("user_id", "ac.user_id", user_ids),
+            ("child_id", "ac.id", child_ids),
+            ("study_id", "ss.id", study_ids),
+        ):
+            if ids is not None:
+                ids = list(ids)
+                scope &= models.Q(**{f"{field}__in": ids})
+                conditions.append(f"AND {column} = ANY(%s)")
+                params.append(ids)
+
+        with transaction.atomic():
+            cls.objects.filter(scope).delete()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    PENDING_ANNOUNCEMENTS_INSERT.format(scope="\n  ".join(conditions)),
+                    params,
+                )
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def clear_memoized_object_perms(sender, action, **kwargs):
+    """Group members have their group's object permissions."""
+    if action.startswith("post_"):
+        invalidate_object_perms()
+
+
+@receiver(post_save, sender=Child)
+def refresh_child_pending_announcements(sender, instance, **kwargs):
+    PendingAnnouncement.refresh(child_ids=[instance.pk])
+
+
+@receiver(post_save, sender=User)
+def refresh_user_pending_announcements(
+    sender, instance, created, update_fields, **kwargs
+):
+    """Families only get announcements while active and opted in to new study emails."""
+    if created:
+        return
+    if update_fields is None or {"is_active", "email_new_studies"} & set(update_fields):
+        PendingAnnouncement.refresh(user_ids=[instance.pk])
+
+
+class SubstitutionKeys(NamedTuple):
+    """Keys standing in for per-recipient values in one email sent to many recipients."""
+
+    username: str
+    token: str
+    display_name: str
+    children_string: str
+
+    @classmethod
+    def new(cls):
+        """Fresh keys for one email. They're random, so that nothing written into the email
+        (e.g. a researcher's custom message) can contain them. The username key has to look
+        like an email address so that unsubscribe links can still be reversed with it.
+        """
+        nonce = secrets.token_hex(16)
+        return cls(
+            username=f"username-{nonce}@substitution",
+            token=f"token-{nonce}",
+            display_name=f"display-name-{nonce}",
+            children_string=f"children-string-{nonce}",
+        )
+
+
+def _as_url_substitution(value):
+    """Quote and escape value the way reverse() and the absolute_url tag would in a template."""
+    return conditional_escape(quote(value, safe=RFC3986_SUBDELIMS + "/~:@"))
+
+
 def create_string_listing_children(children):
     child_names = [child.given_name for child in children]
     num_children = len(child_names)
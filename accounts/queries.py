@@ -2,13 +2,25 @@
 
 import ast
 import operator
-from datetime import date
-from functools import reduce
+from collections import defaultdict
+from datetime import date, timedelta
+from functools import lru_cache, reduce
 from itertools import chain
-
-from django.db import models
-from django.db.models import F, Q
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Q, Value
+from django.db.models.functions import Coalesce, Least
+from django.db.models.lookups import (
+    Exact,
+    GreaterThan,
+    GreaterThanOrEqual,
+    LessThan,
+    LessThanOrEqual,
+)
 from lark import Lark, Transformer, v_args
+from more_itertools import chunked
 
 from studies.fields import CONDITIONS, LANGUAGES
 
@@ -20,6 +32,37 @@ CONDITION_FIELDS = {condition_tuple[0] for condition_tuple in CONDITIONS}
 
 LANGUAGE_FIELDS = {f"speaks_{language_tuple[0]}" for language_tuple in LANGUAGES}
 
+# BitField assigns flags to bits in declaration order.
+CONDITION_BITMASKS = {
+    condition_tuple[0]: 1 << index for index, condition_tuple in enumerate(CONDITIONS)
+}
+
+LANGUAGE_BITMASKS = {
+    f"speaks_{language_tuple[0]}": 1 << index
+    for index, language_tuple in enumerate(LANGUAGES)
+}
+
+ALL_LANGUAGES_BITMASK = reduce(operator.or_, LANGUAGE_BITMASKS.values(), 0)
+
+COMPARISON_LOOKUPS = {
+    "==": Exact,
+    "<": LessThan,
+    "<=": LessThanOrEqual,
+    ">": GreaterThan,
+    ">=": GreaterThanOrEqual,
+}
+
+# Comparing age in days against N is the same as comparing birthday against (today - N days),
+# with the direction of the comparison reversed.
+REVERSED_COMPARATORS = {
+    "==": "==",
+    "!=": "!=",
+    "<": ">",
+    "<=": ">=",
+    ">": "<",
+    ">=": "<=",
+}
+
 QUERY_GRAMMAR = """
 ?start: bool_expr
 
@@ -39,8 +82,9 @@ not_bool_factor: "NOT" bool_factor
 
 gender_comparison: "gender" (EQ | NE) gender_target
 
-// 24 to 40 weeks
-gestational_age_comparison: "gestational_age_in_weeks" comparator GESTATIONAL_AGE_AS_WEEKS
+// 24 to 40 weeks. Comparators are listed inline rather than through the comparator rule so
+// that the LALR contextual lexer can tell GESTATIONAL_AGE_AS_WEEKS apart from INT.
+gestational_age_comparison: "gestational_age_in_weeks" (EQ | NE | LT | LTE | GT | GTE) GESTATIONAL_AGE_AS_WEEKS
 
 age_in_days_comparison: "age_in_days" comparator INT
 
@@ -85,7 +129,23 @@ UNSPECIFIED: "na"i | "n/a"i
     condition_targets=" | ".join([f'"{target}"' for target in CONDITION_FIELDS]),
 )
 
-QUERY_DSL_PARSER = Lark(QUERY_GRAMMAR, parser="earley")
+QUERY_DSL_PARSER = Lark(QUERY_GRAMMAR, parser="lalr")
+
+# Number of distinct criteria expressions whose compiled tester functions are kept per process.
+COMPILED_EXPRESSION_CACHE_SIZE = 1024
+
+# Participation index: how long cached participation sets and requirement lists are kept, and
+# how many children are loaded per query on a cache miss.
+PARTICIPATION_CACHE_TIMEOUT = 60 * 10
+PARTICIPATION_QUERY_CHUNK_SIZE = 1000
+
+# Eligible study lists for the participant studies page. Entries are also tied to the current
+# date and the study list version, so they expire with age windows and study changes.
+ELIGIBLE_STUDIES_CACHE_TIMEOUT = 60 * 60 * 24
+STUDY_LIST_VERSION_CACHE_KEY = "eligible-studies:version"
+# The version is replaced this often even without study changes, which bounds how long lists can
+# outlive a change whose invalidation didn't reach the cache a process reads.
+STUDY_LIST_VERSION_CACHE_TIMEOUT = 60 * 10
 
 
 def age_range_eligibility_for_study(child_age_range, study) -> bool:
@@ -104,47 +164,334 @@ def get_child_eligibility_for_study(child_obj, study_obj):
     )
 
 
-def get_child_participation_eligibility(child, study) -> bool:
-    """Check if child's participation in other studies changes their eligibility.
+def get_participated_study_ids(child_ids) -> dict:
+    """Get the ids of studies each child has participated in, using a single query.
+
+    Args:
+        child_ids: iterable of Child ids
+
+    Returns:
+        dict: Child id -> set of Study ids with a non-empty response from that child
+    """
+    from studies.models import Response
+
+    ember_frame_player_id = 1
+    participated = defaultdict(set)
+    # for both must have and must not have participated, ignore responses from internal studies that are empty
+    responses = (
+        Response.objects.filter(child_id__in=list(child_ids))
+        .exclude(study__study_type_id=ember_frame_player_id, sequence=[])
+        .values_list("child_id", "study_id")
+        .distinct()
+    )
+    for child_id, study_id in responses:
+        participated[child_id].add(study_id)
+    return participated
+
+
+def _load_participation_requirements(study_ids) -> dict:
+    """Load the must have/must not have participated study ids for each study.
+
+    Args:
+        study_ids: iterable of Study ids
+
+    Returns:
+        dict: Study id -> (set of must have ids, set of must not have ids)
+    """
+    from studies.models import Study
+
+    study_ids = list(study_ids)
+    requirements = {study_id: (set(), set()) for study_id in study_ids}
+    for position, through in enumerate(
+        (Study.must_have_participated.through, Study.must_not_have_participated.through)
+    ):
+        for from_study_id, to_study_id in through.objects.filter(
+            from_study_id__in=study_ids
+        ).values_list("from_study_id", "to_study_id"):
+            requirements[from_study_id][position].add(to_study_id)
+    return requirements
+
+
+def child_participation_cache_key(child_id) -> str:
+    return f"participation:child:{child_id}"
+
+
+def participation_requirements_cache_key(study_id) -> str:
+    return f"participation:study:{study_id}"
+
+
+def get_participation_index(child_ids) -> dict:
+    """Get the ids of studies each child has participated in.
+
+    Cached per child. Children missing from the cache are loaded in bulk, with one
+    query per chunk of PARTICIPATION_QUERY_CHUNK_SIZE children.
+
+    Args:
+        child_ids: iterable of Child ids
+
+    Returns:
+        dict: Child id -> frozenset of Study ids with a non-empty response from that child
+    """
+    keys = {child_id: child_participation_cache_key(child_id) for child_id in child_ids}
+    cached = cache.get_many(keys.values())
+    index = {child_id: cached[key] for child_id, key in keys.items() if key in cached}
+
+    missing = [child_id for child_id in keys if child_id not in index]
+    for chunk in chunked(missing, PARTICIPATION_QUERY_CHUNK_SIZE):
+        participated = get_participated_study_ids(chunk)
+        loaded = {
+            child_id: frozenset(participated.get(child_id, ())) for child_id in chunk
+        }
+        cache.set_many(
+            {keys[child_id]: value for child_id, value in loaded.items()},
+            PARTICIPATION_CACHE_TIMEOUT,
+        )
+        index.update(loaded)
+
+    return index
+
+
+def get_participation_requirements(study_ids) -> dict:
+    """Get the must have/must not have participated study ids for each study.
+
+    Cached per study and invalidated when either list changes.
+
+    Args:
+        study_ids: iterable of Study ids
+
+    Returns:
+        dict: Study id -> (frozenset of must have ids, frozenset of must not have ids)
+    """
+    keys = {
+        study_id: participation_requirements_cache_key(study_id)
+        for study_id in study_ids
+    }
+    cached = cache.get_many(keys.values())
+    requirements = {
+        study_id: cached[key] for study_id, key in keys.items() if key in cached
+    }
+
+    missing = [study_id for study_id in keys if study_id not in requirements]
+    if missing:
+        loaded = {
+            study_id: (frozenset(must_have), frozenset(must_not_have))
+            for study_id, (
+                must_have,
+                must_not_have,
+            ) in _load_participation_requirements(missing).items()
+        }
+        cache.set_many(
+            {keys[study_id]: value for study_id, value in loaded.items()},
+            PARTICIPATION_CACHE_TIMEOUT,
+        )
+        requirements.update(loaded)
+
+    return requirements
+
+
+def invalidate_child_participation(child_id):
+    """Drop a child's cached participation set.
+
+    Done again when the current transaction commits, so a set that another request caches
+    before then, without the change, isn't kept.
+    """
+    key = child_participation_cache_key(child_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def invalidate_participation_requirements(study_ids):
+    """Drop studies' cached participation requirements, now and when the transaction commits."""
+    keys = [participation_requirements_cache_key(study_id) for study_id in study_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class EligibilityMatrix:
+    """Eligibility of many children for many studies, computed in bulk.
+
+    Equivalent to calling get_child_eligibility_for_study for every (child, study) pair, but
+    prior participation comes from the participation index for the whole batch, each child is
+    expanded once and each criteria expression is compiled once.
+
+    Attributes:
+        children: list of Child objects, one per row.
+        studies: list of Study objects, one per column.
+        rows: list of lists of bools; rows[i][j] is True if children[i] is eligible for studies[j].
+    """
+
+    def __init__(self, children, studies, today=None):
+        self.children = list(children)
+        self.studies = list(studies)
+        self._child_index = {child.id: i for i, child in enumerate(self.children)}
+        self._study_index = {study.id: j for j, study in enumerate(self.studies)}
+        self.rows = self._evaluate(today or date.today())
+
+    def _evaluate(self, today):
+        participated = get_participation_index(self._child_index)
+        requirements = get_participation_requirements(self._study_index)
+        columns = [
+            (
+                study_age_range(study),
+                *requirements[study.id],
+                compile_expression(study.criteria_expression)
+                if study.criteria_expression
+                else None,
+            )
+            for study in self.studies
+        ]
+        needs_expanded_child = any(column[3] for column in columns)
+
+        rows = []
+        for child in self.children:
+            if not child.birthday:
+                rows.append([False] * len(columns))
+                continue
+
+            age_in_days = (today - child.birthday).days
+            child_participation = participated[child.id]
+            if needs_expanded_child:
+                expanded_child = _get_expanded_child(child)
+                expanded_child["age_in_days"] = age_in_days
+
+            rows.append(
+                [
+                    min_age <= age_in_days <= max_age
+                    and required <= child_participation
+                    and required_not.isdisjoint(child_participation)
+                    and (tester is None or bool(tester(expanded_child)))
+                    for (min_age, max_age), required, required_not, tester in columns
+                ]
+            )
+        return rows
+
+    def is_eligible(self, child, study) -> bool:
+        return self.rows[self._child_index[child.id]][self._study_index[study.id]]
+
+    def eligible_pairs(self):
+        """Yield every eligible (child, study) pair."""
+        for child, row in zip(self.children, self.rows):
+            for study, eligible in zip(self.studies, row):
+                if eligible:
+                    yield child, study
+
+
+def get_study_list_version() -> str:
+    """Token that changes whenever any study's state, criteria or participation lists change."""
+    return cache.get_or_set(
+        STUDY_LIST_VERSION_CACHE_KEY,
+        lambda: uuid4().hex,
+        STUDY_LIST_VERSION_CACHE_TIMEOUT,
+    )
+
+
+def _new_study_list_version():
+    cache.set(
+        STUDY_LIST_VERSION_CACHE_KEY, uuid4().hex, STUDY_LIST_VERSION_CACHE_TIMEOUT
+    )
+
+
+def invalidate_study_lists():
+    """Retire every cached eligible study list and set of study shuffle keys.
+
+    Done again when the current transaction commits, so lists that other requests cache from
+    the old studies before then aren't kept.
+    """
+    _new_study_list_version()
+    transaction.on_commit(_new_study_list_version)
+
+
+def eligible_studies_cache_key(child_id) -> str:
+    return f"eligible-studies:child:{child_id}"
+
+
+def invalidate_eligible_studies(child_id):
+    """Drop a child's cached eligible study list, now and when the transaction commits."""
+    key = eligible_studies_cache_key(child_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def get_eligible_study_ids(child, today=None) -> frozenset:
+    """Get the ids of the active, public studies a child is eligible for.
+
+    Computed once per child and cached until the child changes, any study changes or the
+    date changes.
 
     Args:
         child (Child): Child model object
+        today (date, optional): date to compute ages against. Defaults to today.
+
+    Returns:
+        frozenset: ids of eligible studies
+    """
+    from studies.models import Study
+
+    today = today or date.today()
+    version = get_study_list_version()
+    key = eligible_studies_cache_key(child.id)
+
+    cached = cache.get(key)
+    if cached and cached[:2] == (today, version):
+        return cached[2]
+
+    matrix = EligibilityMatrix(
+        [child], Study.objects.filter(state="active", public=True), today
+    )
+    eligible_ids = frozenset(study.id for _, study in matrix.eligible_pairs())
+    cache.set(key, (today, version, eligible_ids), ELIGIBLE_STUDIES_CACHE_TIMEOUT)
+    return eligible_ids
+
+
+def get_child_participation_q(study) -> Q:
+    """Build a Q object over children equivalent to get_child_participation_eligibility.
+
+    Args:
         study (Study): Study model object
 
     Returns:
-        bool: Return true if child is eligible based on their prior study participation
+        Q: filter selecting children whose prior participation allows them to take part in the study
     """
+    from studies.models import Response
 
     ember_frame_player_id = 1
-    must_have = True
-    must_not = True
+    participation_q = Q()
 
     # for both must have and must not have participated, ignore responses from internal studies that are empty
+    nonempty_responses = Response.objects.filter(child=OuterRef("pk")).exclude(
+        study__study_type_id=ember_frame_player_id, sequence=[]
+    )
 
-    if study.must_have_participated.exists():
-        must_have_count = (
-            child.responses.filter(study__in=study.must_have_participated.all())
-            .exclude(study__study_type_id=ember_frame_player_id, sequence=[])
-            .distinct()
-            .values_list("study")
-            .count()
-        )
-        must_have = must_have_count == study.must_have_participated.count()
-
-        if not must_have:
-            return False
-
-    if study.must_not_have_participated.exists():
-        must_not_have_count = (
-            child.responses.filter(study__in=study.must_not_have_participated.all())
-            .exclude(study__study_type_id=ember_frame_player_id, sequence=[])
-            .distinct()
-            .values_list("study")
-            .count()
+    for study_id in study.must_have_participated.values_list("id", flat=True):
+        participation_q &= Q(Exists(nonempty_responses.filter(study_id=study_id)))
+
+    must_not_have_ids = list(
+        study.must_not_have_participated.values_list("id", flat=True)
+    )
+    if must_not_have_ids:
+        participation_q &= ~Q(
+            Exists(nonempty_responses.filter(study_id__in=must_not_have_ids))
         )
-        must_not = must_not_have_count == 0
 
-    return must_not
+    return participation_q
+
+
+def get_child_participation_eligibility(child, study) -> bool:
+    """Check if child's participation in other studies changes their eligibility.
+
+    Args:
+        child (Child): Child model object
+        study (Study): Study model object
+
+    Returns:
+        bool: Return true if child is eligible based on their prior study participation
+    """
+    must_have, must_not_have = get_participation_requirements([study.id])[study.id]
+    if not must_have and not must_not_have:
+        return True
+
+    participated = get_participation_index([child.id])[child.id]
+    return must_have <= participated and must_not_have.isdisjoint(participated)
 
 
 def _child_in_age_range_for_study(child, study):
@@ -193,6 +540,24 @@ def child_in_age_range_for_study_days_difference(child, study):
         return 0
 
 
+def get_child_age_range_q(study, today=None) -> Q:
+    """Build a Q object over children equivalent to _child_in_age_range_for_study.
+
+    Args:
+        study (Study): Study model object
+        today (date): date to compute ages on; defaults to today
+
+    Returns:
+        Q: filter selecting children whose age in days is within the study's (inclusive) age range
+    """
+    today = today or date.today()
+    min_age_in_days_estimate, max_age_in_days_estimate = study_age_range(study)
+    return Q(
+        birthday__gte=today - timedelta(days=max_age_in_days_estimate),
+        birthday__lte=today - timedelta(days=min_age_in_days_estimate),
+    )
+
+
 def study_age_range(study):
     min_age_in_days_estimate = (
         (study.min_age_years * 365) + (study.min_age_months * 30) + study.min_age_days
@@ -215,9 +580,13 @@ def get_child_eligibility(child_obj, criteria_expr):
         return True
 
 
+@lru_cache(maxsize=COMPILED_EXPRESSION_CACHE_SIZE)
 def compile_expression(boolean_algebra_expression: str):
     """Compiles a boolean algebra expression into a python function.
 
+    Compiled functions are cached by expression text, so repeated eligibility checks
+    against the same study only pay for parsing and compilation once per process.
+
     Args:
         boolean_algebra_expression: a string boolean algebra expression.
 
@@ -246,6 +615,29 @@ def compile_expression(boolean_algebra_expression: str):
     return temp_namespace["property_tester"]
 
 
+def compile_expression_to_q(boolean_algebra_expression: str, today=None) -> Q:
+    """Compiles a boolean algebra expression into a Q object over accounts_child.
+
+    The result selects exactly the children for which the function returned by
+    compile_expression would return True, so eligibility can be checked in the database.
+
+    Args:
+        boolean_algebra_expression: a string boolean algebra expression.
+        today: date to compute ages on; defaults to today.
+
+    Returns:
+        A Q object.
+
+    Raises:
+        lark.exceptions.ParseError: in case we cannot parse the boolean algebra.
+    """
+    if not boolean_algebra_expression:
+        return Q()
+
+    parse_tree = QUERY_DSL_PARSER.parse(boolean_algebra_expression)
+    return QueryTransformer(today).transform(parse_tree)
+
+
 def _get_expanded_child(child_object):
     """Expands a child object such that it can be evaluated easily.
 
@@ -325,14 +717,16 @@ class FunctionTransformer(Transformer):
 
     def gestational_age_comparison(self, comparator, num_weeks):
         """False if no_answer is provided."""
+        comparator = self.comparator(comparator)
         if num_weeks.lower() in ("na", "n/a"):
             # TODO: enhance validation layer so that a non-equals comparator will provide a sensible
             #     error message.
             return f"child_obj.get('gestational_age_in_weeks') {comparator} None"
         else:
+            # Parenthesized so the conditional doesn't swallow surrounding NOT/AND/OR terms.
             return (
-                f"child_obj.get('gestational_age_in_weeks') {comparator} {num_weeks} "
-                "if child_obj.get('gestational_age_in_weeks') else False"
+                f"(child_obj.get('gestational_age_in_weeks') {comparator} {num_weeks} "
+                "if child_obj.get('gestational_age_in_weeks') else False)"
             )
 
     def age_in_days_comparison(self, comparator, num_days):
@@ -361,6 +755,102 @@ class FunctionTransformer(Transformer):
         return f"not {bool_factor}"
 
 
+class BitCount(models.Func):
+    """Number of set bits in a bigint expression (PostgreSQL)."""
+
+    template = "length(replace((%(expressions)s)::bit(64)::text, '0', ''))"
+    output_field = models.IntegerField()
+
+
+def _compare(lhs, comparator: str, rhs) -> Q:
+    """Q object for `lhs <comparator> rhs`, where comparator is a Python operator."""
+    if comparator == "!=":
+        return ~Q(Exact(lhs, rhs))
+    return Q(COMPARISON_LOOKUPS[comparator](lhs, rhs))
+
+
+@v_args(inline=True)
+class QueryTransformer(Transformer):
+    """Database counterpart of FunctionTransformer.
+
+    Every comparison is built from non-null expressions so that negation behaves the same
+    way in SQL as it does in Python.
+    """
+
+    def __init__(self, today=None):
+        super().__init__()
+        self.today = today or date.today()
+
+    def bool_expr(self, bool_term, *others):
+        return reduce(operator.or_, others, bool_term)
+
+    def bool_term(self, bool_factor, *others):
+        return reduce(operator.and_, others, bool_factor)
+
+    def gender_comparison(self, comparator, target_gender):
+        return _compare(F("gender"), self.comparator(comparator), target_gender)
+
+    def gestational_age_comparison(self, comparator, num_weeks):
+        """False if no_answer is provided."""
+        comparator = self.comparator(comparator)
+        gestational_age_enum = Coalesce(F("gestational_age_at_birth"), Value(0))
+        if num_weeks.lower() in ("na", "n/a"):
+            if comparator not in ("==", "!="):
+                raise TypeError(
+                    f"Cannot compare gestational_age_in_weeks {comparator} na"
+                )
+            # Mirrors _gestational_age_enum_value_to_weeks: both null and 0 map to None.
+            return _compare(gestational_age_enum, comparator, 0)
+        else:
+            gestational_age_in_weeks = Least(
+                gestational_age_enum + Value(23), Value(40)
+            )
+            return Q(GreaterThan(gestational_age_enum, 0)) & _compare(
+                gestational_age_in_weeks, comparator, int(num_weeks)
+            )
+
+    def age_in_days_comparison(self, comparator, num_days):
+        return _compare(
+            F("birthday"),
+            REVERSED_COMPARATORS[comparator],
+            self.today - timedelta(days=int(num_days)),
+        )
+
+    def language_comparison(self, lang_target):
+        return Q(
+            GreaterThan(
+                F("languages_spoken").bitand(LANGUAGE_BITMASKS[str(lang_target)]), 0
+            )
+        )
+
+    def condition_comparison(self, condition_target):
+        return Q(
+            GreaterThan(
+                F("existing_conditions").bitand(
+                    CONDITION_BITMASKS[str(condition_target)]
+                ),
+                0,
+            )
+        )
+
+    def language_count_comparison(self, comparator, num_langs):
+        return _compare(
+            BitCount(F("languages_spoken").bitand(ALL_LANGUAGES_BITMASK)),
+            comparator,
+            int(num_langs),
+        )
+
+    def gender_target(self, gender):
+        gender = gender.lower()
+        return GENDER_MAPPING.get(gender, gender)
+
+    def comparator(self, relation):
+        return "==" if relation == "=" else str(relation)
+
+    def not_bool_factor(self, bool_factor):
+        return ~bool_factor
+
+
 class BitfieldQuerySet(models.QuerySet):
     """A QuerySet that can handle bitwise queries intelligently.
 
@@ -424,3 +914,35 @@ class BitfieldQuerySet(models.QuerySet):
         filter_query = reduce(operator.and_, has_each, Q(**{f"{field_name}__gt": 0}))
 
         return self.filter(filter_query)
+
+
+class ChildQuerySet(BitfieldQuerySet):
+    """Child queries that evaluate study eligibility in the database."""
+
+    def matching_criteria_expression(self, criteria_expression: str, today=None):
+        """Filter to children satisfying a criteria expression.
+
+        Args:
+            criteria_expression: a string boolean algebra expression.
+            today: date to compute ages on; defaults to today.
+
+        Returns:
+            A filtered queryset.
+        """
+        return self.filter(compile_expression_to_q(criteria_expression, today))
+
+    def eligible_for_study(self, study, today=None):
+        """Filter to children for which get_child_eligibility_for_study would return True.
+
+        Args:
+            study: the Study to check eligibility for.
+            today: date to compute ages on; defaults to today.
+
+        Returns:
+            A filtered queryset.
+        """
+        return self.filter(
+            get_child_participation_q(study),
+            get_child_age_range_q(study, today),
+            compile_expression_to_q(study.criteria_expression, today),
+        )
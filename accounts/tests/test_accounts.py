@@ -1,27 +1,39 @@
 import datetime
+import random
 from unittest import skip
 from unittest.mock import MagicMock, patch
 
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 from django.test.client import Client
 from django.urls import reverse
 from django_dynamic_fixture import G
-from lark.exceptions import UnexpectedCharacters
+from lark.exceptions import UnexpectedInput
 from parameterized import parameterized
 
 from accounts.backends import TWO_FACTOR_AUTH_SESSION_KEY
 from accounts.models import Child, DemographicData, GoogleAuthenticatorTOTP, User
 from accounts.queries import (
+    EligibilityMatrix,
     age_range_eligibility_for_study,
     child_in_age_range_for_study_days_difference,
+    child_participation_cache_key,
+    compile_expression,
+    compile_expression_to_q,
+    eligible_studies_cache_key,
     get_child_eligibility,
     get_child_eligibility_for_study,
     get_child_participation_eligibility,
+    get_eligible_study_ids,
+    get_participation_index,
+    get_study_list_version,
+    participation_requirements_cache_key,
 )
-from studies.fields import GESTATIONAL_AGE_CHOICES
+from studies.fields import CONDITIONS, GESTATIONAL_AGE_CHOICES, LANGUAGES
 from studies.models import ConsentRuling, Lab, Response, Study, StudyType, Video
+from studies.permissions import LabPermission, StudyPermission
 
 
 class AuthenticationTestCase(TestCase):
@@ -442,6 +454,49 @@ class UserModelTestCase(TestCase):
     def test_unaffiliated_researcher_cannot_create_study(self):
         self.assertFalse(self.unaffiliated_researcher.can_create_study())
 
+    def test_study_perms_are_memoized(self):
+        previewer = G(User, is_active=True, is_researcher=True)
+        self.study.preview_group.user_set.add(previewer)
+        researcher = User.objects.get(pk=previewer.pk)
+        researcher.has_study_perms(StudyPermission.WRITE_STUDY_DETAILS, self.study)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                researcher.has_study_perms(
+                    StudyPermission.READ_STUDY_DETAILS, self.study
+                )
+            )
+            self.assertFalse(
+                researcher.has_study_perms(
+                    StudyPermission.WRITE_STUDY_DETAILS, self.study
+                )
+            )
+            self.assertIn(
+                StudyPermission.READ_STUDY_DETAILS.codename,
+                researcher.perms_for_study(self.study),
+            )
+
+    def test_memoized_study_perms_follow_group_changes(self):
+        researcher = User.objects.get(pk=self.lab_researcher.pk)
+        self.assertFalse(
+            researcher.has_study_perms(StudyPermission.READ_STUDY_DETAILS, self.study)
+        )
+
+        # Lab admins get study permissions through the umbrella lab permissions.
+        self.lab.admin_group.user_set.add(researcher)
+        self.assertTrue(
+            researcher.has_study_perms(StudyPermission.READ_STUDY_DETAILS, self.study)
+        )
+        self.assertIn(
+            LabPermission.READ_STUDY_DETAILS.codename,
+            researcher.object_perms(Lab)[self.lab.pk],
+        )
+
+        self.lab.admin_group.user_set.remove(researcher)
+        self.assertFalse(
+            researcher.has_study_perms(StudyPermission.READ_STUDY_DETAILS, self.study)
+        )
+
     def test_create_user_lowercases_username(self):
         # TODO: Do we actually use `create_user` anywhere?
         new_user = User.objects.create_user("BAD.EMAIL@GMAIL.COM")
@@ -601,12 +656,20 @@ class CriteriaExpressionTestCase(TestCase):
 
     def test_parse_failure(self):
         self.assertRaises(
-            UnexpectedCharacters,
+            UnexpectedInput,
             get_child_eligibility,
             self.deaf_male_child,
             self.malformed_condition,
         )
 
+    def test_compiled_expression_is_cached(self):
+        compile_expression.cache_clear()
+        first = compile_expression(self.complex_condition)
+        second = compile_expression(self.complex_condition)
+        self.assertIs(first, second)
+        self.assertEqual(compile_expression.cache_info().misses, 1)
+        self.assertEqual(compile_expression.cache_info().hits, 1)
+
     def test_compound_or(self):
         self.assertTrue(
             get_child_eligibility(self.deaf_male_child, self.compound_or_condition)
@@ -645,6 +708,18 @@ class CriteriaExpressionTestCase(TestCase):
             )
         )
 
+    def test_gestational_age_equality(self):
+        self.assertTrue(
+            get_child_eligibility(
+                self.born_at_25_weeks, "gestational_age_in_weeks = 25"
+            )
+        )
+        self.assertFalse(
+            get_child_eligibility(
+                self.born_at_35_weeks, "gestational_age_in_weeks = 25"
+            )
+        )
+
     def test_gender_specification(self):
         self.assertTrue(
             get_child_eligibility(self.deaf_male_child, self.gender_specific_condition)
@@ -656,6 +731,19 @@ class CriteriaExpressionTestCase(TestCase):
             )
         )
 
+    def test_gestational_age_unspecified_in_compound_expression(self):
+        self.assertTrue(
+            get_child_eligibility(
+                self.deaf_male_child, "deaf OR gestational_age_in_weeks <= 28"
+            )
+        )
+        self.assertTrue(
+            get_child_eligibility(
+                self.child_with_unspecified_gestational_age,
+                "NOT gestational_age_in_weeks <= 28",
+            )
+        )
+
     def test_num_languages_spoken(self):
         self.assertTrue(
             get_child_eligibility(
@@ -685,6 +773,95 @@ class CriteriaExpressionTestCase(TestCase):
         )
 
 
+class CriteriaExpressionQueryTestCase(TestCase):
+    """Differential tests of the Q object backend against the Python evaluator."""
+
+    comparators = ["=", "!=", "<", "<=", ">", ">="]
+
+    def setUp(self):
+        self.rng = random.Random(20240601)
+        today = datetime.date.today()
+        gestational_ages = [None] + [
+            option[0] for option in GESTATIONAL_AGE_CHOICES if option[0] is not None
+        ]
+        self.children = [
+            G(
+                Child,
+                birthday=today - datetime.timedelta(days=self.rng.randint(0, 3000)),
+                gender=self.rng.choice(["m", "f", "o", "na"]),
+                gestational_age_at_birth=self.rng.choice(gestational_ages),
+                existing_conditions=self.random_bits(len(CONDITIONS)),
+                languages_spoken=self.random_bits(len(LANGUAGES)),
+            )
+            for _ in range(40)
+        ]
+        # Make sure exact age comparisons have something to match.
+        self.children.append(
+            G(Child, birthday=today - datetime.timedelta(days=365), gender="f")
+        )
+
+    def random_bits(self, num_flags):
+        return sum(1 << index for index in range(num_flags) if self.rng.random() < 0.15)
+
+    def random_relation(self):
+        kind = self.rng.randrange(7)
+        comparator = self.rng.choice(self.comparators)
+        if kind == 0:
+            return f"gender {self.rng.choice(['=', '!='])} {self.rng.choice(['male', 'f', 'OTHER', 'na'])}"
+        elif kind == 1:
+            return f"gestational_age_in_weeks {comparator} {self.rng.randint(24, 40)}"
+        elif kind == 2:
+            return f"gestational_age_in_weeks {self.rng.choice(['=', '!='])} na"
+        elif kind == 3:
+            return f"age_in_days {comparator} {self.rng.choice([365, self.rng.randint(0, 3000)])}"
+        elif kind == 4:
+            return f"speaks_{self.rng.choice(LANGUAGES)[0]}"
+        elif kind == 5:
+            return self.rng.choice(CONDITIONS)[0]
+        else:
+            return f"n_languages {comparator} {self.rng.randint(0, 12)}"
+
+    def random_expression(self, depth=0):
+        roll = self.rng.random()
+        if depth > 3 or roll < 0.3:
+            return self.random_relation()
+        elif roll < 0.45:
+            return f"NOT {self.random_expression(depth + 1)}"
+        elif roll < 0.6:
+            return f"({self.random_expression(depth + 1)})"
+        else:
+            operator = self.rng.choice(["AND", "OR"])
+            return f"{self.random_expression(depth + 1)} {operator} {self.random_expression(depth + 1)}"
+
+    def test_matches_python_evaluator(self):
+        for _ in range(150):
+            expression = self.random_expression()
+            expected = {
+                child.pk
+                for child in self.children
+                if get_child_eligibility(child, expression)
+            }
+            actual = set(
+                Child.objects.matching_criteria_expression(expression).values_list(
+                    "pk", flat=True
+                )
+            )
+            self.assertEqual(actual, expected, expression)
+
+    def test_empty_expression_matches_everyone(self):
+        self.assertEqual(
+            Child.objects.matching_criteria_expression("").count(),
+            len(self.children),
+        )
+
+    def test_parse_failure(self):
+        self.assertRaises(
+            UnexpectedInput,
+            compile_expression_to_q,
+            "deaf or hearing_impairment or multiple_birth",
+        )
+
+
 class EligibilityTestCase(TestCase):
     def setUp(self):
         self.study_type = G(StudyType, name="default", id=1)
@@ -900,6 +1077,89 @@ class EligibilityTestCase(TestCase):
                 "Child just above upper age bound is eligible",
             )
 
+    def test_eligible_for_study_matches_python_evaluator(self):
+        children = [
+            self.twin_preemie_baby,
+            self.twin_preemie_3yo,
+            self.twin_full_term_3yo,
+            self.twin_preemie_4yo,
+            self.unborn_child,
+        ]
+        for study in [
+            self.preschooler_study_with_criteria_and_age_range,
+            self.almost_one_study,
+            self.elementary_study,
+            self.teenager_study,
+        ]:
+            lower_bound = (
+                study.min_age_years * 365
+                + study.min_age_months * 30
+                + study.min_age_days
+            )
+            upper_bound = (
+                study.max_age_years * 365
+                + study.max_age_months * 30
+                + study.max_age_days
+            )
+            boundary_children = [
+                G(
+                    Child,
+                    birthday=datetime.date.today() - datetime.timedelta(days=days),
+                )
+                for days in (
+                    lower_bound - 1,
+                    lower_bound,
+                    upper_bound,
+                    upper_bound + 1,
+                )
+            ]
+            expected = {
+                child.pk
+                for child in children + boundary_children
+                if get_child_eligibility_for_study(child, study)
+            }
+            actual = set(
+                Child.objects.filter(
+                    pk__in=[child.pk for child in children + boundary_children]
+                )
+                .eligible_for_study(study)
+                .values_list("pk", flat=True)
+            )
+            self.assertEqual(actual, expected, study.name)
+
+    def test_eligibility_matrix_matches_per_pair_checks(self):
+        children = [
+            self.twin_preemie_baby,
+            self.twin_preemie_3yo,
+            self.twin_full_term_3yo,
+            self.twin_preemie_4yo,
+            self.unborn_child,
+        ]
+        studies = [
+            self.preschooler_study_with_criteria_and_age_range,
+            self.almost_one_study,
+            self.elementary_study,
+            self.teenager_study,
+        ]
+        matrix = EligibilityMatrix(children, studies)
+
+        self.assertEqual(
+            matrix.rows,
+            [
+                [get_child_eligibility_for_study(child, study) for study in studies]
+                for child in children
+            ],
+        )
+        self.assertEqual(
+            list(matrix.eligible_pairs()),
+            [
+                (
+                    self.twin_preemie_3yo,
+                    self.preschooler_study_with_criteria_and_age_range,
+                )
+            ],
+        )
+
     def test_age_range_days_difference(self):
         lower_bound = float(
             self.almost_one_study.min_age_years * 365
@@ -1259,6 +1519,185 @@ class EligibilityTestCase(TestCase):
         self.assertTrue(get_child_participation_eligibility(child_2, study))
         self.assertTrue(get_child_eligibility_for_study(child_2, study))
 
+        self.assertEqual(
+            list(
+                Child.objects.filter(pk__in=[child_1.pk, child_2.pk])
+                .eligible_for_study(study)
+                .values_list("pk", flat=True)
+            ),
+            [child_2.pk],
+        )
+
+        matrix = EligibilityMatrix([child_1, child_2], [study, required_study])
+        self.assertEqual(matrix.rows, [[False, True], [True, True]])
+        self.assertFalse(matrix.is_eligible(child_1, study))
+        self.assertTrue(matrix.is_eligible(child_2, study))
+
+    def test_participation_index_is_cached(self):
+        other_study = G(
+            Study,
+            max_age_years=2,
+            criteria_expression="",
+            study_type=StudyType.get_ember_frame_player(),
+        )
+        study = G(
+            Study,
+            max_age_years=2,
+            criteria_expression="",
+            must_have_participated=[other_study],
+            study_type=StudyType.get_ember_frame_player(),
+        )
+        children = [G(Child, birthday=datetime.date.today()) for _ in range(3)]
+        G(Response, child=children[0], study=other_study, sequence=["0-video-config"])
+
+        with self.assertNumQueries(1):
+            index = get_participation_index([child.id for child in children])
+        self.assertEqual(index[children[0].id], {other_study.id})
+        self.assertEqual(index[children[1].id], set())
+
+        with self.assertNumQueries(0):
+            get_participation_index([child.id for child in children])
+
+        self.assertTrue(get_child_participation_eligibility(children[0], study))
+        with self.assertNumQueries(0):
+            self.assertTrue(get_child_participation_eligibility(children[0], study))
+            self.assertFalse(get_child_participation_eligibility(children[1], study))
+
+    def test_participation_requirements_invalidated_on_change(self):
+        other_study = G(
+            Study,
+            max_age_years=2,
+            criteria_expression="",
+            study_type=StudyType.get_ember_frame_player(),
+        )
+        study = G(
+            Study,
+            max_age_years=2,
+            criteria_expression="",
+            study_type=StudyType.get_ember_frame_player(),
+        )
+        child = G(Child, birthday=datetime.date.today())
+        G(Response, child=child, study=other_study, sequence=["0-video-config"])
+
+        self.assertTrue(get_child_participation_eligibility(child, study))
+
+        study.must_not_have_participated.add(other_study)
+        self.assertFalse(get_child_participation_eligibility(child, study))
+
+        study.must_not_have_participated.remove(other_study)
+        self.assertTrue(get_child_participation_eligibility(child, study))
+
+        # Changes made from the other side of the relation
+        other_study.expected_nonparticipation.add(study)
+        self.assertFalse(get_child_participation_eligibility(child, study))
+
+        other_study.expected_nonparticipation.clear()
+        self.assertTrue(get_child_participation_eligibility(child, study))
+
+    def test_participation_cached_before_commit_is_invalidated_on_commit(self):
+        other_study = G(
+            Study,
+            max_age_years=2,
+            criteria_expression="",
+            study_type=StudyType.get_ember_frame_player(),
+        )
+        study = G(
+            Study,
+            max_age_years=2,
+            criteria_expression="",
+            study_type=StudyType.get_ember_frame_player(),
+        )
+        child = G(Child, birthday=datetime.date.today())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            G(Response, child=child, study=other_study, sequence=["0-video-config"])
+            study.must_not_have_participated.add(other_study)
+            # A concurrent request, which can't see the changes yet, caches the old values.
+            cache.set(child_participation_cache_key(child.id), frozenset())
+            cache.set(
+                participation_requirements_cache_key(study.id),
+                (frozenset(), frozenset()),
+            )
+
+        self.assertEqual(
+            get_participation_index([child.id]), {child.id: {other_study.id}}
+        )
+        self.assertFalse(get_child_participation_eligibility(child, study))
+
+    def test_eligible_study_ids_cached_and_invalidated(self):
+        study = G(
+            Study,
+            min_age_years=0,
+            min_age_months=0,
+            min_age_days=0,
+            max_age_years=0,
+            max_age_months=0,
+            max_age_days=10,
+            criteria_expression="",
+            public=True,
+            study_type=StudyType.get_ember_frame_player(),
+        )
+        Study.objects.filter(pk=study.pk).update(state="active")
+        study.refresh_from_db()
+        child = G(Child, birthday=datetime.date.today() - datetime.timedelta(days=10))
+
+        self.assertIn(study.id, get_eligible_study_ids(child))
+        with self.assertNumQueries(0):
+            self.assertIn(study.id, get_eligible_study_ids(child))
+
+        # The age window moves with the date
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.assertNotIn(study.id, get_eligible_study_ids(child, tomorrow))
+
+        # Child profile change
+        child.birthday = datetime.date.today() - datetime.timedelta(days=20)
+        child.save()
+        self.assertNotIn(study.id, get_eligible_study_ids(child))
+
+        child.birthday = datetime.date.today()
+        child.save()
+        self.assertIn(study.id, get_eligible_study_ids(child))
+
+        # Study state change
+        study.state = "paused"
+        study.save()
+        self.assertNotIn(study.id, get_eligible_study_ids(child))
+
+    def test_eligible_study_ids_cached_before_commit_are_invalidated_on_commit(self):
+        study = G(
+            Study,
+            min_age_years=0,
+            min_age_months=0,
+            min_age_days=0,
+            max_age_years=0,
+            max_age_months=0,
+            max_age_days=10,
+            criteria_expression="",
+            public=True,
+            study_type=StudyType.get_ember_frame_player(),
+        )
+        Study.objects.filter(pk=study.pk).update(state="active")
+        study.refresh_from_db()
+        child = G(Child, birthday=datetime.date.today() - datetime.timedelta(days=10))
+
+        def cache_stale_list():
+            # As a concurrent request that can't see the change yet would.
+            cache.set(
+                eligible_studies_cache_key(child.id),
+                (datetime.date.today(), get_study_list_version(), {study.id}),
+            )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            study.state = "paused"
+            study.save()
+            cache_stale_list()
+        self.assertNotIn(study.id, get_eligible_study_ids(child))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            child.save()
+            cache_stale_list()
+        self.assertNotIn(study.id, get_eligible_study_ids(child))
+
 
 class Force2FAClient(Client):
     """For convenience when testing researcher views, let's just pretend everyone is two-factor auth'd."""
@@ -21,9 +21,13 @@ from api.permissions import (
     ResponsePermissions,
     VideoFromS3Permissions,
 )
-from studies.models import Feedback, Lab, Response, Study, Video
+from studies.models import Feedback, Lab, Response, Study, Video, study_cache
 from studies.permissions import StudyPermission
-from studies.queries import get_consented_responses_qs, studies_for_which_user_has_perm
+from studies.queries import (
+    get_accessible_study_ids,
+    get_consented_responses_qs,
+    studies_for_which_user_has_perm,
+)
 from studies.serializers import (
     FeedbackSerializer,
     ResponseSerializer,
@@ -125,12 +129,12 @@ class ChildViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
             return children_for_active_users
 
         # TODO: make helper for this, maybe on user
-        studies_for_data = studies_for_which_user_has_perm(
+        studies_for_data = get_accessible_study_ids(
             self.request.user, StudyPermission.READ_STUDY_RESPONSE_DATA
-        ).values_list("id", flat=True)
-        studies_for_preview = studies_for_which_user_has_perm(
+        )
+        studies_for_preview = get_accessible_study_ids(
             self.request.user, StudyPermission.READ_STUDY_PREVIEW_DATA
-        ).values_list("id", flat=True)
+        )
         consented_responses = get_consented_responses_qs().filter(
             (Q(study__id__in=studies_for_data) & Q(is_preview=False))
             | (Q(study__id__in=studies_for_preview) & Q(is_preview=True))
@@ -170,12 +174,12 @@ class DemographicDataViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
         if self.request.user.has_perm("accounts.can_read_all_user_data"):
             return demographics_for_active_users
 
-        studies_for_data = studies_for_which_user_has_perm(
+        studies_for_data = get_accessible_study_ids(
             self.request.user, StudyPermission.READ_STUDY_RESPONSE_DATA
-        ).values_list("id", flat=True)
-        studies_for_preview = studies_for_which_user_has_perm(
+        )
+        studies_for_preview = get_accessible_study_ids(
             self.request.user, StudyPermission.READ_STUDY_PREVIEW_DATA
-        ).values_list("id", flat=True)
+        )
         consented_responses = get_consented_responses_qs().filter(
             (Q(study__id__in=studies_for_data) & Q(is_preview=False))
             | (Q(study__id__in=studies_for_preview) & Q(is_preview=True))
@@ -222,12 +226,12 @@ class UserViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
             return all_users.filter(is_active=True)
         qs_ids = all_users.values_list("id", flat=True)
 
-        studies_for_data = studies_for_which_user_has_perm(
+        studies_for_data = get_accessible_study_ids(
             self.request.user, StudyPermission.READ_STUDY_RESPONSE_DATA
-        ).values_list("id", flat=True)
-        studies_for_preview = studies_for_which_user_has_perm(
+        )
+        studies_for_preview = get_accessible_study_ids(
             self.request.user, StudyPermission.READ_STUDY_PREVIEW_DATA
-        ).values_list("id", flat=True)
+        )
         consented_responses = get_consented_responses_qs().filter(
             (Q(study__id__in=studies_for_data) & Q(is_preview=False))
             | (Q(study__id__in=studies_for_preview) & Q(is_preview=True))
@@ -329,7 +333,7 @@ class ResponseViewSet(ConvertUuidToIdMixin, views.ModelViewSet):
         #        API to retrieve responses for a given study.
         if "study_uuid" in self.kwargs:
             study_uuid = self.kwargs["study_uuid"]
-            study = get_object_or_404(Study, uuid=study_uuid)
+            study = study_cache.get_or_404(uuid=study_uuid)
 
             nested_responses = study.responses
 
@@ -380,12 +384,12 @@ class ResponseViewSet(ConvertUuidToIdMixin, views.ModelViewSet):
             #     1) Participant sessions PATCHing (partial updating) ongoing response-sessions.
             #     2) Researchers/parents programmatically GETting the Responses API
 
-            studies_for_data = studies_for_which_user_has_perm(
+            studies_for_data = get_accessible_study_ids(
                 self.request.user, StudyPermission.READ_STUDY_RESPONSE_DATA
-            ).values_list("id", flat=True)
-            studies_for_preview = studies_for_which_user_has_perm(
+            )
+            studies_for_preview = get_accessible_study_ids(
                 self.request.user, StudyPermission.READ_STUDY_PREVIEW_DATA
-            ).values_list("id", flat=True)
+            )
             consented_responses = get_consented_responses_qs().filter(
                 (Q(study__id__in=studies_for_data) & Q(is_preview=False))
                 | (Q(study__id__in=studies_for_preview) & Q(is_preview=True))
@@ -434,12 +438,12 @@ class FeedbackViewSet(FilterByUrlKwargsMixin, ConvertUuidToIdMixin, views.ModelV
         """
         qs = super().get_queryset()
 
-        studies_for_data = studies_for_which_user_has_perm(
+        studies_for_data = get_accessible_study_ids(
             self.request.user, StudyPermission.READ_STUDY_RESPONSE_DATA
-        ).values_list("id", flat=True)
-        studies_for_preview = studies_for_which_user_has_perm(
+        )
+        studies_for_preview = get_accessible_study_ids(
             self.request.user, StudyPermission.READ_STUDY_PREVIEW_DATA
-        ).values_list("id", flat=True)
+        )
         consented_responses = get_consented_responses_qs().filter(
             (Q(study__id__in=studies_for_data) & Q(is_preview=False))
             | (Q(study__id__in=studies_for_preview) & Q(is_preview=True))
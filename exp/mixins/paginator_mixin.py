@@ -1,4 +1,5 @@
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db.models import Q
 
 
 class PaginatorMixin(object):
@@ -16,3 +17,86 @@ class PaginatorMixin(object):
         except EmptyPage:
             results = paginator.page(paginator.num_pages)
         return results
+
+
+class KeysetPage:
+    """A page of a KeysetPaginatorMixin list, with the rows bounding it for links to the
+    pages on either side."""
+
+    def __init__(self, object_list, has_previous, has_next):
+        self.object_list = object_list
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    @property
+    def first_pk(self):
+        return self.object_list[0].pk
+
+    @property
+    def last_pk(self):
+        return self.object_list[-1].pk
+
+
+class KeysetPaginatorMixin:
+    """Pages a ListView by seeking past the row at the edge of the neighbouring page, so later
+    pages cost as little as the first.
+
+    get_ordering() must name a single field; rows are ordered by it, then by pk. The "after"
+    query parameter is the pk of the last row of the previous page, and "before" the first of
+    the next.
+    """
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = self.get_ordering()
+        field = ordering.lstrip("-")
+        descending = ordering.startswith("-")
+        prefix = "-" if descending else ""
+        queryset = queryset.order_by(ordering, f"{prefix}pk")
+
+        after = self.request.GET.get("after")
+        before = None if after else self.request.GET.get("before")
+        edge = None
+        if after or before:
+            try:
+                edge = (
+                    queryset.model._default_manager.filter(pk=after or before)
+                    .values(field, "pk")
+                    .first()
+                )
+            except ValueError:
+                pass
+        if edge:
+            lookup = "lt" if descending == bool(after) else "gt"
+            queryset = queryset.filter(
+                Q(**{f"{field}__{lookup}": edge[field]})
+                | Q(**{field: edge[field], f"pk__{lookup}": edge["pk"]})
+            )
+        else:
+            before = None
+        if before:
+            queryset = queryset.reverse()
+
+        object_list = list(queryset[: page_size + 1])
+        more = len(object_list) > page_size
+        object_list = object_list[:page_size]
+        if before:
+            object_list.reverse()
+            page = KeysetPage(object_list, has_previous=more, has_next=True)
+        else:
+            page = KeysetPage(object_list, has_previous=bool(edge), has_next=more)
+        return None, page, object_list, page.has_other_pages()
@@ -2,7 +2,7 @@ from django.db.models import Prefetch, Q
 
 from accounts.models import Child, User
 from studies.permissions import StudyPermission
-from studies.queries import get_consented_responses_qs, studies_for_which_user_has_perm
+from studies.queries import get_accessible_study_ids, get_consented_responses_qs
 
 
 class ParticipantMixin:
@@ -11,12 +11,12 @@ class ParticipantMixin:
     model = User
 
     def valid_responses(self):
-        study_ids_real_data = studies_for_which_user_has_perm(
+        study_ids_real_data = get_accessible_study_ids(
             self.request.user, StudyPermission.READ_STUDY_RESPONSE_DATA
-        ).values_list("id", flat=True)
-        study_ids_preview_data = studies_for_which_user_has_perm(
+        )
+        study_ids_preview_data = get_accessible_study_ids(
             self.request.user, StudyPermission.READ_STUDY_PREVIEW_DATA
-        ).values_list("id", flat=True)
+        )
         return get_consented_responses_qs().filter(
             Q(study__id__in=study_ids_real_data, is_preview=False)
             | Q(study__id__in=study_ids_preview_data, is_preview=True)
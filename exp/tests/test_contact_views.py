@@ -3,7 +3,8 @@ import uuid
 from unittest.mock import patch
 
 from django.contrib.sites.models import Site
-from django.test import Client, TestCase
+from django.core import mail
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django_dynamic_fixture import G
 from guardian.shortcuts import assign_perm
@@ -245,7 +246,7 @@ class ContactViewTestCase(TestCase):
             "Researcher4", content, "Extra researcher's name in rendered contact view"
         )
 
-    @patch("studies.helpers.send_mail.delay")
+    @patch("studies.helpers.send_personalized_mail.delay")
     def test_can_post_message_to_participants(self, mock_send_mail):
         self.client.force_login(self.researcher_with_perm)
         response = self.client.post(
@@ -258,9 +259,16 @@ class ContactViewTestCase(TestCase):
             follow=True,
         )
         self.assertEqual(response.status_code, 200)
-        # Ensure message sent to participants 0, 1, 2.  We now mail each person
-        # individually to provide an appropriate unsubscribe link.
-        self.assertEqual(mock_send_mail.call_count, 3)
+        # Ensure message sent to participants 0, 1, 2.  Each person gets their own
+        # personalization to provide an appropriate unsubscribe link, all in one task.
+        self.assertEqual(mock_send_mail.call_count, 1)
+        personalizations = mock_send_mail.call_args.args[2]
+        self.assertCountEqual(
+            [personalization["to"] for personalization in personalizations],
+            [p.username for p in self.participants[0:3]],
+        )
+        for personalization in personalizations:
+            self.assertIn("List-Unsubscribe", personalization["headers"])
 
         # checking that we aren't adding any users to bbc.
         self.assertFalse("bbc" in mock_send_mail.call_args.kwargs)
@@ -278,7 +286,23 @@ class ContactViewTestCase(TestCase):
             set(self.participants[0:3]),
         )
 
-    @patch("studies.helpers.send_mail.delay")
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_message_text_is_not_substituted(self):
+        self.client.force_login(self.researcher_with_perm)
+        body = "Reply with -token-, -username@substitution- or -children-string-"
+        self.client.post(
+            self.contact_url,
+            {
+                "subject": "test email",
+                "body": body,
+                "recipients": [self.participants[0].uuid],
+            },
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(body, mail.outbox[0].body)
+        self.assertIn(body, mail.outbox[0].alternatives[0][0])
+
+    @patch("studies.helpers.send_personalized_mail.delay")
     def test_message_not_posted_to_non_participant(self, mock_send_mail):
         self.client.force_login(self.researcher_with_perm)
         response = self.client.post(
@@ -294,8 +318,14 @@ class ContactViewTestCase(TestCase):
         # Ensure message sent only to participant 3, not participant 4 (who did not participate in this study)
         mock_send_mail.assert_called()
         self.assertEqual(
-            mock_send_mail.call_args.args,
-            ("custom_email", "test email", self.participants[3].username),
+            mock_send_mail.call_args.args[:2], ("custom_email", "test email")
+        )
+        self.assertEqual(
+            [
+                personalization["to"]
+                for personalization in mock_send_mail.call_args.args[2]
+            ],
+            [self.participants[3].username],
         )
         self.assertFalse("bbc" in mock_send_mail.call_args.kwargs)
         self.assertEqual(
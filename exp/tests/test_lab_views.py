@@ -1,10 +1,13 @@
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django_dynamic_fixture import G
 from guardian.shortcuts import assign_perm
 
 from accounts.backends import TWO_FACTOR_AUTH_SESSION_KEY
 from accounts.models import User
+from project.query_profiling import QueryBudgetTestMixin
 from studies.models import Lab, Study, StudyType
 from studies.permissions import LabPermission
 
@@ -26,7 +29,7 @@ class Force2FAClient(Client):
 # we're happy just checking there aren't errors when emails are sent.
 @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
 @override_settings(CELERY_TASK_EAGER_PROPAGATES=True)
-class LabViewsTestCase(TestCase):
+class LabViewsTestCase(QueryBudgetTestMixin, TestCase):
     def setUp(self):
         self.client = Force2FAClient()
 
@@ -129,6 +132,50 @@ class LabViewsTestCase(TestCase):
             page.status_code, 403, "Unaffiliated researcher is able to view lab members"
         )
 
+    # Lab members view: stays within its query budget.
+    def testLabMembersViewWithinQueryBudget(self):
+        self.client.force_login(self.researcher)
+        page = self.assertWithinQueryBudget(self.lab_members_url)
+        self.assertEqual(page.status_code, 200)
+
+    # Lab members view: labels each member with their highest lab group.
+    def testLabMembersViewGroupLabels(self):
+        requester = G(User, is_active=True, is_researcher=True, given_name="Dara")
+        self.lab.requested_researchers.add(requester)
+        self.lab.admin_group.user_set.add(self.researcher)
+        self.lab.guest_group.user_set.add(self.researcher)
+        self.client.force_login(self.researcher)
+
+        page = self.client.get(self.lab_members_url)
+
+        labels = {
+            member["user"].pk: member["user_data"]["group_label"]
+            for member in page.context["lab_members"]
+        }
+        self.assertEqual(
+            labels,
+            {
+                self.researcher.pk: "Admin",
+                self.researcher_in_lab.pk: "Member",
+                requester.pk: "Requested to join",
+            },
+        )
+
+    # Lab members view: query count doesn't grow with the number of members.
+    def testLabMembersViewQueriesIndependentOfMemberCount(self):
+        self.client.force_login(self.researcher)
+        with CaptureQueriesContext(connection) as few_members:
+            self.client.get(self.lab_members_url)
+
+        for i in range(5):
+            member = G(User, is_active=True, is_researcher=True)
+            self.lab.researchers.add(member)
+            self.lab.readonly_group.user_set.add(member)
+        with CaptureQueriesContext(connection) as more_members:
+            self.client.get(self.lab_members_url)
+
+        self.assertEqual(len(more_members), len(few_members))
+
     # Lab members view: can see as researcher in lab.
     def testCanGetLabMembersViewAsLabResearcher(self):
         self.client.force_login(self.researcher)
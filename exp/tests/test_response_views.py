@@ -5,6 +5,7 @@ import json
 import re
 import uuid
 import zipfile
+from unittest.mock import patch
 
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
@@ -15,9 +16,11 @@ from accounts.backends import TWO_FACTOR_AUTH_SESSION_KEY
 from accounts.models import Child, DemographicData, User
 from accounts.utils import hash_id
 from exp.views.responses import (
+    StudyAttachments,
     StudyResponseSetResearcherFields,
     get_frame_data,
 )
+from project.query_profiling import QueryBudgetTestMixin
 from studies.models import ConsentRuling, Lab, Response, Study, StudyType, Video
 
 
@@ -287,6 +290,49 @@ class ResponseViewsTestCase(TestCase):
             "Unexpected status code for video attachments page",
         )
 
+    def test_video_attachments_page_through_consented_videos(self):
+        self.client.force_login(self.study_reader)
+        videos = [
+            G(
+                Video,
+                frame_id="2-my-consent-frame",
+                full_name=f"videoStream_{self.study.uuid}_2-my-consent-frame_{resp.uuid}_1594823856933_{resp.pk}",
+                pipe_name=f"7WHkjNhHt741R4lpMsDzTGBgCqBfkC{resp.pk}.mp4",
+                study=self.study,
+                response=resp,
+            )
+            for resp in self.responses
+        ]
+        # Withdrawn consent replaces the earlier ruling.
+        G(
+            ConsentRuling,
+            response=self.responses[0],
+            action="rejected",
+            arbiter=self.study_reader,
+        )
+        expected = sorted(video.full_name for video in videos[1:])
+        url = reverse("exp:study-attachments", kwargs={"pk": self.study.pk})
+
+        pages = []
+        params = {"sort": "full_name"}
+        with patch.object(StudyAttachments, "paginate_by", 4):
+            while True:
+                page_obj = self.client.get(url, params).context["page_obj"]
+                pages.append([video.full_name for video in page_obj])
+                if not page_obj.has_next():
+                    break
+                params = {"sort": "full_name", "after": page_obj.last_pk}
+
+            self.assertEqual([name for page in pages for name in page], expected)
+            self.assertEqual(len(pages), 4)
+
+            previous_page = self.client.get(
+                url, {"sort": "full_name", "before": page_obj.first_pk}
+            ).context["page_obj"]
+            self.assertEqual([video.full_name for video in previous_page], pages[-2])
+            self.assertTrue(previous_page.has_previous())
+            self.assertTrue(previous_page.has_next())
+
     def test_can_see_response_views_as_study_admin(self):
         self.client.force_login(self.study_admin)
         for url in self.all_response_urls:
@@ -403,7 +449,7 @@ class ResponseViewsTestCase(TestCase):
                 updated_resp.save()
 
 
-class ResponseDataDownloadTestCase(TestCase):
+class ResponseDataDownloadTestCase(QueryBudgetTestMixin, TestCase):
     def _decode_response(self, response):
         """Read content from either a streaming or regular response."""
         if hasattr(response, "streaming_content"):
@@ -1364,6 +1410,20 @@ class ResponseDataDownloadTestCase(TestCase):
 
         self.assertEqual(n_matches, self.n_responses + self.n_previews)
 
+    def test_responses_list_within_query_budget(self):
+        self.client.force_login(self.study_reader)
+        response = self.assertWithinQueryBudget(
+            reverse("exp:study-responses-list", kwargs={"pk": self.study.pk})
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_participant_detail_within_query_budget(self):
+        self.client.force_login(self.study_reader)
+        response = self.assertWithinQueryBudget(
+            reverse("exp:participant-detail", kwargs={"pk": self.participants[0].pk})
+        )
+        self.assertEqual(response.status_code, 200)
+
     def test_get_appropriate_individual_responses_as_previewer(self):
         self.client.force_login(self.study_previewer)
         response = self.client.get(
@@ -8,15 +8,19 @@ import random
 import time
 from unittest.mock import MagicMock, patch
 
+from botocore.exceptions import ClientError, EndpointConnectionError
 from django.conf import settings
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from django_dynamic_fixture import G
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
 from accounts.models import Child, User
-from studies.models import Lab, Response, Study, StudyType, Video
+from project.celery import app
+from studies.models import Lab, PipeUpload, Response, Study, StudyType, Video
+from studies.tasks import process_pending_pipe_uploads, process_pipe_upload
 
 
 def create_test_video_name(study_uuid, frame_id, resp_uuid, consent):
@@ -39,7 +43,7 @@ class RenameVideoTestCase(APITestCase):
         self.mock_s3_object = self.s3_patcher.start()
         mock_obj = MagicMock()
         self.mock_s3_object.return_value = mock_obj
-        mock_obj.copy_from.return_value = None
+        mock_obj.copy.return_value = None
         mock_obj.delete.return_value = None
 
         self.researcher = G(User, is_active=True, is_researcher=True)
@@ -155,6 +159,131 @@ class RenameVideoTestCase(APITestCase):
             f"oldfilename --> {video_filename}", api_response.content.decode("utf-8")
         )
 
+    def post_webhook(self, payload):
+        payload_str = json.dumps(payload)
+        signature = base64.b64encode(
+            hmac.new(
+                self.secret.encode("utf-8"),
+                (self.full_url + payload_str).encode("utf-8"),
+                hashlib.sha1,
+            ).digest()
+        ).decode("utf-8")
+        return self.client.post(
+            self.url,
+            data={"payload": payload_str},
+            HTTP_HOST="testserver",
+            HTTP_X_PIPE_SIGNATURE=signature,
+        )
+
+    def testRenameVideoOnlyAcknowledges(self):
+        api_response = self.post_webhook(self.payload)
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        upload = PipeUpload.objects.get()
+        self.assertEqual(upload.pipe_name, "oldfilename.mp4")
+        self.assertEqual(upload.payload, self.payload)
+        self.assertIsNone(upload.processed_at)
+        self.assertFalse(Video.objects.exists())
+        self.mock_s3_object.assert_not_called()
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def testRenameVideoProcessesUploadOnce(self):
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                api_response = self.post_webhook(self.payload)
+            self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+
+        video = Video.objects.get()
+        self.assertEqual(video.full_name, f"{self.new_video_filename}.mp4")
+        self.assertEqual(video.pipe_name, "oldfilename.mp4")
+        self.assertEqual(video.response, self.response)
+        self.assertIsNotNone(PipeUpload.objects.get().processed_at)
+        self.mock_s3_object.return_value.copy.assert_called_once()
+
+    def testRenameVideoRejectsMalformedPayload(self):
+        self.payload["data"]["payload"] = "not-a-video-name"
+        api_response = self.post_webhook(self.payload)
+        self.assertEqual(api_response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PipeUpload.objects.exists())
+
+    def testProcessPipeUploadResumesInterruptedRename(self):
+        # An earlier attempt copied the video and deleted the original, so copying fails but
+        # the video is already under its new name.
+        self.mock_s3_object.return_value.copy.side_effect = ClientError(
+            {"Error": {"Code": "404"}}, "HeadObject"
+        )
+        upload = G(PipeUpload, pipe_name="oldfilename.mp4", payload=self.payload)
+        self.assertEqual(
+            process_pipe_upload(upload.id), f"{self.new_video_filename}.mp4"
+        )
+        self.assertTrue(Video.objects.filter(pipe_name="oldfilename.mp4").exists())
+        upload.refresh_from_db()
+        self.assertIsNotNone(upload.processed_at)
+
+    def testProcessPipeUploadRecordsFailure(self):
+        self.mock_s3_object.return_value.copy.side_effect = ClientError(
+            {"Error": {"Code": "404"}}, "HeadObject"
+        )
+        self.mock_s3_object.return_value.load.side_effect = ClientError(
+            {"Error": {"Code": "404"}}, "HeadObject"
+        )
+        upload = G(PipeUpload, pipe_name="oldfilename.mp4", payload=self.payload)
+        self.assertIsNone(process_pipe_upload(upload.id))
+        self.assertFalse(Video.objects.exists())
+        upload.refresh_from_db()
+        self.assertIsNone(upload.processed_at)
+        self.assertEqual(upload.attempts, 1)
+        self.assertIn("ClientError", upload.last_error)
+
+        # Once processed, it's left alone.
+        upload.processed_at = timezone.now()
+        upload.save()
+        self.mock_s3_object.reset_mock()
+        self.assertIsNone(process_pipe_upload(upload.id))
+        self.mock_s3_object.assert_not_called()
+
+    def testProcessPipeUploadRecordsConnectionFailure(self):
+        self.mock_s3_object.return_value.copy.side_effect = EndpointConnectionError(
+            endpoint_url="https://s3.amazonaws.com"
+        )
+        upload = G(PipeUpload, pipe_name="oldfilename.mp4", payload=self.payload)
+        self.assertIsNone(process_pipe_upload(upload.id))
+        upload.refresh_from_db()
+        self.assertIsNone(upload.processed_at)
+        self.assertIsNone(upload.claimed_at)
+        self.assertEqual(upload.attempts, 1)
+        self.assertIn("EndpointConnectionError", upload.last_error)
+
+    def testProcessPipeUploadLeavesClaimedUploadsAlone(self):
+        upload = G(
+            PipeUpload,
+            pipe_name="oldfilename.mp4",
+            payload=self.payload,
+            claimed_at=timezone.now(),
+        )
+        PipeUpload.objects.filter(pk=upload.pk).update(
+            received_at=timezone.now() - PipeUpload.CLAIM_TIMEOUT
+        )
+        self.assertIsNone(process_pipe_upload(upload.id))
+        self.assertEqual(process_pending_pipe_uploads(), 0)
+        self.mock_s3_object.assert_not_called()
+
+        # A claim that's run out can be taken over.
+        PipeUpload.objects.filter(pk=upload.pk).update(
+            claimed_at=timezone.now() - PipeUpload.CLAIM_TIMEOUT
+        )
+        self.assertEqual(
+            process_pipe_upload(upload.id), f"{self.new_video_filename}.mp4"
+        )
+        upload.refresh_from_db()
+        self.assertIsNotNone(upload.processed_at)
+
+    def testPipeUploadTasksAreRoutedToAWorkerQueue(self):
+        for task in (
+            "studies.tasks.process_pipe_upload",
+            "studies.tasks.process_pending_pipe_uploads",
+        ):
+            self.assertEqual(app.amqp.router.route({}, task)["queue"].name, "cleanup")
+
     def tearDown(self):
         # Clean up the S3 patch
         self.s3_patcher.stop()
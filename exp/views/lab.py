@@ -4,7 +4,8 @@ from functools import reduce
 from django.contrib import messages
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.contrib.auth.models import Group
-from django.db.models import Q
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Exists, OuterRef, Q
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404, reverse
 from django.views import generic
@@ -90,6 +91,7 @@ class LabMembersView(
     model = Lab
     raise_exception = True
     template_name = "studies/lab_member_list.html"
+    query_budget = 15
 
     def user_can_view_lab_members(self):
         """Allow viewing members for labs you're in, and managing members if specific perms."""
@@ -138,6 +140,20 @@ class LabMembersView(
                     ),
                 )
             )
+        lab_group_ids = [group_id for group_id, label in self.lab_group_labels()]
+        queryset = queryset.annotate(
+            lab_group_ids=ArrayAgg("groups", filter=Q(groups__in=lab_group_ids)),
+            in_lab=Exists(
+                Lab.researchers.through.objects.filter(
+                    lab_id=lab.pk, user_id=OuterRef("pk")
+                )
+            ),
+            requested_to_join=Exists(
+                Lab.requested_researchers.through.objects.filter(
+                    lab_id=lab.pk, user_id=OuterRef("pk")
+                )
+            ),
+        )
         queryset = queryset.order_by("family_name")
         queryset = self.paginated_queryset(queryset, query_dict.get("page", 1), 20)
 
@@ -149,22 +165,29 @@ class LabMembersView(
             for user in qs
         ]
 
+    def lab_group_labels(self):
+        """Lab group ids from highest- to lowest-level, with their labels."""
+        lab = self.get_object()
+        return [
+            (lab.admin_group_id, "Admin"),
+            (lab.member_group_id, "Member"),
+            (lab.readonly_group_id, "View"),
+            (lab.guest_group_id, "Guest"),
+        ]
+
     def get_group_label(self, member):
         """
         Returns a label for the highest-level LabGroup a member is in with respect to this lab.
+
+        Uses the lab_group_ids, in_lab and requested_to_join annotations from get_lab_members.
         """
-        lab = self.get_object()
-        if member in lab.admin_group.user_set.all():
-            return "Admin"
-        elif member in lab.member_group.user_set.all():
-            return "Member"
-        elif member in lab.readonly_group.user_set.all():
-            return "View"
-        elif member in lab.guest_group.user_set.all():
-            return "Guest"
-        elif member in lab.researchers.all():
+        group_ids = member.lab_group_ids or ()
+        for group_id, label in self.lab_group_labels():
+            if group_id in group_ids:
+                return label
+        if member.in_lab:
             return "No groups"
-        elif member in lab.requested_researchers.all():
+        elif member.requested_to_join:
             return "Requested to join"
         else:
             return "Not in this lab"
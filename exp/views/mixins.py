@@ -7,13 +7,14 @@ from django.contrib.auth.models import AnonymousUser
 from django.core.handlers.wsgi import WSGIRequest
 from django.db.models import Model, QuerySet
 from django.http.response import HttpResponseForbidden, HttpResponseRedirect
-from django.shortcuts import get_object_or_404, redirect
+from django.shortcuts import redirect
 from django.urls import reverse
+from django.views.generic.detail import SingleObjectMixin
 from guardian.mixins import LoginRequiredMixin
 
 from accounts.backends import TWO_FACTOR_AUTH_SESSION_KEY
 from accounts.models import User
-from studies.models import Lab, Response, Study
+from studies.models import Lab, Response, Study, lab_cache, study_cache
 from studies.permissions import StudyPermission
 
 LookitUser = Union[User, AnonymousUser]
@@ -88,7 +89,7 @@ class ResearcherLoginRequiredMixin(LookitHandlerBase, LoginRequiredMixin):
 class StudyLookupMixin(LookitHandlerBase):
     @cached_property
     def study(self):
-        return get_object_or_404(Study, pk=self.kwargs.get("pk"))
+        return study_cache.get_or_404(pk=self.kwargs.get("pk"))
 
 
 class CanViewStudyResponsesMixin(
@@ -121,5 +122,22 @@ class SingleObjectFetchProtocol(Protocol[ModelType]):
         """
         if getattr(self, "object", None) is None:
             # Only call get_object() when self.object isn't present.
-            self.object: ModelType = super().get_object(queryset)
+            self.object: ModelType = self._get_cached_object(
+                queryset
+            ) or super().get_object(queryset)
         return self.object
+
+    def _get_cached_object(self, queryset):
+        """Get the object from its model's cache, if the view looks it up by pk alone."""
+        pk = getattr(self, "kwargs", {}).get(self.pk_url_kwarg)
+        if (
+            pk is None
+            or queryset is not None
+            or type(self).get_queryset is not SingleObjectMixin.get_queryset
+            or (self.queryset is not None and self.queryset.query.has_filters())
+        ):
+            return None
+
+        model = self.model if self.queryset is None else self.queryset.model
+        model_cache = {Lab: lab_cache, Study: study_cache}.get(model)
+        return model_cache.get_or_404(pk=pk) if model_cache else None
@@ -29,6 +29,7 @@ from django.views.generic.detail import SingleObjectMixin
 from django.views.generic.list import MultipleObjectMixin
 
 from accounts.utils import hash_child_id, hash_id, hash_participant_id
+from exp.mixins.paginator_mixin import KeysetPaginatorMixin
 from exp.utils import (
     RESPONSE_PAGE_SIZE,
     csv_dict_output_and_writer,
@@ -838,6 +839,7 @@ class StudyResponsesList(CanViewStudyResponsesMixin, generic.ListView):
 
     template_name = "studies/study_responses.html"
     model = Response
+    query_budget = 20
 
     def get_queryset(self):
         study = self.study
@@ -1905,7 +1907,9 @@ class StudyCollisionCheck(ResponseDownloadMixin, View):
         return JsonResponse({"collisions": collision_text})
 
 
-class StudyAttachments(CanViewStudyResponsesMixin, generic.ListView):
+class StudyAttachments(
+    CanViewStudyResponsesMixin, KeysetPaginatorMixin, generic.ListView
+):
     """
     StudyAttachments View shows video attachments for the study
     """
@@ -1913,9 +1917,11 @@ class StudyAttachments(CanViewStudyResponsesMixin, generic.ListView):
     template_name = "studies/study_attachments.html"
     model = Video
     paginate_by = 100
+    orderings = ("full_name", "-full_name", "created_at", "-created_at")
 
     def get_ordering(self):
-        return self.request.GET.get("sort", "-created_at") or "-created_at"
+        sort = self.request.GET.get("sort")
+        return sort if sort in self.orderings else "-created_at"
 
     def get_queryset(self):
         """Fetches all consented videos this user has access to.
@@ -1942,7 +1948,7 @@ class StudyAttachments(CanViewStudyResponsesMixin, generic.ListView):
         match = self.request.GET.get("match", "")
         if match:
             videos = videos.filter(full_name__icontains=match)
-        return videos.order_by(self.get_ordering())
+        return videos
 
     def get_context_data(self, **kwargs):
         """
@@ -15,7 +15,7 @@ from django.http import (
     HttpResponseForbidden,
     HttpResponseRedirect,
 )
-from django.shortcuts import get_object_or_404, redirect, reverse
+from django.shortcuts import redirect, reverse
 from django.views import generic
 from django.views.generic.detail import SingleObjectMixin
 from revproxy.views import ProxyView
@@ -42,7 +42,7 @@ from studies.helpers import (
     get_experiment_absolute_url,
     send_mail,
 )
-from studies.models import Study, StudyType
+from studies.models import Study, StudyType, study_cache
 from studies.permissions import LabPermission, StudyPermission
 from studies.queries import get_study_list_qs
 from studies.tasks import ember_build_and_gcp_deploy
@@ -470,21 +470,14 @@ class StudyDetailView(
 
         Not showing Lab admin & Lab read in this list (even though they technically can view the project)
         """
-        study = self.get_object()
-        all_study_users = reduce(
-            lambda x, y: (x | y),
-            [group.user_set.all() for group in study.all_study_groups()],
-            User.objects.none(),
-        )
-        return all_study_users
+        return self.get_object().researchers_with_study_groups()
 
     def get_annotated_study_researchers(self):
         """Gets current study researchers and their highest-level study-specific perm descriptions"""
         study = self.get_object()
-        study_researchers = self.get_study_researchers()
         return [
-            {"current_group": study.get_group_of_researcher(user), "user": user}
-            for user in study_researchers
+            {"current_group": study.group_label(user.study_group_ids), "user": user}
+            for user in self.get_study_researchers()
         ]
 
     def search_researchers(self):
@@ -874,7 +867,7 @@ class StudyPreviewDetailView(
         study by uuid.
         """
         uuid = self.kwargs.get("uuid")
-        return get_object_or_404(Study, uuid=uuid)
+        return study_cache.get_or_404(uuid=uuid)
 
     def get_context_data(self, **kwargs):
         """If user is authenticated, add demographic, children, and response data.
@@ -983,7 +976,7 @@ class PreviewProxyView(
             return False
 
         try:
-            study = Study.objects.get(uuid=kwargs.get("uuid", None))
+            study = study_cache.get(uuid=kwargs.get("uuid", None))
         except Study.DoesNotExist:
             return False
 
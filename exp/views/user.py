@@ -86,6 +86,7 @@ class ParticipantDetailView(
 
     fields = ("is_active",)
     template_name = "accounts/participant_detail.html"
+    query_budget = 25
 
     def can_see_participant_detail(self):
         return self.request.user.is_researcher
@@ -115,7 +116,7 @@ class ParticipantDetailView(
         resps = (
             self.valid_responses()
             .filter(child__user=self.get_object())
-            .select_related("child__user")
+            .select_related("child__user", "study")
         )
         orderby = self.request.GET.get("sort", "-date_created")
         if orderby:
@@ -2,26 +2,28 @@ import base64
 import hashlib
 import hmac
 import json
+from functools import partial
 
-from botocore.exceptions import ClientError
 from django.conf import settings
+from django.db import transaction
 from django.http import (
     HttpResponse,
     HttpResponseBadRequest,
     HttpResponseForbidden,
-    HttpResponseNotFound,
 )
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 
-from studies.models import Video
+from studies.models import PipeUpload, Video
+from studies.tasks import process_pipe_upload
 
 
 class RenameVideoView(View):
     """
     Webhook handler for Pipe webhook that fires upon uploading to S3, so we can rename
     video to the intended permanent name instead of the random string assigned by Pipe.
+    The upload is recorded as a PipeUpload and renamed by the process_pipe_upload task.
     """
 
     @method_decorator(csrf_exempt)
@@ -64,18 +66,24 @@ class RenameVideoView(View):
                     return HttpResponseForbidden()
 
                 try:
-                    video_obj = Video.from_pipe_payload(payload_data)
-                    return HttpResponse(
-                        (
-                            payload_data["data"]["videoName"]
-                            + " --> "
-                            + video_obj.filename
-                        )
-                        if video_obj
-                        else "Preview video not saved"
+                    old_pipe_name, new_full_name, _ = Video.pipe_file_names(
+                        payload_data["data"]
                     )
-                except ClientError as e:
-                    return HttpResponseNotFound(e)
+                except ValueError:
+                    return HttpResponseBadRequest(
+                        f"Could not parse video filename {new_name}"
+                    )
+
+                # Acknowledge right away, and rename the video and create its Video in a
+                # worker. Pipe retries webhooks it doesn't hear back about in time.
+                upload, _ = PipeUpload.objects.get_or_create(
+                    pipe_name=old_pipe_name, defaults={"payload": payload_data}
+                )
+                if upload.processed_at is None:
+                    transaction.on_commit(partial(process_pipe_upload.delay, upload.id))
+                return HttpResponse(
+                    payload_data["data"]["videoName"] + " --> " + new_full_name
+                )
 
             else:  # Not authenticated
                 return HttpResponseForbidden()
@@ -0,0 +1,80 @@
+"""Read-through caches for rows that are read on most requests and rarely change.
+
+A ModelCache holds copies of one model's rows, looked up by primary key or by one of a few
+unique fields. Every entry's key includes a version token for the model; invalidate() replaces
+the token, so one save or delete retires every cached row of that model at once (including
+lookups by a slug or uuid the row no longer has). Receivers for post_save/post_delete call
+invalidate(); queryset .update() and .delete() bypass them, so don't use those on cached models.
+
+Hits and misses are counted per process; see cache_stats().
+"""
+
+import threading
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def cache_stats():
+    """Snapshot of this process's hit and miss counts, by model label."""
+    with _stats_lock:
+        return {label: dict(counts) for label, counts in _stats.items()}
+
+
+class ModelCache:
+    def __init__(self, model, lookups=("pk",)):
+        self.model = model
+        self.lookups = lookups
+        self.label = model._meta.label
+        self.version_key = f"model-cache-version:{self.label}"
+        with _stats_lock:
+            _stats[self.label] = {"hits": 0, "misses": 0}
+
+    def version(self) -> str:
+        return cache.get_or_set(self.version_key, lambda: uuid4().hex, None)
+
+    def _new_version(self):
+        cache.set(self.version_key, uuid4().hex, None)
+
+    def invalidate(self):
+        """Retire all cached rows.
+
+        Done again when the current transaction commits, so copies of the old row that other
+        requests cache before then aren't kept.
+        """
+        self._new_version()
+        transaction.on_commit(self._new_version)
+
+    def get(self, **lookup):
+        """Get the row matching a single lookup, e.g. get(uuid=...).
+
+        Returns a fresh copy of the row each call, so callers may modify it.
+
+        Raises:
+            model.DoesNotExist: No row matches; misses aren't cached.
+        """
+        ((field, value),) = lookup.items()
+        if field not in self.lookups:
+            raise ValueError(f"{self.label} rows aren't cached by {field}")
+
+        key = f"model-cache:{self.label}:{self.version()}:{field}:{value}"
+        instance = cache.get(key)
+        with _stats_lock:
+            _stats[self.label]["misses" if instance is None else "hits"] += 1
+        if instance is None:
+            instance = self.model._default_manager.get(**lookup)
+            cache.set(key, instance, settings.MODEL_CACHE_TIMEOUT)
+        return instance
+
+    def get_or_404(self, **lookup):
+        """Like get(), but raise Http404 if no row matches, as get_object_or_404 does."""
+        try:
+            return self.get(**lookup)
+        except self.model.DoesNotExist:
+            raise Http404(f"No {self.model._meta.object_name} matches the given query.")
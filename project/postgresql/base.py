@@ -0,0 +1,111 @@
+"""PostgreSQL backend that keeps metrics on persistent connections.
+
+Connections are reused across requests and tasks for up to CONN_MAX_AGE seconds, and health
+checked before each reuse when CONN_HEALTH_CHECKS is on (see DATABASES in project/settings.py).
+This records how often connections are opened, checked out again and reused, how long opening
+one and checking one out take, and how many fail their health check. The numbers are per
+process. With DB_CONNECTION_METRICS on, the running totals are logged whenever a connection is
+opened and at the end of every request and Celery task.
+
+Under gevent (GEVENT=1) CONN_MAX_AGE is always 0, so connections are never reused and only the
+opened connection counts and times mean anything there.
+"""
+
+import logging
+import threading
+import time
+
+from celery.signals import task_postrun
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections
+from django.db.backends.postgresql import base
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "connections_opened": 0,
+    "connect_seconds_total": 0.0,
+    "connect_seconds_max": 0.0,
+    "checkouts": 0,
+    "checkout_seconds_total": 0.0,
+    "checkout_seconds_max": 0.0,
+    "connections_reused": 0,
+    "health_check_failures": 0,
+}
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            if key.endswith("_max"):
+                _stats[key] = max(_stats[key], value)
+            else:
+                _stats[key] += value
+
+
+def connection_stats():
+    """Snapshot of this process's connection metrics.
+
+    open_connections counts this thread's open connections, i.e. the size of its "pool".
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["open_connections"] = sum(
+        1
+        for connection in connections.all(initialized_only=True)
+        if connection.connection is not None
+    )
+    return stats
+
+
+def log_connection_stats(message, *args):
+    if settings.DB_CONNECTION_METRICS:
+        logger.info(message, *args, extra={"db_connection_stats": connection_stats()})
+
+
+@receiver(request_finished)
+def log_request_connection_stats(sender, **kwargs):
+    log_connection_stats("Database connections after request")
+
+
+@receiver(task_postrun)
+def log_task_connection_stats(sender=None, task=None, **kwargs):
+    log_connection_stats("Database connections after task %s", task and task.name)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def connect(self):
+        start = time.monotonic()
+        super().connect()
+        elapsed = time.monotonic() - start
+        _record(
+            connections_opened=1,
+            connect_seconds_total=elapsed,
+            connect_seconds_max=elapsed,
+        )
+        log_connection_stats(
+            "Opened database connection %s in %.1fms", self.alias, elapsed * 1000
+        )
+
+    def close_if_health_check_failed(self):
+        if (
+            self.connection is None
+            or not self.health_check_enabled
+            or self.health_check_done
+        ):
+            return
+
+        start = time.monotonic()
+        super().close_if_health_check_failed()
+        elapsed = time.monotonic() - start
+        reused = self.connection is not None
+        _record(
+            checkouts=1,
+            checkout_seconds_total=elapsed,
+            checkout_seconds_max=elapsed,
+            connections_reused=int(reused),
+            health_check_failures=int(not reused),
+        )
@@ -0,0 +1,164 @@
+"""Per-request SQL profiling and query budgets for views.
+
+When QUERY_PROFILING is on, QueryProfilingMiddleware counts each request's queries, their total
+time and any statement run more than once (the usual sign of an N+1 pattern). It reports them in
+X-Query-* response headers and logs them. Views can declare a `query_budget`, the most queries one
+request should take; going over it is logged as a warning, and QueryBudgetTestMixin fails tests
+for it.
+"""
+
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+logger = logging.getLogger(__name__)
+
+# How many of the most repeated statements to report.
+REPEATED_STATEMENTS_REPORTED = 5
+
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r"\b\d+(?:\.\d+)?\b")
+_value_list = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+
+
+def fingerprint(sql):
+    """Normalize a statement so that runs differing only in their parameters compare equal."""
+    sql = _string_literal.sub("?", sql)
+    sql = _number_literal.sub("?", sql)
+    return _value_list.sub("(...)", sql)
+
+
+class QueryProfile:
+    """Queries made while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    @classmethod
+    def from_captured_queries(cls, captured_queries):
+        profile = cls()
+        for query in captured_queries:
+            profile.record(query["sql"], float(query["time"]))
+        return profile
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.fingerprints[fingerprint(sql)] += 1
+
+    def __call__(self, execute, sql, params, many, context):
+        """Execute wrapper; see django.db.backends.base.base.BaseDatabaseWrapper.execute_wrapper."""
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.monotonic() - start)
+
+    @property
+    def repeated(self):
+        """The most repeated statements, as (fingerprint, times run) pairs."""
+        return [
+            (statement, times)
+            for statement, times in self.fingerprints.most_common(
+                REPEATED_STATEMENTS_REPORTED
+            )
+            if times > 1
+        ]
+
+
+def get_query_budget(view_func):
+    view_class = getattr(view_func, "view_class", None)
+    return getattr(view_class, "query_budget", None)
+
+
+class QueryProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.QUERY_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = QueryProfile()
+        with ExitStack() as stack:
+            for db in connections.all():
+                stack.enter_context(db.execute_wrapper(profile))
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        view_name = match.view_name if match else None
+        budget = get_query_budget(match.func) if match else None
+        over_budget = budget is not None and profile.count > budget
+
+        response["X-Query-Count"] = str(profile.count)
+        response["X-Query-Time-Ms"] = f"{profile.duration * 1000:.1f}"
+        response["X-Query-Repeated"] = str(
+            sum(times - 1 for times in profile.fingerprints.values())
+        )
+        if budget is not None:
+            response["X-Query-Budget"] = str(budget)
+
+        logger.log(
+            logging.WARNING if over_budget else logging.INFO,
+            "%s %s made %d queries in %.1fms",
+            request.method,
+            view_name or request.path,
+            profile.count,
+            profile.duration * 1000,
+            extra={
+                "query_profile": {
+                    "method": request.method,
+                    "path": request.path,
+                    "view": view_name,
+                    "query_count": profile.count,
+                    "query_time_ms": round(profile.duration * 1000, 1),
+                    "query_budget": budget,
+                    "over_budget": over_budget,
+                    "repeated": [
+                        {"statement": statement, "count": times}
+                        for statement, times in profile.repeated
+                    ],
+                }
+            },
+        )
+        return response
+
+
+class QueryBudgetTestMixin:
+    """TestCase mixin for checking that views stay within their declared query_budget."""
+
+    def assertWithinQueryBudget(self, url, method="get", **kwargs):
+        """Request url with the test client and fail if its view goes over budget.
+
+        Returns:
+            The response.
+        """
+        view_func = resolve(urlparse(url).path).func
+        view_name = getattr(view_func, "view_class", view_func).__name__
+        budget = get_query_budget(view_func)
+        if budget is None:
+            self.fail(f"{view_name} does not declare a query_budget")
+
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(url, **kwargs)
+
+        profile = QueryProfile.from_captured_queries(captured.captured_queries)
+        if profile.count > budget:
+            repeated = "\n".join(
+                f"  {times}x {statement}" for statement, times in profile.repeated
+            )
+            self.fail(
+                f"{view_name} made {profile.count} queries, over its budget of "
+                f"{budget}. Most repeated statements:\n{repeated or '  (none)'}"
+            )
+        return response
@@ -1,24 +1,115 @@
 import base64
+import re
 from email.mime.base import MIMEBase
 from email.utils import parseaddr
+from urllib.error import HTTPError
 
 from django.core.mail import EmailMultiAlternatives
+from django.core.mail.backends.base import BaseEmailBackend
+from more_itertools import chunked
 from sendgrid.helpers.mail import (
     Attachment,
     Category,
     Content,
     CustomArg,
     Email,
+    Header,
     Mail,
     Personalization,
     Substitution,
 )
 from sgbackend import SendGridBackend
 
+# SendGrid accepts at most this many personalizations in a single mail send request.
+MAX_PERSONALIZATIONS_PER_REQUEST = 1000
+
+
+def substitute(text, substitutions):
+    """Replace each substitution key in text with its value, in a single pass."""
+    if not substitutions:
+        return text
+    pattern = re.compile("|".join(map(re.escape, substitutions)))
+    return pattern.sub(lambda match: substitutions[match.group(0)], text)
+
+
+class PersonalizedEmailMessage(EmailMultiAlternatives):
+    """One email sent to many recipients, each with their own subject, substitutions and headers.
+
+    Each personalization is a dict with "to" (a single address) and optional "subject",
+    "substitutions" and "headers". Substitution keys in the body and alternatives are replaced
+    with the recipient's values. LookitSendGridBackend delivers the recipients in batches of
+    MAX_PERSONALIZATIONS_PER_REQUEST per request; any other backend gets one email per recipient.
+    """
+
+    def __init__(
+        self, subject="", body="", from_email=None, personalizations=(), **kwargs
+    ):
+        super().__init__(subject, body, from_email, **kwargs)
+        self.personalizations = list(personalizations)
+
+    def recipients(self):
+        return [personalization["to"] for personalization in self.personalizations]
+
+    def personalized(self):
+        """Yield the equivalent individual email for each recipient."""
+        for personalization in self.personalizations:
+            substitutions = personalization.get("substitutions", {})
+            email = EmailMultiAlternatives(
+                personalization.get("subject", self.subject),
+                substitute(self.body, substitutions),
+                self.from_email,
+                [personalization["to"]],
+                attachments=self.attachments,
+                headers={**self.extra_headers, **personalization.get("headers", {})},
+                reply_to=self.reply_to,
+                connection=self.connection,
+            )
+            for content, mimetype in self.alternatives:
+                email.attach_alternative(substitute(content, substitutions), mimetype)
+            yield email
+
+    def send(self, fail_silently=False):
+        if not self.personalizations:
+            return 0
+        connection = self.get_connection(fail_silently)
+        if getattr(connection, "supports_personalizations", False):
+            return connection.send_messages([self])
+        return connection.send_messages(list(self.personalized()))
+
 
 class LookitSendGridBackend(SendGridBackend):
-    def _build_sg_mail(self, email):
-        """Custom SG email builder that handles image attachment correctly to allow inline images."""
+    supports_personalizations = True
+
+    def send_messages(self, emails):
+        """Send each email, splitting personalized emails into as few requests as possible."""
+        if not emails:
+            return
+
+        count = 0
+        for email in emails:
+            try:
+                if isinstance(email, PersonalizedEmailMessage):
+                    for personalizations in chunked(
+                        email.personalizations, MAX_PERSONALIZATIONS_PER_REQUEST
+                    ):
+                        self._send_request(self._build_sg_mail(email, personalizations))
+                else:
+                    self._send_request(self._build_sg_mail(email))
+                count += 1
+            except HTTPError:
+                if not self.fail_silently:
+                    raise
+        return count
+
+    def _send_request(self, request_body):
+        self.sg.client.mail.send.post(request_body=request_body)
+
+    def _build_sg_mail(self, email, personalizations=None):
+        """Custom SG email builder that handles image attachment correctly to allow inline images.
+
+        If personalizations are given, they replace the single personalization built from the
+        email's to, cc and bcc addresses.
+        """
 
         ############# FROM SendGridBackend._build_sg_mail: ############################################################
         mail = Mail()
@@ -126,5 +217,36 @@ class LookitSendGridBackend(SendGridBackend):
                 mail.add_attachment(attach)
 
         ############# FROM SendGridBackend._build_sg_mail: #############################################################
-        mail.add_personalization(personalization)
+        if personalizations is None:
+            mail.add_personalization(personalization)
+        else:
+            for recipient in personalizations:
+                mail.add_personalization(
+                    self._build_sg_personalization(email, recipient)
+                )
         return mail.get()
+
+    def _build_sg_personalization(self, email, recipient):
+        personalization = Personalization()
+        personalization.add_to(Email(recipient["to"]))
+        personalization.set_subject(recipient.get("subject", email.subject))
+        for key, value in recipient.get("substitutions", {}).items():
+            personalization.add_substitution(Substitution(key, value))
+        for key, value in recipient.get("headers", {}).items():
+            personalization.add_header(Header(key, value))
+        return personalization
+
+
+class FakeSendGridBackend(LookitSendGridBackend):
+    """Builds SendGrid requests like LookitSendGridBackend, but keeps them in `requests` instead.
+
+    For tests; clear `FakeSendGridBackend.requests` between uses.
+    """
+
+    requests = []
+
+    def __init__(self, fail_silently=False, **kwargs):
+        BaseEmailBackend.__init__(self, fail_silently=fail_silently, **kwargs)
+
+    def _send_request(self, request_body):
+        FakeSendGridBackend.requests.append(request_body)
@@ -10,7 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 from pathlib import Path
 
 from django.contrib.messages import constants as messages
@@ -65,6 +69,25 @@ JSPSYCH_S3_SECRET_ACCESS_KEY = os.environ.get(
     "JSPSYCH_S3_SECRET_ACCESS_KEY", "abcdefghijklmnopqrstuvwxyz01234567891012"
 )
 JSPSYCH_S3_BUCKET = os.environ.get("JSPSYCH_S3_BUCKET", "fakeBucketName")
+# Videos downloaded at once when building a video zip, and how much of each is held in memory
+# (in bytes) before the rest is spooled to a temporary file.
+VIDEO_ZIP_DOWNLOAD_WORKERS = int(os.environ.get("VIDEO_ZIP_DOWNLOAD_WORKERS", 8))
+VIDEO_ZIP_SPOOL_MAX_SIZE = int(
+    os.environ.get("VIDEO_ZIP_SPOOL_MAX_SIZE", 16 * 1024 * 1024)
+)
+# Build video zips from per-video objects kept in GCS (see studies.video_archives), so that new
+# archives of a study only upload videos that earlier archives didn't include. Off by default,
+# which streams each archive from scratch.
+VIDEO_ZIP_INCREMENTAL = bool(os.environ.get("VIDEO_ZIP_INCREMENTAL", False))
+# Threads that complete incomplete video uploads, and how many of them may work in one bucket at
+# once (see studies.tasks.cleanup_incomplete_video_uploads).
+VIDEO_UPLOAD_RECOVERY_WORKERS = int(os.environ.get("VIDEO_UPLOAD_RECOVERY_WORKERS", 8))
+VIDEO_UPLOAD_RECOVERY_BUCKET_CONCURRENCY = int(
+    os.environ.get("VIDEO_UPLOAD_RECOVERY_BUCKET_CONCURRENCY", 4)
+)
+# Files uploaded at once when deploying a built study (see
+# studies.experiment_builder.deploy_to_remote).
+EXPERIMENT_DEPLOY_WORKERS = int(os.environ.get("EXPERIMENT_DEPLOY_WORKERS", 8))
 
 # Application definition
 
@@ -113,8 +136,12 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "project.query_profiling.QueryProfilingMiddleware",
 ]
 
+# Report each request's query count, SQL time and repeated statements in X-Query-* headers and logs.
+QUERY_PROFILING = bool(os.environ.get("QUERY_PROFILING", False))
+
 if DEBUG:
     MIDDLEWARE += ["pyinstrument.middleware.ProfilerMiddleware"]
 else:
@@ -167,10 +194,35 @@ WSGI_APPLICATION = "project.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/1.9/ref/settings/#databases
 
+# Database connections are kept open and reused for up to DB_CONN_MAX_AGE seconds, with a health
+# check before each reuse. Web and Celery processes can be tuned separately: PROCESS_ROLE is "web"
+# or "worker", and DB_WEB_CONN_MAX_AGE / DB_WORKER_CONN_MAX_AGE override the shared default.
+# Celery's Django integration drops connections inherited across fork and closes any that are past
+# their max age before and after each task. Set DB_USE_PGBOUNCER when connecting through pgbouncer
+# in transaction pooling mode, which can't hold server-side cursors open between transactions.
+# Under gevent (GEVENT=1) Django keeps a connection per greenlet, so persistent connections would
+# pile up until Postgres runs out; connections are always closed after each request there.
+PROCESS_ROLE = os.environ.get("PROCESS_ROLE", "web")
+if os.environ.get("GEVENT") == "1":
+    DB_CONN_MAX_AGE = 0
+else:
+    DB_CONN_MAX_AGE = int(
+        os.environ.get(
+            f"DB_{PROCESS_ROLE.upper()}_CONN_MAX_AGE",
+            os.environ.get("DB_CONN_MAX_AGE", 60),
+        )
+    )
+DB_USE_PGBOUNCER = bool(os.environ.get("DB_USE_PGBOUNCER", False))
+# Log each process's connection metrics (see project/postgresql) when a connection is opened and
+# after every request and task.
+DB_CONNECTION_METRICS = bool(os.environ.get("DB_CONNECTION_METRICS", False))
+
 DATABASES = {
     "default": {
-        "CONN_MAX_AGE": 0,
-        "ENGINE": "django.db.backends.postgresql",  # django.db.backends.postgresql
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "DISABLE_SERVER_SIDE_CURSORS": DB_USE_PGBOUNCER,
+        "ENGINE": "project.postgresql",  # django.db.backends.postgresql, with connection metrics
         "NAME": os.environ.get("DB_NAME", "lookit"),
         "USER": os.environ.get("DB_USER", "postgres"),
         "PASSWORD": os.environ.get("DB_PASSWORD", ""),
@@ -180,6 +232,29 @@ DATABASES = {
     }
 }
 
+# Shared cache. Use Redis when REDIS_URL is set (e.g. redis://127.0.0.1:6379/0), so all web and
+# worker processes share entries and invalidations. Cached rows, permissions and study lists are
+# invalidated by signals in whichever process makes the change, so a per-process cache would keep
+# serving stale entries in the others: without Redis, only the single-process dev server (DEBUG)
+# and tests use a local-memory cache, and anything else caches nothing.
+REDIS_URL = os.environ.get("REDIS_URL")
+TESTING = sys.argv[1:2] == ["test"]
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": "lookit",
+        }
+    }
+elif DEBUG or TESTING:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+# How long (in seconds) rows cached by project.model_cache.ModelCache are kept.
+MODEL_CACHE_TIMEOUT = int(os.environ.get("MODEL_CACHE_TIMEOUT", 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -327,8 +402,13 @@ else:
 
     GS_BUCKET_NAME = None
     GS_PROJECT_ID = None
+    GS_PRIVATE_BUCKET_NAME = None
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media/")
+if TESTING:
+    # Write files uploaded by tests to a throwaway directory instead of the source tree.
+    MEDIA_ROOT = tempfile.mkdtemp(prefix="lookit-test-media-")
+    atexit.register(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 EMAIL_FROM_ADDRESS = os.environ.get("EMAIL_FROM_ADDRESS", "lookit.robot@some.domain")
@@ -377,8 +457,13 @@ CELERY_TASK_ROUTES = {
     "studies.tasks.build_zipfile_of_videos": {"queue": "builds"},
     "studies.tasks.build_framedata_dict": {"queue": "builds"},
     "studies.tasks.delete_video_from_cloud": {"queue": "cleanup"},
+    "studies.tasks.delete_pending_videos": {"queue": "cleanup"},
+    "studies.tasks.reconcile_study_stats": {"queue": "cleanup"},
+    "studies.tasks.process_pipe_upload": {"queue": "cleanup"},
+    "studies.tasks.process_pending_pipe_uploads": {"queue": "cleanup"},
     "studies.tasks.cleanup*": {"queue": "cleanup"},
     "studies.helpers.send_mail": {"queue": "email"},
+    "studies.helpers.send_personalized_mail": {"queue": "email"},
     "studies.tasks.send_announcement_emails": {"queue": "email"},
 }
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
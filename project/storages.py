@@ -1,3 +1,6 @@
+import os
+
+from django.core.files.storage import FileSystemStorage
 from storages.backends.gcloud import GoogleCloudStorage
 
 from project import settings
@@ -12,3 +15,16 @@ class LowercaseGoogleCloudStorage(GoogleCloudStorage):
 
 class LookitExperimentStorage(LowercaseGoogleCloudStorage):
     location = settings.EXPERIMENT_LOCATION
+
+
+class LocalExperimentStorage(FileSystemStorage):
+    """Experiment storage on the local filesystem, e.g. for tests. Like
+    LookitExperimentStorage, saving a file replaces any file of the same name."""
+
+    def __init__(self, location=None, **kwargs):
+        kwargs.setdefault("allow_overwrite", True)
+        super().__init__(
+            location=location
+            or os.path.join(settings.MEDIA_ROOT, settings.EXPERIMENT_LOCATION),
+            **kwargs,
+        )
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.db import connections
+from django.test import TestCase, override_settings
+
+from project.postgresql.base import (
+    connection_stats,
+    log_request_connection_stats,
+    log_task_connection_stats,
+)
+
+
+class DatabaseConnectionMetricsTestCase(TestCase):
+    def setUp(self):
+        # A connection of its own, outside the test case's transaction, so it can be closed.
+        self.connection = connections.create_connection("default")
+        self.addCleanup(self.connection.close)
+
+    def assertStatsChanged(self, before, **changes):
+        after = connection_stats()
+        for key in ("connections_opened", "checkouts", "connections_reused"):
+            self.assertEqual(after[key] - before[key], changes.get(key, 0), key)
+        self.assertEqual(
+            after["health_check_failures"] - before["health_check_failures"],
+            changes.get("health_check_failures", 0),
+        )
+
+    def test_opening_a_connection_is_counted(self):
+        before = connection_stats()
+        self.connection.connect()
+        self.assertStatsChanged(before, connections_opened=1)
+
+    def test_reusing_a_connection_is_counted(self):
+        self.connection.connect()
+        before = connection_stats()
+
+        # As at the start of the next request or task.
+        self.connection.health_check_done = False
+        self.connection.close_if_health_check_failed()
+        self.assertIsNotNone(self.connection.connection)
+        self.assertStatsChanged(before, checkouts=1, connections_reused=1)
+
+        # It's only checked once per request or task.
+        self.connection.close_if_health_check_failed()
+        self.assertStatsChanged(before, checkouts=1, connections_reused=1)
+
+    def test_health_check_failures_are_counted(self):
+        self.connection.connect()
+        before = connection_stats()
+
+        self.connection.health_check_done = False
+        with mock.patch.object(self.connection, "is_usable", return_value=False):
+            self.connection.close_if_health_check_failed()
+        self.assertIsNone(self.connection.connection)
+        self.assertStatsChanged(before, checkouts=1, health_check_failures=1)
+
+    @override_settings(DB_CONNECTION_METRICS=True)
+    def test_stats_are_logged_after_requests_and_tasks(self):
+        with self.assertLogs("project.postgresql.base", "INFO") as logs:
+            log_request_connection_stats(sender=None)
+            log_task_connection_stats(
+                sender=None, task=SimpleNamespace(name="studies.tasks.some_task")
+            )
+
+        self.assertEqual(
+            [record.getMessage() for record in logs.records],
+            [
+                "Database connections after request",
+                "Database connections after task studies.tasks.some_task",
+            ],
+        )
+        for record in logs.records:
+            self.assertEqual(
+                record.db_connection_stats.keys(), connection_stats().keys()
+            )
+
+    def test_stats_are_not_logged_by_default(self):
+        with self.assertNoLogs("project.postgresql.base", "INFO"):
+            self.connection.connect()
+            log_request_connection_stats(sender=None)
@@ -1,10 +1,16 @@
+import fcntl
+import hashlib
 import inspect
 import json
 import logging
 import os
 import re
+import shutil
+import tempfile
+import uuid
 import zipfile
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from operator import attrgetter
 from typing import NamedTuple, Sequence
 
@@ -12,6 +18,7 @@ import docker
 import requests
 from django.conf import settings
 from django.core.files import File
+from django.core.files.base import ContentFile
 
 from project import storages
 from studies.helpers import send_mail
@@ -142,14 +149,31 @@ class ExperimentBuilder:
             raise BuildError(f"Failure at {current_stage}\nLogs:\n{stage_log.logs}.")
 
 
+# Stands in for the study UUID in cached player builds; as long as a UUID, so that rewriting
+# it with a study's doesn't move anything in the files (or their source maps).
+CACHED_BUILD_STUDY_UUID = "cached-player-build-study-uuid-00000"
+
+# Files of the build image, which go into every player build.
+BUILD_IMAGE_FILES = ("Dockerfile", "build.sh", "environment")
+
+
 class EmberFrameplayerBuilder(ExperimentBuilder):
-    """Builds Ember Frameplayer experiments."""
+    """Builds Ember Frameplayer experiments.
+
+    Compiled players are cached by frame player SHA (and the build image and environment),
+    with CACHED_BUILD_STUDY_UUID in place of the study UUID in their asset paths. Only the
+    first study build for a SHA runs ember; the rest copy the cached build and put their
+    UUID in.
+    """
 
     DEFAULT_CONTEXT = {
         "local_paths": DirectoryTargets(
             checkouts=os.path.join(settings.EMBER_BUILD_ROOT_PATH, "checkouts"),
             deployments=os.path.join(settings.EMBER_BUILD_ROOT_PATH, "deployments"),
         ),
+        "player_cache_path": os.path.join(
+            settings.EMBER_BUILD_ROOT_PATH, "player_cache"
+        ),
         "update_fields": [],
     }
 
@@ -157,9 +181,8 @@ class EmberFrameplayerBuilder(ExperimentBuilder):
         "get_study",
         "get_researcher",
         "get_player_sha",
-        "build_docker_image",
-        "get_container_directories",
-        "run_docker_container",
+        "get_player_build",
+        "prepare_deployment",
         "deploy_study",
         "save_study_and_log_results",
     )
@@ -183,12 +206,54 @@ class EmberFrameplayerBuilder(ExperimentBuilder):
         self.build_context["researcher"] = User.objects.get(uuid=researcher_uuid)
 
     def get_player_sha(self, study):
-        """Gets the player sha, if it's been explicitly declared. If not, mark metadata as an update field."""
-        self.build_context["player_sha"] = player_sha = study.metadata.get(
-            "last_known_player_sha", None
+        """Gets the player sha, if it's been explicitly declared. If not, use the head of the
+        player branch and mark metadata as an update field."""
+        self.build_context["player_repo_url"] = player_repo_url = study.metadata.get(
+            "player_repo_url", settings.EMBER_EXP_PLAYER_REPO
         )
+        player_sha = study.metadata.get("last_known_player_sha", None)
         if not player_sha:  # We will technically be updating metadata here.
             self.build_context["update_fields"] += ["metadata"]
+        if player_sha is None or not re.match("([a-f0-9]{40})", player_sha):
+            player_sha = get_branch_sha(
+                player_repo_url, settings.EMBER_EXP_PLAYER_BRANCH
+            )
+
+        study.metadata["last_known_player_sha"] = player_sha
+        self.build_context["player_sha"] = player_sha
+
+    def get_player_build(
+        self, player_repo_url, player_sha, player_cache_path, local_paths
+    ):
+        """Finds the cached build of this player, compiling and caching it first if need be."""
+        player_build_path = os.path.join(
+            player_cache_path,
+            f"{player_sha}-{player_build_digest(player_repo_url, build_environment())}",
+        )
+        self.build_context["player_build_path"] = player_build_path
+        if os.path.isdir(player_build_path):
+            # Cleanup goes by modification time, so keep builds in use.
+            os.utime(player_build_path)
+            return {"logs": f"Using cached player build {player_build_path}."}
+
+        self.build_docker_image()
+        checkout_directory, _ = download_repos(
+            player_repo_url, player_sha=player_sha, checkouts_path=local_paths.checkouts
+        )
+        # Build beside the cache entry and move it into place, so that concurrent builds of
+        # the same player never see a partial build.
+        os.makedirs(player_cache_path, mode=0o777, exist_ok=True)
+        build_directory = f"{os.path.basename(player_build_path)}.{uuid.uuid4()}"
+        logs = self.run_docker_container(checkout_directory, build_directory)
+        try:
+            os.rename(
+                os.path.join(player_cache_path, build_directory), player_build_path
+            )
+        except OSError:  # Another build of this player got there first.
+            shutil.rmtree(
+                os.path.join(player_cache_path, build_directory), ignore_errors=True
+            )
+        return {"logs": logs}
 
     def build_docker_image(self):
         docker_client = docker.from_env()
@@ -200,53 +265,47 @@ class EmberFrameplayerBuilder(ExperimentBuilder):
         )
         self.build_context["docker_image"] = image
 
-    def get_container_directories(self, study, study_uuid, player_sha):
-        player_repo_url = study.metadata.get(
-            "player_repo_url", settings.EMBER_EXP_PLAYER_REPO
-        )
-
-        # TODO: How can we make download repos more efficient?
-        checkout_directory, player_sha = download_repos(
-            player_repo_url, player_sha=player_sha
-        )
-
-        study.metadata["last_known_player_sha"] = player_sha
-
-        container_checkout_directory = os.path.join("/checkouts/", checkout_directory)
-        container_destination_directory = os.path.join("/deployments/", str(study_uuid))
-
-        self.build_context["container_paths"] = DirectoryTargets(
-            checkouts=container_checkout_directory,
-            deployments=container_destination_directory,
-        )
-
-    def run_docker_container(self, container_paths, study_uuid, local_paths):
+    def run_docker_container(self, checkout_directory, build_directory):
+        """Compile the player in checkout_directory into build_directory in the cache."""
         docker_client = docker.from_env()
+        local_paths = self.build_context["local_paths"]
         stdout_and_stderr = docker_client.containers.run(
             "ember_build",
             command="bash build.sh",
             auto_remove=True,
             environment={
-                "CHECKOUT_DIR": container_paths.checkouts,
-                "PREPEND_FINGERPRINT": f"/studies/{study_uuid}/",
-                "STUDY_OUTPUT_DIR": container_paths.deployments,
-                "SENTRY_DSN": os.environ.get("SENTRY_DSN_JS", None),
-                "PIPE_ACCOUNT_HASH": os.environ.get("PIPE_ACCOUNT_HASH"),
-                "PIPE_ENVIRONMENT": os.environ.get("PIPE_ENVIRONMENT"),
-                "S3_REGION": os.environ.get("S3_REGION"),
-                "S3_ACCESS_KEY_ID": os.environ.get("S3_ACCESS_KEY_ID"),
-                "S3_SECRET_ACCESS_KEY": os.environ.get("S3_SECRET_ACCESS_KEY"),
-                "S3_BUCKET": os.environ.get("S3_BUCKET"),
+                "CHECKOUT_DIR": os.path.join("/checkouts/", checkout_directory),
+                "PREPEND_FINGERPRINT": f"/studies/{CACHED_BUILD_STUDY_UUID}/",
+                "STUDY_OUTPUT_DIR": os.path.join("/deployments/", build_directory),
+                **build_environment(),
             },
             volumes={
                 local_paths.checkouts: {"bind": "/checkouts", "mode": "ro"},
-                local_paths.deployments: {"bind": "/deployments", "mode": "rw"},
+                self.build_context["player_cache_path"]: {
+                    "bind": "/deployments",
+                    "mode": "rw",
+                },
             },
             stdout=True,
             stderr=True,
         )
+        return stdout_and_stderr.decode("utf-8")
 
-        return {"success": True, "logs": stdout_and_stderr.decode("utf-8")}
+    def prepare_deployment(
+        self, player_build_path, local_paths, destination_directory, study_uuid
+    ):
+        """Copy the cached player build into the study's deployment, with its UUID."""
+        deployment_directory = os.path.join(
+            local_paths.deployments, destination_directory
+        )
+        shutil.rmtree(deployment_directory, ignore_errors=True)
+        shutil.copytree(player_build_path, deployment_directory)
+        rewritten = replace_in_files(
+            deployment_directory,
+            CACHED_BUILD_STUDY_UUID.encode(),
+            str(study_uuid).encode(),
+        )
+        return {"logs": f"Put the study UUID in {rewritten} files."}
 
     def deploy_study(self, local_paths, destination_directory):
         storage = storages.LookitExperimentStorage()
@@ -255,7 +314,11 @@ class EmberFrameplayerBuilder(ExperimentBuilder):
             local_paths.deployments, destination_directory
         )
 
-        deploy_to_remote(cloud_deployment_directory, storage)
+        counts = deploy_to_remote(cloud_deployment_directory, storage)
+        return {
+            "logs": "Uploaded {uploaded} files, left {unchanged} unchanged and deleted "
+            "{deleted}.".format(**counts)
+        }
 
     def save_study_and_log_results(self, study, update_fields):
         # Only update field for particular build, in case we have parallel builds running
@@ -281,6 +344,47 @@ class EmberFrameplayerBuilder(ExperimentBuilder):
         StudyLog.objects.create(study=study, action=action, user=researcher, extra=logs)
 
 
+def build_environment():
+    """Environment for player builds that isn't specific to a study."""
+    return {
+        "SENTRY_DSN": os.environ.get("SENTRY_DSN_JS", None),
+        "PIPE_ACCOUNT_HASH": os.environ.get("PIPE_ACCOUNT_HASH"),
+        "PIPE_ENVIRONMENT": os.environ.get("PIPE_ENVIRONMENT"),
+        "S3_REGION": os.environ.get("S3_REGION"),
+        "S3_ACCESS_KEY_ID": os.environ.get("S3_ACCESS_KEY_ID"),
+        "S3_SECRET_ACCESS_KEY": os.environ.get("S3_SECRET_ACCESS_KEY"),
+        "S3_BUCKET": os.environ.get("S3_BUCKET"),
+    }
+
+
+def player_build_digest(player_repo_url, environment):
+    """Digest of everything besides the player SHA that goes into a player build."""
+    digest = hashlib.sha256()
+    digest.update(player_repo_url.encode())
+    digest.update(json.dumps(environment, sort_keys=True).encode())
+    for filename in BUILD_IMAGE_FILES:
+        path = os.path.join(settings.EMBER_BUILD_ROOT_PATH, filename)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()[:16]
+
+
+def replace_in_files(directory, old, new):
+    """Replace old with new in every file under directory. Returns the number changed."""
+    changed = 0
+    for root_directory, dirs, files in os.walk(directory):
+        for filename in files:
+            path = os.path.join(root_directory, filename)
+            with open(path, "rb") as f:
+                contents = f.read()
+            if old in contents:
+                with open(path, "wb") as f:
+                    f.write(contents.replace(old, new))
+                changed += 1
+    return changed
+
+
 def get_repo_path(full_repo_path):
     return re.search("https://github.com/(.*)", full_repo_path).group(1).rstrip("/")
 
@@ -292,14 +396,20 @@ def get_branch_sha(repo_url, branch):
     return sha
 
 
+# Size of the pieces player archives are downloaded and extracted in.
+CHECKOUT_CHUNK_SIZE = 1024 * 1024
+
+
 def unzip_file(file, destination_folder):
     """
     Github puts all files into a f`{repo_name}_{sha}`/ directory.
     This strips off the top-level directory and uses the destination_folder
     in it's place.
+
+    file is a path or a seekable file object; members are extracted a chunk at a time.
     """
     os.makedirs(destination_folder, mode=0o777, exist_ok=True)
-    with zipfile.ZipFile(BytesIO(file)) as zip_file:
+    with zipfile.ZipFile(file) as zip_file:
         for member in zip_file.infolist():
             if member.is_dir():
                 os.makedirs(
@@ -310,51 +420,168 @@ def unzip_file(file, destination_folder):
                     exist_ok=True,
                 )
                 continue
-            with open(
-                os.path.join(destination_folder, member.filename.partition("/")[-1]),
-                "wb",
-            ) as outfile:
-                outfile.write(zip_file.read(member))
+            with (
+                zip_file.open(member) as infile,
+                open(
+                    os.path.join(
+                        destination_folder, member.filename.partition("/")[-1]
+                    ),
+                    "wb",
+                ) as outfile,
+            ):
+                shutil.copyfileobj(infile, outfile, CHECKOUT_CHUNK_SIZE)
+
+
+# Where each study deployment's manifest is kept, beside its files.
+DEPLOYMENT_MANIFEST_NAME = ".deployment-manifest.json"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(partial(f.read, 1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _delete_quietly(storage, name):
+    """Delete name from storage, returning the error instead of raising it."""
+    try:
+        storage.delete(name)
+    except Exception as e:
+        return e
+    return None
 
 
-def deploy_to_remote(local_path, storage):
-    """Wrapper for remote file deployments.
+def deploy_to_remote(local_path, storage, workers=None):
+    """Upload a study deployment to storage, leaving files that haven't changed alone.
 
-    If we have a Google Cloud Storage client, we should leverage batching capability.
+    A manifest of each deployed file's content hash and stored name is kept with the
+    deployment. Files whose hash matches the last deployment's aren't uploaded; the rest are
+    uploaded on a pool of workers threads, and files the deployment no longer has are deleted.
+    This is skipped when developing locally.
+
+    Returns the number of files uploaded, unchanged and deleted.
     """
-    # TODO: Threaded implementation of multi-upload, given that the GCS API backend
-    # doesn't actually support batched MIME requests :(
-    _upload_in_serial(local_path, storage)
-
-
-def _upload_in_serial(local_path, storage):
-    """Inner worker function for storage uploads in serial.  This should be skipped when
-    developing locally."""
-    if not settings.DEBUG:
-        for root_directory, dirs, files in os.walk(local_path, topdown=True):
-            for filename in files:
-                full_path = os.path.join(root_directory, filename)
-                with open(full_path, mode="rb") as f:
-                    remote_path = full_path.split("/ember_build/deployments/")[1]
-                    filename = storage.save(remote_path, File(f))
-    else:
+    if settings.DEBUG:
         logger.debug(
             "*** WARNING ***: Debug is true, not uploading files to cloud storage."
         )
+        return {"uploaded": 0, "unchanged": 0, "deleted": 0}
+
+    workers = workers or settings.EXPERIMENT_DEPLOY_WORKERS
+    deployment_root = os.path.dirname(os.path.normpath(local_path))
+    manifest_name = os.path.join(
+        os.path.relpath(local_path, deployment_root), DEPLOYMENT_MANIFEST_NAME
+    )
+    try:
+        with storage.open(manifest_name) as f:
+            previous_manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous_manifest = {}
+
+    hashes = {}
+    for root_directory, dirs, files in os.walk(local_path, topdown=True):
+        for filename in files:
+            full_path = os.path.join(root_directory, filename)
+            hashes[os.path.relpath(full_path, deployment_root)] = file_sha256(full_path)
+
+    manifest = {
+        path: previous_manifest[path]
+        for path, sha256 in hashes.items()
+        if path in previous_manifest and previous_manifest[path]["sha256"] == sha256
+    }
+    changed = [path for path in hashes if path not in manifest]
+    stale = sorted(previous_manifest.keys() - hashes.keys())
+
+    def upload(path):
+        with open(os.path.join(deployment_root, path), mode="rb") as f:
+            return storage.save(path, File(f))
+
+    errors = []
+    deleted = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(upload, path): path for path in changed}
+        for future, path in futures.items():
+            try:
+                manifest[path] = {"sha256": hashes[path], "name": future.result()}
+            except Exception as e:
+                logger.error(f"Failed to upload {path}: {e}")
+                errors.append(e)
+
+        # After uploading, as stored names may be lowercased into a new file's name.
+        stored_names = {entry["name"] for entry in manifest.values()}
+        stale = [
+            path
+            for path in stale
+            if previous_manifest[path]["name"] not in stored_names
+        ]
+        stale_names = [previous_manifest[path]["name"] for path in stale]
+        for path, error in zip(
+            stale, executor.map(partial(_delete_quietly, storage), stale_names)
+        ):
+            if not error:
+                deleted += 1
+            else:
+                logger.error(f"Failed to delete {path}: {error}")
+                errors.append(error)
+                # Keep it in the manifest, so the next deployment deletes it.
+                manifest[path] = previous_manifest[path]
+
+    # Record what was uploaded even if some uploads failed, so that retrying picks up there.
+    storage.save(
+        manifest_name,
+        ContentFile(json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")),
+    )
+    if errors:
+        raise errors[0]
+    return {
+        "uploaded": len(changed),
+        "unchanged": len(hashes) - len(changed),
+        "deleted": deleted,
+    }
 
 
-def download_repos(player_repo_url, player_sha=None):
+def download_repos(player_repo_url, player_sha=None, checkouts_path=None):
+    """Checks out the player at player_sha (or the tip of its branch) under checkouts_path.
+
+    The archive is streamed to a temporary file and extracted beside the checkout, which is
+    then moved into place, so a checkout that exists is complete. Builds of the same sha
+    hold a lock on it while checking it out, so only one of them downloads it.
+    """
     if player_sha is None or not re.match("([a-f0-9]{40})", player_sha):
         player_sha = get_branch_sha(player_repo_url, settings.EMBER_EXP_PLAYER_BRANCH)
+    if checkouts_path is None:
+        checkouts_path = os.path.join(settings.EMBER_BUILD_ROOT_PATH, "checkouts")
 
     repo_destination_folder = f"{player_sha}"
     local_repo_destination_folder = os.path.join(
-        "./ember_build/checkouts/", repo_destination_folder
+        checkouts_path, repo_destination_folder
     )
-
-    if not os.path.isdir(local_repo_destination_folder):
-        player_zip_path = f"{player_repo_url}/archive/{player_sha}.zip"
-        unzip_file(requests.get(player_zip_path).content, local_repo_destination_folder)
+    if os.path.isdir(local_repo_destination_folder):
+        return repo_destination_folder, player_sha
+
+    os.makedirs(checkouts_path, mode=0o777, exist_ok=True)
+    with open(os.path.join(checkouts_path, f"{player_sha}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # Another build may have checked it out while this one waited for the lock.
+        if not os.path.isdir(local_repo_destination_folder):
+            extract_directory = os.path.join(
+                checkouts_path, f"{player_sha}.{uuid.uuid4()}"
+            )
+            try:
+                with tempfile.TemporaryFile(dir=checkouts_path) as archive:
+                    with requests.get(
+                        f"{player_repo_url}/archive/{player_sha}.zip", stream=True
+                    ) as response:
+                        response.raise_for_status()
+                        for chunk in response.iter_content(CHECKOUT_CHUNK_SIZE):
+                            archive.write(chunk)
+                    archive.seek(0)
+                    unzip_file(archive, extract_directory)
+                os.rename(extract_directory, local_repo_destination_folder)
+            finally:
+                shutil.rmtree(extract_directory, ignore_errors=True)
 
     return repo_destination_folder, player_sha
 
@@ -16,6 +16,7 @@ from accounts.queries import (
     get_child_participation_eligibility,
 )
 from project.celery import app
+from project.sendgrid_backend import PersonalizedEmailMessage
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +29,56 @@ def get_experiment_absolute_url(path):
     return urljoin(settings.EXPERIMENT_BASE_URL, path)
 
 
+def render_email_content(template_name, context):
+    """Render the txt and html versions of an email template.
+
+    Inline base64 images in the html are swapped for references to attachments, and
+    for [IMAGE] placeholders in the custom_email text.
+
+    Returns:
+        tuple: text content, html content and the list of MIMEImage attachments
+    """
+    # For text version: replace images with [IMAGE] so they're not removed entirely
+    context_plain_text = copy.deepcopy(context)
+    # TODO: use a custom filter rather than striptags to preserve image placeholders in the
+    # custom_email template
+    if template_name == "custom_email" and "custom_message" in context_plain_text:
+        image_scheme = re.compile(r"<img .*?>", re.MULTILINE)
+        context_plain_text["custom_message"] = re.sub(
+            image_scheme, "[IMAGE]", context_plain_text["custom_message"]
+        )
+
+    # Render into template
+    text_content = get_template("emails/{}.txt".format(template_name)).render(
+        context_plain_text
+    )
+    html_content = get_template("emails/{}.html".format(template_name)).render(context)
+
+    # For HTML version: Replace inline images with attachments referenced. See
+    # https://gist.github.com/osantana/833045a89ccbc6fc50c1 for reference
+    inline_scheme = re.compile(
+        r' src="data:image/(?P<subtype>.*?);base64,(?P<path>.*?)" ?', re.MULTILINE
+    )
+    images_data = []
+
+    def repl(match):
+        images_data.append((match.group("subtype"), match.group("path")))
+        return ' src="cid:image-%05d" ' % (len(images_data),)
+
+    html_content = re.sub(inline_scheme, repl, html_content)
+
+    images = []
+    for index, (subtype, data) in enumerate(images_data):
+        image = MIMEImage(base64.b64decode(data), _subtype=subtype)
+        image_id = "image-%05d" % (index + 1)
+        image.add_header("Content-ID", image_id)
+        image.add_header("Content-Disposition", "inline")
+        image.add_header("Filename", image_id + "." + subtype)
+        images.append(image)
+
+    return text_content, html_content, images
+
+
 @app.task
 def send_mail(
     template_name,
@@ -53,21 +104,7 @@ def send_mail(
     :param str custom_message Custom email message - for use instead of a template
     :kwargs: Context vars for the email template
     """
-    # For text version: replace images with [IMAGE] so they're not removed entirely
-    context_plain_text = copy.deepcopy(context)
-    # TODO: use a custom filter rather than striptags to preserve image placeholders in the
-    # custom_email template
-    if template_name == "custom_email" and "custom_message" in context_plain_text:
-        image_scheme = re.compile(r"<img .*?>", re.MULTILINE)
-        context_plain_text["custom_message"] = re.sub(
-            image_scheme, "[IMAGE]", context_plain_text["custom_message"]
-        )
-
-    # Render into template
-    text_content = get_template("emails/{}.txt".format(template_name)).render(
-        context_plain_text
-    )
-    html_content = get_template("emails/{}.html".format(template_name)).render(context)
+    text_content, html_content, images = render_email_content(template_name, context)
 
     if not isinstance(to_addresses, list):
         to_addresses = [to_addresses]
@@ -84,26 +121,41 @@ def send_mail(
         reply_to=reply_to,
         headers=headers,
     )
+    for image in images:
+        email.attach(image)
 
-    # For HTML version: Replace inline images with attachments referenced. See
-    # https://gist.github.com/osantana/833045a89ccbc6fc50c1 for reference
-    inline_scheme = re.compile(
-        r' src="data:image/(?P<subtype>.*?);base64,(?P<path>.*?)" ?', re.MULTILINE
-    )
-    images_data = []
+    email.attach_alternative(html_content, "text/html")
+    email.send()
+    return email
 
-    def repl(match):
-        images_data.append((match.group("subtype"), match.group("path")))
-        return ' src="cid:image-%05d" ' % (len(images_data),)
 
-    html_content = re.sub(inline_scheme, repl, html_content)
+@app.task
+def send_personalized_mail(
+    template_name, subject, personalizations, reply_to=None, **context
+):
+    """
+    Helper for sending one templated email to many recipients
 
-    for index, (subtype, data) in enumerate(images_data):
-        image = MIMEImage(base64.b64decode(data), _subtype=subtype)
-        image_id = "image-%05d" % (index + 1)
-        image.add_header("Content-ID", image_id)
-        image.add_header("Content-Disposition", "inline")
-        image.add_header("Filename", image_id + "." + subtype)
+    The template is rendered once. Per-recipient values are filled in from each personalization's
+    substitutions, so the context should hold the substitution keys in their place.
+
+    :param str template_name: Name of the template to send. There should exist a txt and html version
+    :param str subject: Default subject line of the email
+    :param list personalizations: List of dicts with "to" and optional "subject", "substitutions"
+        and "headers" for each recipient; see PersonalizedEmailMessage
+    :param list reply_to: List of reply-to addresses
+    :kwargs: Context vars for the email template
+    """
+    text_content, html_content, images = render_email_content(template_name, context)
+
+    email = PersonalizedEmailMessage(
+        subject,
+        text_content,
+        settings.EMAIL_FROM_ADDRESS,
+        personalizations=personalizations,
+        reply_to=reply_to,
+    )
+    for image in images:
         email.attach(image)
 
     email.attach_alternative(html_content, "text/html")
@@ -27,9 +27,9 @@ class Command(BaseCommand):
         dry_run = options["dry_run"]
 
         with patch("studies.models.S3_RESOURCE.Object") as mock_s3_object:
-            # We need to mock the S3 object and return values for copy_from/delete so that this part of the Pipe webhook processing is skipped and does not throw errors when the old Pipe file cannot be found (because it has already been renamed).
+            # We need to mock the S3 object and return values for copy/delete so that this part of the Pipe webhook processing is skipped and does not throw errors when the old Pipe file cannot be found (because it has already been renamed).
             mock_obj = MagicMock()
-            mock_obj.copy_from.return_value = None
+            mock_obj.copy.return_value = None
             mock_obj.delete.return_value = None
             mock_s3_object.return_value = mock_obj
 
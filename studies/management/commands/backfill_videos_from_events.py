@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from studies.models import Response, StudyType
+from studies.tasks import backfill_videos_from_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Create Videos for the Pipe videos recorded in frame player responses' event timings, "
+        "looking for them in S3 concurrently, and report throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--study",
+            dest="study_uuids",
+            action="append",
+            default=[],
+            help="UUID of a study to backfill; may be repeated. Defaults to all studies.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=16,
+            help="Number of videos to look for in S3 at once.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of videos to look for before creating their Videos.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Look for videos without creating any Videos.",
+        )
+
+    def handle(self, *args, **options):
+        responses = Response.objects.filter(
+            study_type=StudyType.get_ember_frame_player()
+        )
+        if options["study_uuids"]:
+            responses = responses.filter(study__uuid__in=options["study_uuids"])
+        responses = responses.only("id", "study_id", "exp_data").order_by("id")
+
+        report = backfill_videos_from_events(
+            responses.iterator(chunk_size=options["batch_size"]),
+            settings.BUCKET_NAME,
+            options["workers"],
+            options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+
+        log_prefix = "[DRY RUN] " if options["dry_run"] else ""
+        looked_for = report.event_videos - report.duplicates
+        seconds = max(report.seconds, 1e-9)
+        self.stdout.write(
+            f"{log_prefix}{report.responses} responses with {report.event_videos} videos "
+            f"in their events ({report.duplicates} seen in earlier responses, "
+            f"{report.existing} already had Videos)."
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{log_prefix}Created {report.created} Videos; {report.missing} videos "
+                f"weren't in S3. {report.seconds:.2f}s, "
+                f"{report.responses / seconds:.1f} responses/s, "
+                f"{looked_for / seconds:.1f} videos/s."
+            )
+        )
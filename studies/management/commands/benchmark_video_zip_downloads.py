@@ -0,0 +1,92 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from studies.tasks import DOWNLOAD_CHUNK_SIZE, prefetched_downloads
+
+
+class SlowObjectStoreHandler(BaseHTTPRequestHandler):
+    """Serves every path as an object of the configured size, with a fixed time to first byte
+    and a per-connection bandwidth limit, roughly like a single S3 GET stream."""
+
+    object_size = 0
+    latency = 0.0
+    bandwidth = 0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Length", str(self.object_size))
+        self.end_headers()
+        remaining = self.object_size
+        while remaining:
+            chunk_size = min(DOWNLOAD_CHUNK_SIZE, remaining)
+            self.wfile.write(b"\0" * chunk_size)
+            remaining -= chunk_size
+            time.sleep(chunk_size / self.bandwidth)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure video zip download throughput against a local stand-in for S3, "
+        "for different numbers of download workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--videos", type=int, default=40)
+        parser.add_argument(
+            "--size", type=int, default=2 * 1024 * 1024, help="Bytes per video."
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0.05, help="Seconds to first byte."
+        )
+        parser.add_argument(
+            "--bandwidth",
+            type=int,
+            default=20 * 1024 * 1024,
+            help="Bytes per second per download.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            nargs="+",
+            default=[1, 4, settings.VIDEO_ZIP_DOWNLOAD_WORKERS],
+        )
+
+    def handle(self, *args, **options):
+        handler = type(
+            "Handler",
+            (SlowObjectStoreHandler,),
+            {
+                "object_size": options["size"],
+                "latency": options["latency"],
+                "bandwidth": options["bandwidth"],
+            },
+        )
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        try:
+            for workers in options["workers"]:
+                urls = (f"{base_url}/{n}.mp4" for n in range(options["videos"]))
+                total = 0
+                start = time.perf_counter()
+                for body in prefetched_downloads(
+                    urls, workers, settings.VIDEO_ZIP_SPOOL_MAX_SIZE
+                ):
+                    with body:
+                        total += len(body.read())
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{workers:>3} workers: {total / elapsed / 1024 / 1024:8.1f} MiB/s "
+                    f"({options['videos']} videos in {elapsed:.2f}s)"
+                )
+        finally:
+            server.shutdown()
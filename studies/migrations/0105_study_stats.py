@@ -0,0 +1,75 @@
+# Generated by Django 5.2.13 on 2026-10-18 22:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BACKFILL_STUDY_STATS = """
+INSERT INTO studies_studystats (study_id,
+                                completed_responses_count,
+                                incomplete_responses_count,
+                                valid_consent_count,
+                                pending_consent_count,
+                                starting_date,
+                                ending_date)
+SELECT ss.id,
+       COUNT(sr.id) FILTER (WHERE sr.completed),
+       COUNT(sr.id) FILTER (WHERE NOT sr.completed),
+       COUNT(sr.id) FILTER (WHERE sr.current_ruling = 'accepted'),
+       COUNT(sr.id) FILTER (WHERE sr.current_ruling = 'pending'),
+       (SELECT MAX(sl.created_at)
+        FROM studies_studylog sl
+        WHERE sl.study_id = ss.id
+          AND sl.action = 'active'),
+       (SELECT MAX(sl.created_at)
+        FROM studies_studylog sl
+        WHERE sl.study_id = ss.id
+          AND sl.action = 'deactivated')
+FROM studies_study ss
+         LEFT OUTER JOIN (SELECT r.id,
+                                 r.study_id,
+                                 r.completed,
+                                 COALESCE((SELECT cr.action
+                                           FROM studies_consentruling cr
+                                           WHERE cr.response_id = r.id
+                                           ORDER BY cr.created_at DESC
+                                           LIMIT 1), 'pending') AS current_ruling
+                          FROM studies_response r
+                          WHERE r.is_preview = false
+                            AND r.completed_consent_frame = true) sr ON sr.study_id = ss.id
+GROUP BY ss.id
+ON CONFLICT DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("studies", "0104_add_bucket_kwarg_to_video_cleanup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StudyStats",
+            fields=[
+                (
+                    "study",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="studies.study",
+                    ),
+                ),
+                ("completed_responses_count", models.PositiveIntegerField(default=0)),
+                ("incomplete_responses_count", models.PositiveIntegerField(default=0)),
+                ("valid_consent_count", models.PositiveIntegerField(default=0)),
+                ("pending_consent_count", models.PositiveIntegerField(default=0)),
+                ("starting_date", models.DateTimeField(null=True)),
+                ("ending_date", models.DateTimeField(null=True)),
+            ],
+            options={
+                "verbose_name_plural": "study stats",
+            },
+        ),
+        migrations.RunSQL(BACKFILL_STUDY_STATS, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.13 on 2026-10-18 22:45
+
+from django.db import migrations
+from django.db.models import Q
+
+four_am_crontab_schedule_dict = dict(
+    minute="0", hour="4", day_of_week="*", day_of_month="*", month_of_year="*"
+)
+reconcile_study_stats_periodic_task_dict = dict(
+    name="Nightly study stats reconciliation",
+    task="studies.tasks.reconcile_study_stats",
+)
+
+
+def create_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    four_am_crontab_schedule, created = CrontabSchedule.objects.get_or_create(
+        **four_am_crontab_schedule_dict
+    )
+    PeriodicTask.objects.get_or_create(
+        crontab=four_am_crontab_schedule, **reconcile_study_stats_periodic_task_dict
+    )
+
+
+def remove_scheduled_jobs(apps, schema_editor):
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    PeriodicTask.objects.filter(Q(**reconcile_study_stats_periodic_task_dict)).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("studies", "0105_study_stats"),
+        ("django_celery_beat", "0001_initial"),
+    ]
+
+    operations = [migrations.RunPython(create_scheduled_jobs, remove_scheduled_jobs)]
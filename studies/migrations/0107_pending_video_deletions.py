@@ -0,0 +1,69 @@
+# Generated by Django 5.2.13 on 2026-10-18 23:00
+
+from django.db import migrations, models
+from django.db.models import Q
+
+hourly_crontab_schedule_dict = dict(
+    minute="15", hour="*", day_of_week="*", day_of_month="*", month_of_year="*"
+)
+delete_pending_videos_periodic_task_dict = dict(
+    name="Hourly deletion of deleted videos from S3",
+    task="studies.tasks.delete_pending_videos",
+)
+
+
+def create_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    hourly_crontab_schedule, created = CrontabSchedule.objects.get_or_create(
+        **hourly_crontab_schedule_dict
+    )
+    PeriodicTask.objects.get_or_create(
+        crontab=hourly_crontab_schedule, **delete_pending_videos_periodic_task_dict
+    )
+
+
+def remove_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    PeriodicTask.objects.filter(Q(**delete_pending_videos_periodic_task_dict)).delete()
+    CrontabSchedule.objects.filter(**hourly_crontab_schedule_dict).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("studies", "0106_add_scheduled_study_stats_reconciliation"),
+        ("django_celery_beat", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingVideoDeletion",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket", models.CharField(max_length=255)),
+                ("key", models.CharField(max_length=255)),
+                ("due_at", models.DateTimeField(db_index=True)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("bucket", "key"), name="unique_pending_video_deletion"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(create_scheduled_jobs, remove_scheduled_jobs),
+    ]
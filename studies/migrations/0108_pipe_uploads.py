@@ -0,0 +1,66 @@
+# Generated by Django 5.2.13 on 2026-10-18 23:30
+
+from django.db import migrations, models
+from django.db.models import Q
+
+every_ten_minutes_crontab_schedule_dict = dict(
+    minute="*/10", hour="*", day_of_week="*", day_of_month="*", month_of_year="*"
+)
+process_pending_pipe_uploads_periodic_task_dict = dict(
+    name="Retry processing pending Pipe uploads",
+    task="studies.tasks.process_pending_pipe_uploads",
+)
+
+
+def create_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    every_ten_minutes_crontab_schedule, created = CrontabSchedule.objects.get_or_create(
+        **every_ten_minutes_crontab_schedule_dict
+    )
+    PeriodicTask.objects.get_or_create(
+        crontab=every_ten_minutes_crontab_schedule,
+        **process_pending_pipe_uploads_periodic_task_dict,
+    )
+
+
+def remove_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    PeriodicTask.objects.filter(
+        Q(**process_pending_pipe_uploads_periodic_task_dict)
+    ).delete()
+    CrontabSchedule.objects.filter(**every_ten_minutes_crontab_schedule_dict).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("studies", "0107_pending_video_deletions"),
+        ("django_celery_beat", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PipeUpload",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("pipe_name", models.CharField(max_length=255, unique=True)),
+                ("payload", models.JSONField()),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                ("processed_at", models.DateTimeField(db_index=True, null=True)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_scheduled_jobs, remove_scheduled_jobs),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.13 on 2026-10-18 23:11
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+mark_current_consent_rulings = """
+UPDATE studies_consentruling
+SET is_current = true
+WHERE id IN (SELECT DISTINCT ON (response_id) id
+             FROM studies_consentruling
+             ORDER BY response_id, created_at DESC, id DESC);
+"""
+
+# Postgres servers built without the contrib extensions skip the index; searches still work,
+# they just scan the study's videos.
+create_video_name_search_index = """
+DO $$
+BEGIN
+    IF (SELECT COUNT(*)
+        FROM pg_available_extensions
+        WHERE name IN ('pg_trgm', 'btree_gin')) = 2 THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE EXTENSION IF NOT EXISTS btree_gin;
+        CREATE INDEX studies_video_name_trgm_idx
+            ON studies_video USING gin (study_id, UPPER(full_name) gin_trgm_ops);
+    END IF;
+END
+$$;
+"""
+
+drop_video_name_search_index = "DROP INDEX IF EXISTS studies_video_name_trgm_idx;"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("studies", "0108_pipe_uploads"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="consentruling",
+            name="is_current",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunSQL(mark_current_consent_rulings, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name="consentruling",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_current", True)),
+                fields=("response",),
+                name="unique_current_consent_ruling",
+            ),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    create_video_name_search_index, drop_video_name_search_index
+                )
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name="video",
+                    index=django.contrib.postgres.indexes.GinIndex(
+                        models.F("study"),
+                        django.contrib.postgres.indexes.OpClass(
+                            django.db.models.functions.text.Upper("full_name"),
+                            name="gin_trgm_ops",
+                        ),
+                        name="studies_video_name_trgm_idx",
+                    ),
+                ),
+            ],
+        ),
+    ]
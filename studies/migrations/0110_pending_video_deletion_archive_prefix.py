@@ -0,0 +1,17 @@
+# Generated by Django 5.2.13 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("studies", "0109_consent_ruling_is_current_and_video_name_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pendingvideodeletion",
+            name="archive_prefix",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.13 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("studies", "0110_pending_video_deletion_archive_prefix"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pipeupload",
+            name="claimed_at",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
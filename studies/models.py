@@ -1,18 +1,27 @@
 import logging
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from enum import Enum
+from functools import partial
 
 import boto3
-import dateutil
-import fleep
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 from django.conf import settings
 from django.contrib.auth.models import Group, Permission
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models.signals import post_save, pre_delete, pre_save
+from django.db import connection, models, transaction
+from django.db.models.functions import Greatest, Upper
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.dispatch import receiver
 from django.shortcuts import reverse
 from django.utils import timezone as dutimezone
@@ -23,8 +32,21 @@ from kombu.utils import cached_property
 from model_utils import Choices
 from transitions import Machine
 
-from accounts.models import Child, DemographicData, User
+from accounts.models import (
+    Child,
+    DemographicData,
+    PendingAnnouncement,
+    User,
+    invalidate_object_perms,
+)
+from accounts.queries import (
+    invalidate_child_participation,
+    invalidate_eligible_studies,
+    invalidate_participation_requirements,
+    invalidate_study_lists,
+)
 from attachment_helpers import get_url
+from project.model_cache import ModelCache
 from studies import workflow
 from studies.helpers import (
     FrameActionDispatcher,
@@ -42,10 +64,10 @@ from studies.permissions import (
     StudyPermission,
     create_groups_for_instance,
 )
-from studies.tasks import delete_video_from_cloud
+from studies.tasks import find_event_video, video_bucket_name, videos_in_events
+from studies.video_archives import archive_prefix
 
 logger = logging.getLogger(__name__)
-date_parser = dateutil.parser
 
 # Consent ruling stuff
 PENDING = "pending"
@@ -55,6 +77,10 @@ CONSENT_RULINGS = (ACCEPTED, REJECTED, PENDING)
 
 S3_RESOURCE = boto3.resource("s3")
 S3_BUCKET = S3_RESOURCE.Bucket(settings.BUCKET_NAME)
+# S3 copies videos larger than the threshold as parallel parts.
+PIPE_VIDEO_COPY_CONFIG = TransferConfig(
+    multipart_threshold=64 * 1024 * 1024, multipart_chunksize=64 * 1024 * 1024
+)
 
 dispatch_frame_action = FrameActionDispatcher()
 
@@ -163,6 +189,9 @@ class Lab(models.Model):
         return f"{self.name} ({self.principal_investigator_name}, {self.institution})"
 
 
+lab_cache = ModelCache(Lab, lookups=("pk", "slug"))
+
+
 # Using Direct foreign keys for guardian, see:
 # https://django-guardian.readthedocs.io/en/stable/userguide/performance.html
 class LabUserObjectPermission(UserObjectPermissionBase):
@@ -266,15 +295,18 @@ class StudyType(models.Model):
 
     @classmethod
     def get_ember_frame_player(cls):
-        return cls.objects.get(id=1)
+        return study_type_cache.get(pk=1)
 
     @classmethod
     def get_external(cls):
-        return cls.objects.get(id=2)
+        return study_type_cache.get(pk=2)
 
     @classmethod
     def get_jspsych(cls):
-        return cls.objects.get(id=3)
+        return study_type_cache.get(pk=3)
+
+
+study_type_cache = ModelCache(StudyType)
 
 
 def default_study_structure():
@@ -412,24 +444,38 @@ class Study(models.Model):
             self.admin_group,
         ]
 
+    # Study groups from highest- to lowest-level, with their labels.
+    GROUP_LABELS = (
+        ("admin_group_id", "Admin"),
+        ("manager_group_id", "Manager"),
+        ("researcher_group_id", "Researcher"),
+        ("submission_processor_group_id", "Submission Processor"),
+        ("analysis_group_id", "Analysis"),
+        ("design_group_id", "Design"),
+        ("preview_group_id", "Preview"),
+    )
+
+    def study_group_ids(self):
+        return [getattr(self, field) for field, label in self.GROUP_LABELS]
+
+    def group_label(self, group_ids):
+        """Returns label for the highest-level study group among group_ids, or None if there's none"""
+        for field, label in self.GROUP_LABELS:
+            if getattr(self, field) in group_ids:
+                return label
+        return None
+
     def get_group_of_researcher(self, user):
         """Returns label for the highest-level group the researcher is in for this study, or None if not in any study groups"""
-        user_groups = user.groups.all()
-        if self.admin_group in user_groups:
-            return "Admin"
-        if self.manager_group in user_groups:
-            return "Manager"
-        if self.researcher_group in user_groups:
-            return "Researcher"
-        if self.submission_processor_group in user_groups:
-            return "Submission Processor"
-        if self.analysis_group in user_groups:
-            return "Analysis"
-        if self.design_group in user_groups:
-            return "Design"
-        if self.preview_group in user_groups:
-            return "Preview"
-        return None
+        return self.group_label(set(user.groups.values_list("id", flat=True)))
+
+    def researchers_with_study_groups(self):
+        """Users in any of this study's groups, each annotated with the ids of the study
+        groups they're in as study_group_ids."""
+        group_ids = self.study_group_ids()
+        return User.objects.filter(groups__in=group_ids).annotate(
+            study_group_ids=ArrayAgg("groups", filter=models.Q(groups__in=group_ids))
+        )
 
     def __init__(self, *args, **kwargs):
         super(Study, self).__init__(*args, **kwargs)
@@ -546,7 +592,12 @@ class Study(models.Model):
     @property
     def videos_for_consented_responses(self):
         """Gets videos but only for consented responses."""
-        return Video.objects.filter(response_id__in=self.consented_responses)
+        return self.videos.filter(
+            response__study=self,
+            response__completed_consent_frame=True,
+            response__consent_rulings__is_current=True,
+            response__consent_rulings__action=ACCEPTED,
+        )
 
     @property
     def consent_videos(self):
@@ -912,6 +963,9 @@ class Study(models.Model):
 # Using Direct foreign keys for guardian, see:
 # https://django-guardian.readthedocs.io/en/stable/userguide/performance.html
 # Opting not to use "enabled" feature and just to load custom perms directly.
+study_cache = ModelCache(Study, lookups=("pk", "uuid"))
+
+
 class StudyUserObjectPermission(UserObjectPermissionBase):
     content_object = models.ForeignKey(Study, on_delete=models.CASCADE)
 
@@ -920,6 +974,62 @@ class StudyGroupObjectPermission(GroupObjectPermissionBase):
     content_object = models.ForeignKey(Study, on_delete=models.CASCADE)
 
 
+@receiver(post_save, sender=LabUserObjectPermission)
+@receiver(post_delete, sender=LabUserObjectPermission)
+@receiver(post_save, sender=LabGroupObjectPermission)
+@receiver(post_delete, sender=LabGroupObjectPermission)
+@receiver(post_save, sender=StudyUserObjectPermission)
+@receiver(post_delete, sender=StudyUserObjectPermission)
+@receiver(post_save, sender=StudyGroupObjectPermission)
+@receiver(post_delete, sender=StudyGroupObjectPermission)
+def clear_memoized_study_perms(sender, **kwargs):
+    from studies.queries import invalidate_accessible_studies
+
+    invalidate_object_perms()
+    invalidate_accessible_studies()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(m2m_changed, sender=Lab.researchers.through)
+def clear_cached_accessible_studies(sender, action, **kwargs):
+    """Researchers' accessible study ids depend on their groups, permissions and labs."""
+    from studies.queries import invalidate_accessible_studies
+
+    if action.startswith("post_"):
+        invalidate_accessible_studies()
+
+
+@receiver(pre_save, sender=User)
+def check_user_access_change(sender, instance, update_fields, **kwargs):
+    """Note whether a user is becoming or ceasing to be a superuser or active, which changes
+    which studies they can access."""
+    saving_access = update_fields is None or {"is_superuser", "is_active"} & set(
+        update_fields
+    )
+    previous = (
+        User.objects.filter(pk=instance.pk)
+        .values_list("is_superuser", "is_active")
+        .first()
+        if instance.pk and saving_access
+        else None
+    )
+    instance._access_changed = previous is not None and previous != (
+        instance.is_superuser,
+        instance.is_active,
+    )
+
+
+@receiver(post_save, sender=User)
+def clear_cached_accessible_studies_for_user(sender, instance, **kwargs):
+    """Superusers can access every study, and inactive users none."""
+    from studies.queries import invalidate_accessible_studies
+
+    if getattr(instance, "_access_changed", False):
+        invalidate_accessible_studies()
+
+
 @receiver(post_save, sender=Study)
 def add_study_created_log(sender, instance, created, **kwargs):
     if created:
@@ -1009,6 +1119,81 @@ def remove_old_lab_researchers(sender, instance, **kwargs):
                         group.user_set.remove(user)
 
 
+@receiver(pre_save, sender=Study)
+def check_announcement_visibility_change(sender, instance, **kwargs):
+    """Note whether the study is starting or stopping being announced to families, and
+    whether it's moving to another lab."""
+    previous = (
+        Study.objects.filter(pk=instance.pk)
+        .values_list("state", "public", "lab_id")
+        .first()
+        if instance.pk
+        else None
+    )
+    instance._announcement_visibility_changed = previous is None or previous[:2] != (
+        instance.state,
+        instance.public,
+    )
+    instance._lab_changed = previous is None or previous[2] != instance.lab_id
+
+
+@receiver(post_save, sender=Study)
+def refresh_study_pending_announcements(sender, instance, **kwargs):
+    if getattr(instance, "_announcement_visibility_changed", True):
+        PendingAnnouncement.refresh(study_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Study)
+@receiver(post_delete, sender=Study)
+def clear_cached_study_lists(sender, **kwargs):
+    """Cached eligible study lists depend on every study's state and criteria."""
+    invalidate_study_lists()
+
+
+@receiver(post_save, sender=Lab)
+@receiver(post_delete, sender=Lab)
+@receiver(post_save, sender=StudyType)
+@receiver(post_delete, sender=StudyType)
+@receiver(post_save, sender=Study)
+@receiver(post_delete, sender=Study)
+def clear_cached_rows(sender, **kwargs):
+    """Retire cached copies of a model's rows when any of them changes."""
+    {Lab: lab_cache, StudyType: study_type_cache, Study: study_cache}[
+        sender
+    ].invalidate()
+
+
+@receiver(post_save, sender=Study)
+@receiver(post_delete, sender=Study)
+def clear_cached_accessible_studies_for_study(sender, instance, **kwargs):
+    """Adding, deleting or moving a study to another lab changes who can access it."""
+    from studies.queries import invalidate_accessible_studies
+
+    if kwargs.get("created", True) or getattr(instance, "_lab_changed", True):
+        invalidate_accessible_studies()
+
+
+@receiver(m2m_changed, sender=Study.must_have_participated.through)
+@receiver(m2m_changed, sender=Study.must_not_have_participated.through)
+def clear_cached_participation_requirements(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """Drop cached must have/must not have participated lists when either list changes."""
+    if action.startswith("post_"):
+        invalidate_study_lists()
+
+    if not reverse and action in ("post_add", "post_remove", "post_clear"):
+        invalidate_participation_requirements([instance.pk])
+    elif reverse and action in ("post_add", "post_remove"):
+        invalidate_participation_requirements(pk_set)
+    elif reverse and action == "pre_clear":
+        invalidate_participation_requirements(
+            sender.objects.filter(to_study_id=instance.pk).values_list(
+                "from_study_id", flat=True
+            )
+        )
+
+
 class ResponseApiManager(models.Manager):
     """Overrides to enable the display name."""
 
@@ -1077,6 +1262,9 @@ class Response(models.Model):
     )
     researcher_star = models.BooleanField(default=False)
 
+    # The values that decide which StudyStats counts a response is included in.
+    STATS_FIELDS = ("study_id", "is_preview", "completed_consent_frame", "completed")
+
     def __str__(self):
         return self.display_name
 
@@ -1093,6 +1281,15 @@ class Response(models.Model):
         resource_name = "responses"
         lookup_field = "uuid"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(field in instance.__dict__ for field in cls.STATS_FIELDS):
+            instance._stats_values = tuple(
+                instance.__dict__[field] for field in cls.STATS_FIELDS
+            )
+        return instance
+
     def _get_recent_consent_ruling(self):
         return self.consent_rulings.first()
 
@@ -1229,65 +1426,17 @@ class Response(models.Model):
         """Creates the video containers/representations for this given response.
 
         We should only really invoke this as part of a migration as of right now (2/8/2019),
-        but it's quite possible we'll have the need for dynamic upsertion later.
+        but it's quite possible we'll have the need for dynamic upsertion later. To backfill
+        many responses, use the backfill_videos_from_events command.
         """
-
-        seen_ids = set()
-        video_objects = []
-
-        # Using a constructive approach here, but with an ancillary seen_ids list b/c Django models without
-        # primary keys are unhashable.
-        for frame_id, event_data in self.exp_data.items():
-            if event_data.get("videoList", None) and event_data.get("videoId", None):
-                # We've officially captured video here!
-                events = event_data.get("eventTimings", [])
-                for event in events:
-                    video_id = event["videoId"]
-                    pipe_name = event["pipeId"]  # what we call "ID" they call "name"
-                    if (
-                        video_id not in seen_ids
-                        and pipe_name
-                        and event["streamTime"] > 0
-                    ):
-                        # Try looking for the regular ID first.
-                        file_obj = S3_RESOURCE.Object(
-                            settings.BUCKET_NAME, f"{video_id}.mp4"
-                        )
-                        try:
-                            response = file_obj.get()
-                        except ClientError:
-                            try:  # If that doesn't work, use the pipe name.
-                                file_obj = S3_RESOURCE.Object(
-                                    settings.BUCKET_NAME, f"{pipe_name}.mp4"
-                                )
-                                response = file_obj.get()
-                            except ClientError:
-                                logger.warning(
-                                    f"could not find {video_id} or {pipe_name} in S3!"
-                                )
-                                continue
-                        # Read first 32 bytes from streaming body (file header) to get actual filetype.
-                        streaming_body = response["Body"]
-                        file_header_buffer: bytes = streaming_body.read(32)
-                        file_info = fleep.get(file_header_buffer)
-                        streaming_body.close()
-
-                        video_objects.append(
-                            Video(
-                                pipe_name=pipe_name,
-                                created_at=date_parser.parse(event["timestamp"]),
-                                date_modified=response["LastModified"],
-                                #  Can't get the *actual* pipe id property, it's in the webhook payload...
-                                frame_id=frame_id,
-                                full_name=f"{video_id}.{file_info.extension[0]}",
-                                study=self.study,
-                                response=self,
-                                is_consent_footage=event_data.get("frameType", None)
-                                == "CONSENT",
-                            )
-                        )
-                        seen_ids.add(video_id)
-
+        video_objects = [
+            video
+            for video in map(
+                partial(find_event_video, settings.BUCKET_NAME),
+                videos_in_events(self),
+            )
+            if video
+        ]
         return Video.objects.bulk_create(video_objects)
 
     def save(self, *args, **kwargs):
@@ -1312,6 +1461,34 @@ def take_action_on_exp_data(sender, instance, created, **kwargs):
         dispatch_frame_action(response)
 
 
+@receiver(post_save, sender=Response)
+@receiver(post_delete, sender=Response)
+def clear_cached_child_participation(sender, instance, **kwargs):
+    """Drop the child's cached participation set when one of their responses changes."""
+    invalidate_child_participation(instance.child_id)
+    invalidate_eligible_studies(instance.child_id)
+
+
+@receiver(post_save, sender=Response)
+def remove_pending_announcement(sender, instance, **kwargs):
+    """Families aren't sent announcements about studies their child has already taken part in."""
+    ember_frame_player_id, external_id = 1, 2
+    if (
+        instance.completed_consent_frame
+        and instance.study_type_id == ember_frame_player_id
+    ) or instance.study_type_id == external_id:
+        PendingAnnouncement.objects.filter(
+            child_id=instance.child_id, study_id=instance.study_id
+        ).delete()
+
+
+@receiver(post_delete, sender=Response)
+def restore_pending_announcement(sender, instance, **kwargs):
+    PendingAnnouncement.refresh(
+        child_ids=[instance.child_id], study_ids=[instance.study_id]
+    )
+
+
 class FeedbackApiManager(models.Manager):
     """Prefetch all the things."""
 
@@ -1397,9 +1574,19 @@ class Video(models.Model):
     )  # If a response is deleted, also delete related videos
     is_consent_footage = models.BooleanField(default=False, db_index=True)
 
+    class Meta:
+        indexes = [
+            # For searching a study's videos by name, which is case-insensitive.
+            GinIndex(
+                "study",
+                OpClass(Upper("full_name"), name="gin_trgm_ops"),
+                name="studies_video_name_trgm_idx",
+            )
+        ]
+
     @classmethod
-    def check_and_parse_pipe_payload(cls, pipe_payload: str):
-        """Confirm that pipe payload is in expected format and extract study, response, etc."""
+    def parse_pipe_payload(cls, pipe_payload: str):
+        """Confirm that pipe payload is in expected format and split it into its parts."""
         consent_type_label = "consent-"
         marked_as_consent = pipe_payload.startswith(consent_type_label)
         if marked_as_consent:
@@ -1415,8 +1602,29 @@ class Video(models.Model):
             )
             raise
 
+        return (
+            marked_as_consent,
+            pipe_payload,
+            study_uuid,
+            frame_id,
+            response_uuid,
+            timestamp,
+        )
+
+    @classmethod
+    def check_and_parse_pipe_payload(cls, pipe_payload: str):
+        """Confirm that pipe payload is in expected format and extract study, response, etc."""
+        (
+            marked_as_consent,
+            pipe_payload,
+            study_uuid,
+            frame_id,
+            response_uuid,
+            timestamp,
+        ) = cls.parse_pipe_payload(pipe_payload)
+
         try:
-            study = Study.objects.get(uuid=study_uuid)
+            study = study_cache.get(uuid=study_uuid)
         except Study.DoesNotExist as ex:
             logger.error(f"Study with uuid {study_uuid} does not exist. {ex}")
             raise
@@ -1429,12 +1637,26 @@ class Video(models.Model):
 
         return marked_as_consent, pipe_payload, study, frame_id, response, timestamp
 
+    @classmethod
+    def pipe_file_names(cls, data: dict):
+        """Names of a Pipe upload's video, its permanent name, and its throwaway thumbnail."""
+        _, pipe_payload, *_ = cls.parse_pipe_payload(data["payload"])
+        return (
+            f"{data['videoName']}.{data['type'].lower()}",
+            f"{pipe_payload}.{data['type'].lower()}",
+            f"{data['videoName']}.jpg",
+        )
+
     @classmethod
     def from_pipe_payload(cls, pipe_response_dict: dict):
-        """Factory method for use in the Pipe webhook.
+        """Factory method for use in processing Pipe webhooks.
 
         Note that this is taking over previous attachment_helpers functionality, which means that it's doing the
         file renaming as well. Keeping this logic inline makes more sense because it's the only place where we do it.
+
+        Safe to call again for the same upload: an upload that already has its Video is
+        returned as is, and a rename that was interrupted after copying is picked up where it
+        left off.
         """
 
         data = pipe_response_dict["data"]
@@ -1449,26 +1671,33 @@ class Video(models.Model):
             timestamp,
         ) = cls.check_and_parse_pipe_payload(data["payload"])
 
-        old_pipe_name = f"{data['videoName']}.{data['type'].lower()}"
-        new_full_name = f"{pipe_payload}.{data['type'].lower()}"
-        throwaway_jpg_name = f"{data['videoName']}.jpg"
+        old_pipe_name, new_full_name, throwaway_jpg_name = cls.pipe_file_names(data)
 
-        # No way to directly rename in boto3, so copy and delete original (this is dumb, but let's get it working)
-        try:  # Create a copy with the correct new name, if the original exists. Could also
-            # wait until old_name_full exists using orig_video.wait_until_exists()
-            S3_RESOURCE.Object(settings.BUCKET_NAME, new_full_name).copy_from(
-                CopySource=(settings.BUCKET_NAME + "/" + old_pipe_name)
-            )
-        except ClientError:  # old_name_full not found!
-            logger.error(
-                f"Amazon S3 couldn't find the video for Pipe ID {old_pipe_name} in bucket {settings.BUCKET_NAME}"
+        existing = cls.objects.filter(pipe_name=old_pipe_name).first()
+        if existing:
+            return existing
+
+        # No way to directly rename in S3, so copy and delete original. The copy happens
+        # within S3, in parallel parts for large videos.
+        new_video = S3_RESOURCE.Object(settings.BUCKET_NAME, new_full_name)
+        try:
+            new_video.copy(
+                {"Bucket": settings.BUCKET_NAME, "Key": old_pipe_name},
+                Config=PIPE_VIDEO_COPY_CONFIG,
             )
-            raise
-        else:  # Go on to remove the originals
-            orig_video = S3_RESOURCE.Object(settings.BUCKET_NAME, old_pipe_name)
-            orig_video.delete()
-            # remove the .jpg thumbnail.
-            S3_RESOURCE.Object(settings.BUCKET_NAME, throwaway_jpg_name).delete()
+        except ClientError:  # old_pipe_name not found!
+            # An earlier attempt may have copied the video and deleted the original already.
+            try:
+                new_video.load()
+            except ClientError:
+                logger.error(
+                    f"Amazon S3 couldn't find the video for Pipe ID {old_pipe_name} in bucket {settings.BUCKET_NAME}"
+                )
+                raise
+        # Go on to remove the originals; deleting objects that are already gone succeeds.
+        S3_RESOURCE.Object(settings.BUCKET_NAME, old_pipe_name).delete()
+        # remove the .jpg thumbnail.
+        S3_RESOURCE.Object(settings.BUCKET_NAME, throwaway_jpg_name).delete()
 
         # Determine whether this is consent footage based on payload and/or response data.
         # TODO: move to only using payload info about whether this is consent footage. We only have frame data in
@@ -1551,18 +1780,75 @@ class Video(models.Model):
         )
 
 
+class PendingVideoDeletion(models.Model):
+    """An S3 object of a deleted Video, to be deleted once it's due.
+
+    delete_pending_videos deletes due objects in batches, along with any copies kept for video
+    archives under archive_prefix in the private GCS bucket, and puts failed ones off to retry.
+    """
+
+    DELAY = timedelta(days=7)
+
+    bucket = models.CharField(max_length=255)
+    key = models.CharField(max_length=255)
+    archive_prefix = models.CharField(max_length=255, blank=True)
+    due_at = models.DateTimeField(db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("bucket", "key"), name="unique_pending_video_deletion"
+            )
+        ]
+
+    def __str__(self):
+        return f"<PendingVideoDeletion: {self.bucket}/{self.key} at {self.due_at}>"
+
+
 @receiver(pre_delete, sender=Video)
 def delete_video_on_s3(sender, instance, using, **kwargs):
-    """Delete video from S3 when deleting Video object.
+    """Delete video from S3 a week after deleting Video object.
 
     Do this in a pre_delete hook rather than a custom delete function because this will
     be called when cascading deletion from responses."""
-    video_in_pipe_bucket = instance.recording_method_is_pipe
-    study_type_is_jspsych = instance.study_type_is_jspsych
-    delete_video_from_cloud.apply_async(
-        args=(instance.full_name, video_in_pipe_bucket, study_type_is_jspsych),
-        countdown=60 * 60 * 24 * 7,
-    )  # Delete after 1 week.
+    PendingVideoDeletion.objects.update_or_create(
+        bucket=video_bucket_name(
+            instance.recording_method_is_pipe, instance.study_type_is_jspsych
+        ),
+        key=instance.full_name,
+        defaults={
+            "due_at": dutimezone.now() + PendingVideoDeletion.DELAY,
+            "archive_prefix": archive_prefix(
+                study_cache.get(pk=instance.study_id).uuid
+            ),
+        },
+    )
+
+
+class PipeUpload(models.Model):
+    """A video Pipe told us it copied to S3, acknowledged but perhaps not registered yet.
+
+    The Pipe webhook only records these; process_pipe_upload renames the video to its
+    permanent name and creates its Video, and process_pending_pipe_uploads retries those that
+    haven't been.
+    """
+
+    MAX_ATTEMPTS = 5
+    # How long a run that claimed an upload has to process it before others may claim it.
+    CLAIM_TIMEOUT = timedelta(minutes=30)
+
+    pipe_name = models.CharField(max_length=255, unique=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, db_index=True)
+    claimed_at = models.DateTimeField(null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"<PipeUpload: {self.pipe_name} at {self.received_at}>"
 
 
 class ConsentRuling(models.Model):
@@ -1580,6 +1866,8 @@ class ConsentRuling(models.Model):
         User, on_delete=models.SET_NULL, related_name="consent_rulings", null=True
     )  # If a user is deleted, keep their previous consent rulings
     comments = models.TextField(null=True)
+    # Whether this is the response's most recent ruling, so that queries can join on it.
+    is_current = models.BooleanField(default=False, editable=False)
 
     class Meta:
         ordering = ["-created_at"]
@@ -1587,6 +1875,278 @@ class ConsentRuling(models.Model):
             models.Index(fields=("response", "action")),
             models.Index(fields=("response", "arbiter")),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=("response",),
+                condition=models.Q(is_current=True),
+                name="unique_current_consent_ruling",
+            )
+        ]
 
     def __str__(self):
         return f"<{self.arbiter.get_short_name()}: {self.action} {self.response} @ {self.created_at:%c}>"
+
+    def save(self, *args, **kwargs):
+        """A new ruling replaces its response's current one."""
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Lock the response, so that rulings made for it at once take turns.
+            list(
+                Response.objects.select_for_update()
+                .filter(pk=self.response_id)
+                .values_list("pk", flat=True)
+            )
+            ConsentRuling.objects.filter(
+                response_id=self.response_id, is_current=True
+            ).update(is_current=False)
+            self.is_current = True
+            super().save(*args, **kwargs)
+
+
+STUDY_STATS_UPSERT = """
+INSERT INTO studies_studystats (study_id,
+                                completed_responses_count,
+                                incomplete_responses_count,
+                                valid_consent_count,
+                                pending_consent_count,
+                                starting_date,
+                                ending_date)
+SELECT ss.id,
+       COUNT(sr.id) FILTER (WHERE sr.completed),
+       COUNT(sr.id) FILTER (WHERE NOT sr.completed),
+       COUNT(sr.id) FILTER (WHERE sr.current_ruling = 'accepted'),
+       COUNT(sr.id) FILTER (WHERE sr.current_ruling = 'pending'),
+       (SELECT MAX(sl.created_at)
+        FROM studies_studylog sl
+        WHERE sl.study_id = ss.id
+          AND sl.action = 'active'),
+       (SELECT MAX(sl.created_at)
+        FROM studies_studylog sl
+        WHERE sl.study_id = ss.id
+          AND sl.action = 'deactivated')
+FROM studies_study ss
+         LEFT OUTER JOIN (SELECT r.id,
+                                 r.study_id,
+                                 r.completed,
+                                 COALESCE((SELECT cr.action
+                                           FROM studies_consentruling cr
+                                           WHERE cr.response_id = r.id
+                                           ORDER BY cr.created_at DESC
+                                           LIMIT 1), 'pending') AS current_ruling
+                          FROM studies_response r
+                          WHERE r.is_preview = false
+                            AND r.completed_consent_frame = true
+                            {response_scope}) sr ON sr.study_id = ss.id
+WHERE true
+  {study_scope}
+GROUP BY ss.id
+ON CONFLICT (study_id) DO UPDATE
+    SET completed_responses_count  = EXCLUDED.completed_responses_count,
+        incomplete_responses_count = EXCLUDED.incomplete_responses_count,
+        valid_consent_count        = EXCLUDED.valid_consent_count,
+        pending_consent_count      = EXCLUDED.pending_consent_count,
+        starting_date              = EXCLUDED.starting_date,
+        ending_date                = EXCLUDED.ending_date
+WHERE (studies_studystats.completed_responses_count,
+       studies_studystats.incomplete_responses_count,
+       studies_studystats.valid_consent_count,
+       studies_studystats.pending_consent_count,
+       studies_studystats.starting_date,
+       studies_studystats.ending_date) IS DISTINCT FROM
+      (EXCLUDED.completed_responses_count,
+       EXCLUDED.incomplete_responses_count,
+       EXCLUDED.valid_consent_count,
+       EXCLUDED.pending_consent_count,
+       EXCLUDED.starting_date,
+       EXCLUDED.ending_date);
+"""
+
+CONSENT_RULING_STATS = {
+    ACCEPTED: "valid_consent_count",
+    PENDING: "pending_consent_count",
+}
+
+
+def response_stats(is_preview, completed_consent_frame, completed, ruling):
+    """The StudyStats counts that a response with these values adds one to."""
+    if is_preview or not completed_consent_frame:
+        return {}
+    counts = {
+        "completed_responses_count" if completed else "incomplete_responses_count": 1
+    }
+    if ruling in CONSENT_RULING_STATS:
+        counts[CONSENT_RULING_STATS[ruling]] = 1
+    return counts
+
+
+class StudyStats(models.Model):
+    """Response and consent counts and activity dates shown for each study in the study list.
+
+    Counts are adjusted as responses, consent rulings and study logs are written, so that the
+    study list doesn't count every study's responses; deleting a response or ruling recomputes
+    its study's row. Queryset updates bypass all of this, so reconcile_study_stats recomputes
+    every row nightly.
+    """
+
+    study = models.OneToOneField(
+        Study, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    completed_responses_count = models.PositiveIntegerField(default=0)
+    incomplete_responses_count = models.PositiveIntegerField(default=0)
+    valid_consent_count = models.PositiveIntegerField(default=0)
+    pending_consent_count = models.PositiveIntegerField(default=0)
+    starting_date = models.DateTimeField(null=True)
+    ending_date = models.DateTimeField(null=True)
+
+    class Meta:
+        verbose_name_plural = "study stats"
+
+    def __str__(self):
+        return f"<StudyStats: {self.study_id}>"
+
+    @classmethod
+    def refresh(cls, study_ids=None) -> int:
+        """Recompute stats for every study or only the given ones.
+
+        Returns the number of rows that were added or changed.
+        """
+        response_scope = study_scope = ""
+        params = []
+        if study_ids is not None:
+            response_scope = "AND r.study_id = ANY(%s)"
+            study_scope = "AND ss.id = ANY(%s)"
+            params = [list(study_ids)] * 2
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                STUDY_STATS_UPSERT.format(
+                    response_scope=response_scope, study_scope=study_scope
+                ),
+                params,
+            )
+            return cursor.rowcount
+
+    @classmethod
+    def adjust(cls, study_id, before, after):
+        """Move one response's contribution to its study's counts from before to after.
+
+        Counts that have drifted (e.g. through queryset updates, which reconcile_study_stats
+        fixes later) stop at 0 rather than failing the response's save.
+        """
+        changes = {
+            field: Greatest(
+                models.F(field) + after.get(field, 0) - before.get(field, 0), 0
+            )
+            for field in before.keys() | after.keys()
+            if after.get(field, 0) != before.get(field, 0)
+        }
+        if changes and not cls.objects.filter(study_id=study_id).update(**changes):
+            cls.refresh(study_ids=[study_id])
+
+
+@receiver(post_save, sender=Study)
+def create_study_stats(sender, instance, created, **kwargs):
+    if created:
+        StudyStats.refresh(study_ids=[instance.pk])
+
+
+@receiver(pre_save, sender=Response)
+def load_response_stats_values(sender, instance, **kwargs):
+    """Find the values counted in study stats that an update is about to replace, if the
+    response wasn't loaded with them."""
+    if instance._state.adding or hasattr(instance, "_stats_values"):
+        return
+    instance._stats_values = (
+        Response.objects.filter(pk=instance.pk)
+        .values_list(*Response.STATS_FIELDS)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Response)
+def update_study_stats_for_response(sender, instance, created, **kwargs):
+    old_values = None if created else instance._stats_values
+    new_values = tuple(getattr(instance, field) for field in Response.STATS_FIELDS)
+    instance._stats_values = new_values
+    if old_values == new_values:
+        return
+
+    if created:
+        ruling = PENDING
+    else:
+        ruling = (
+            instance.consent_rulings.values_list("action", flat=True).first() or PENDING
+        )
+    before = response_stats(*old_values[1:], ruling) if old_values else {}
+    after = response_stats(*new_values[1:], ruling)
+    if old_values and old_values[0] != new_values[0]:
+        StudyStats.adjust(old_values[0], before, {})
+        before = {}
+    StudyStats.adjust(new_values[0], before, after)
+
+
+@receiver(post_save, sender=ConsentRuling)
+def update_study_stats_for_ruling(sender, instance, created, **kwargs):
+    """A new ruling replaces the response's previous ruling, or pending if it had none."""
+    if not created:
+        return
+    study_id, *values = (
+        Response.objects.filter(pk=instance.response_id)
+        .values_list(*Response.STATS_FIELDS)
+        .get()
+    )
+    previous_ruling = (
+        ConsentRuling.objects.filter(response_id=instance.response_id)
+        .exclude(pk=instance.pk)
+        .values_list("action", flat=True)
+        .first()
+        or PENDING
+    )
+    StudyStats.adjust(
+        study_id,
+        response_stats(*values, previous_ruling),
+        response_stats(*values, instance.action),
+    )
+
+
+@receiver(post_delete, sender=Response)
+def refresh_study_stats_for_response(sender, instance, **kwargs):
+    # Previews and responses that never got through consent aren't counted.
+    if instance.is_preview or not instance.completed_consent_frame:
+        return
+    StudyStats.refresh(study_ids=[instance.study_id])
+
+
+@receiver(post_delete, sender=ConsentRuling)
+def restore_previous_consent_ruling(sender, instance, **kwargs):
+    """Make the newest remaining ruling current when the current one is deleted."""
+    if instance.is_current:
+        ConsentRuling.objects.filter(
+            pk__in=ConsentRuling.objects.filter(response_id=instance.response_id)
+            .order_by("-created_at", "-pk")
+            .values("pk")[:1]
+        ).update(is_current=True)
+
+
+@receiver(post_delete, sender=ConsentRuling)
+def refresh_study_stats_for_ruling(sender, instance, **kwargs):
+    study_ids = list(
+        Response.objects.filter(
+            pk=instance.response_id, is_preview=False, completed_consent_frame=True
+        ).values_list("study_id", flat=True)
+    )
+    if study_ids:
+        StudyStats.refresh(study_ids=study_ids)
+
+
+@receiver(post_save, sender=StudyLog)
+def update_study_stats_dates(sender, instance, created, **kwargs):
+    field = {"active": "starting_date", "deactivated": "ending_date"}.get(
+        instance.action
+    )
+    if created and field:
+        if not StudyStats.objects.filter(study_id=instance.study_id).update(
+            **{field: instance.created_at}
+        ):
+            StudyStats.refresh(study_ids=[instance.study_id])
@@ -2,14 +2,15 @@ import operator
 from collections import defaultdict
 from datetime import timedelta
 from functools import reduce
+from uuid import uuid4
 
+from django.core.cache import cache
 from django.core.exceptions import FieldError
-from django.db import models
+from django.db import models, transaction
 from django.db.models import (
     Count,
     Exists,
     F,
-    IntegerField,
     OuterRef,
     Q,
     Subquery,
@@ -30,13 +31,15 @@ from studies.models import (
     Study,
     StudyLog,
     Video,
+    study_cache,
+    study_type_cache,
 )
 from studies.permissions import UMBRELLA_LAB_PERMISSION_MAP, StudyPermission
 
-
-class SubqueryCount(Subquery):
-    template = "(SELECT count(*) FROM (%(subquery)s) _count)"
-    output_field = IntegerField()
+# Ids of the studies each researcher can access, by permission. Entries are tied to a version
+# token that permission, group and lab membership changes and study creation replace.
+ACCESSIBLE_STUDIES_CACHE_TIMEOUT = 60 * 60
+ACCESSIBLE_STUDIES_VERSION_CACHE_KEY = "accessible-studies:version"
 
 
 def get_annotated_responses_qs(include_comments=False, include_time=False):
@@ -147,7 +150,9 @@ def get_responses_with_current_rulings_and_videos(study_id, preview_only):
     consent_videos = Video.objects.filter(
         study_id=study_id, is_consent_footage=True
     ).values("full_name", "response_id")
-    study_type_is_jspsych = Study.objects.get(pk=study_id).study_type.is_jspsych
+    study_type_is_jspsych = study_type_cache.get(
+        pk=study_cache.get(pk=study_id).study_type_id
+    ).is_jspsych
     videos_per_response = defaultdict(list)
     for video in consent_videos:
         recording_is_pipe = Video.objects.get(
@@ -168,19 +173,61 @@ def get_responses_with_current_rulings_and_videos(study_id, preview_only):
     return responses_for_study
 
 
-def studies_for_which_user_has_perm(user, study_perm: StudyPermission):
-    study_level_perm_study_ids = get_objects_for_user(
-        user, study_perm.prefixed_codename
-    ).values_list("id", flat=True)
-
-    umbrella_lab_perm = UMBRELLA_LAB_PERMISSION_MAP.get(study_perm)
-    labs_with_labwide_perms = get_objects_for_user(
-        user, umbrella_lab_perm.prefixed_codename
+def accessible_studies_cache_key(user_id, study_perm: StudyPermission) -> str:
+    version = cache.get_or_set(
+        ACCESSIBLE_STUDIES_VERSION_CACHE_KEY, lambda: uuid4().hex, None
     )
+    return f"accessible-studies:{version}:user:{user_id}:{study_perm.codename}"
 
-    return Study.objects.filter(
-        Q(lab__in=labs_with_labwide_perms) | Q(id__in=study_level_perm_study_ids)
-    )
+
+def _new_accessible_studies_version():
+    cache.set(ACCESSIBLE_STUDIES_VERSION_CACHE_KEY, uuid4().hex, None)
+
+
+def invalidate_accessible_studies():
+    """Drop every user's cached accessible study ids.
+
+    Done again when the current transaction commits, so ids that other requests cache from
+    the old permissions before then aren't kept.
+    """
+    _new_accessible_studies_version()
+    transaction.on_commit(_new_accessible_studies_version)
+
+
+def get_accessible_study_ids(user, study_perm: StudyPermission) -> frozenset:
+    """Get the ids of the studies a user has a study permission for.
+
+    That's studies they have the permission on, directly, through a group or site-wide, and
+    studies in labs where they have the umbrella lab permission. Cached per user and
+    permission until permissions, group or lab memberships change or a study is added or
+    removed. Inactive users have no access.
+    """
+    if not user.is_active:
+        return frozenset()
+    key = accessible_studies_cache_key(user.pk, study_perm)
+    study_ids = cache.get(key)
+    if study_ids is None:
+        study_level_perm_study_ids = get_objects_for_user(
+            user, study_perm.prefixed_codename
+        ).values_list("id", flat=True)
+
+        umbrella_lab_perm = UMBRELLA_LAB_PERMISSION_MAP.get(study_perm)
+        labs_with_labwide_perms = get_objects_for_user(
+            user, umbrella_lab_perm.prefixed_codename
+        )
+
+        study_ids = frozenset(
+            Study.objects.filter(
+                Q(lab__in=labs_with_labwide_perms)
+                | Q(id__in=study_level_perm_study_ids)
+            ).values_list("id", flat=True)
+        )
+        cache.set(key, study_ids, ACCESSIBLE_STUDIES_CACHE_TIMEOUT)
+    return study_ids
+
+
+def studies_for_which_user_has_perm(user, study_perm: StudyPermission):
+    return Study.objects.filter(id__in=get_accessible_study_ids(user, study_perm))
 
 
 def get_consent_statistics(study_id, preview_only):
@@ -274,16 +321,10 @@ def get_pending_responses_qs():
 
 
 def _build_study_list_base_qs(user):
-    """Build the base annotated queryset for the study list."""
-    annotated_responses_qs = get_annotated_responses_qs().only(
-        "id",
-        "completed",
-        "completed_consent_frame",
-        "date_created",
-        "date_modified",
-        "is_preview",
-    )
+    """Build the base annotated queryset for the study list.
 
+    Response counts and activity dates come from each study's StudyStats row.
+    """
     return (
         studies_for_which_user_has_perm(user, StudyPermission.READ_STUDY_DETAILS)
         # .select_related("lab")
@@ -308,44 +349,12 @@ def _build_study_list_base_qs(user):
             creator_name=Concat(
                 "creator__given_name", Value(" "), "creator__family_name"
             ),
-            completed_responses_count=SubqueryCount(
-                Response.objects.filter(
-                    study=OuterRef("pk"),
-                    is_preview=False,
-                    completed_consent_frame=True,
-                    completed=True,
-                ).values("id")
-            ),
-            incomplete_responses_count=SubqueryCount(
-                Response.objects.filter(
-                    study=OuterRef("pk"),
-                    is_preview=False,
-                    completed_consent_frame=True,
-                    completed=False,
-                ).values("id")
-            ),
-            valid_consent_count=SubqueryCount(
-                annotated_responses_qs.filter(
-                    study=OuterRef("pk"), is_preview=False, current_ruling="accepted"
-                )
-            ),
-            pending_consent_count=SubqueryCount(
-                annotated_responses_qs.filter(
-                    study=OuterRef("pk"), is_preview=False, current_ruling="pending"
-                )
-            ),
-            starting_date=Subquery(
-                StudyLog.objects.filter(study=OuterRef("pk"))
-                .order_by("-created_at")
-                .filter(action="active")
-                .values("created_at")[:1]
-            ),
-            ending_date=Subquery(
-                StudyLog.objects.filter(study=OuterRef("pk"))
-                .order_by("-created_at")
-                .filter(action="deactivated")
-                .values("created_at")[:1]
-            ),
+            completed_responses_count=Coalesce("stats__completed_responses_count", 0),
+            incomplete_responses_count=Coalesce("stats__incomplete_responses_count", 0),
+            valid_consent_count=Coalesce("stats__valid_consent_count", 0),
+            pending_consent_count=Coalesce("stats__pending_consent_count", 0),
+            starting_date=F("stats__starting_date"),
+            ending_date=F("stats__ending_date"),
             status_change_date_display=Coalesce(
                 F("status_change_date"),
                 Subquery(
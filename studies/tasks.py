@@ -1,6 +1,7 @@
 import csv
 import datetime
 import hashlib
+import json
 import logging
 import os
 import random
@@ -8,27 +9,41 @@ import secrets
 import shutil
 import stat
 import tempfile
+import threading
 import time
-from collections import Counter
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import partial
 from io import StringIO
-from itertools import starmap
+from itertools import chain, islice, starmap
 from operator import attrgetter, itemgetter
 from typing import Generator, NamedTuple
 
 import boto3
 import docker
+import fleep
 import requests
 from botocore.exceptions import ClientError, ParamValidationError
 from celery.utils.log import get_task_logger
+from dateutil import parser as dateutil_parser
 from django.conf import settings
-from django.db import connection
+from django.db.models import F, Q
 from django.utils import timezone
+from google.api_core.exceptions import GoogleAPIError, NotFound
 from google.cloud import storage as gc_storage
-from more_itertools import chunked, first, flatten, groupby_transform, map_reduce
+from more_itertools import (
+    chunked,
+    first,
+    flatten,
+    groupby_transform,
+    map_reduce,
+    quantify,
+)
 from stream_zip import ZIP_64, stream_zip
 
-from accounts.models import Child, Message, User
-from accounts.queries import get_child_eligibility_for_study
+from accounts.models import Child, Message, PendingAnnouncement, User
+from accounts.queries import EligibilityMatrix
 from project.celery import app
 from studies.experiment_builder import EmberFrameplayerBuilder
 from studies.helpers import send_mail
@@ -51,57 +66,13 @@ logger.addHandler(handler)
 
 S3_CLIENT = boto3.client("s3")
 
-MESSAGE_TARGET_QUERY = """
-WITH message_targets AS ( -- all valid user-child-study triplets
-    SELECT DISTINCT ac.user_id,
-                    ac.id as child_id,
-                    ss.study_id
-    FROM accounts_child ac
-             INNER JOIN accounts_user au on au.id = ac.user_id
-             CROSS JOIN (
-        SELECT id AS study_id
-        FROM studies_study
-        WHERE state = 'active'
-          AND public = true
-    ) ss
-    WHERE au.is_active = true
-      AND ac.deleted = false
-      AND au.email_new_studies = true
-        EXCEPT (
-        SELECT DISTINCT ac.user_id,
-                        sr.child_id,
-                        sr.study_id
-        FROM studies_response sr
-                 INNER JOIN accounts_child ac on sr.child_id = ac.id
-                 INNER JOIN studies_studytype sst on sr.study_type_id = sst.id
-        WHERE (sr.completed_consent_frame = true AND sst.id = 1)
-	            OR (sst.id = 2)
-    )
-),
-     latest_study_notifications_for_children AS (
-         SELECT amr.user_id,
-                amcoi.child_id,
-                am.related_study_id,
-                MAX(am.email_sent_timestamp) as latest_sent_time
-         FROM accounts_message am
-                  INNER JOIN accounts_message_children_of_interest amcoi on am.id = amcoi.message_id
-                  INNER JOIN accounts_message_recipients amr on am.id = amr.message_id
-         WHERE (amr.user_id, amcoi.child_id, am.related_study_id) IN (SELECT * FROM message_targets)
-         GROUP BY amr.user_id, amcoi.child_id, am.related_study_id
-     )
-SELECT mt.user_id,
-       mt.child_id,
-       mt.study_id
-FROM message_targets mt
-         LEFT OUTER JOIN latest_study_notifications_for_children lsnfc
-                         ON lsnfc.user_id = mt.user_id
-                             AND lsnfc.child_id = mt.child_id
-                             AND lsnfc.related_study_id = mt.study_id
-WHERE lsnfc.latest_sent_time IS NULL
-ORDER BY mt.user_id, mt.child_id, mt.study_id;
-"""
 MAX_EMAILS_PER_STUDY = 50
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Most keys S3 deletes in one DeleteObjects request.
+S3_DELETE_BATCH_SIZE = 1000
+
 
 class MessageTarget(NamedTuple):
     user_id: int
@@ -110,11 +81,18 @@ class MessageTarget(NamedTuple):
 
 
 def potential_message_targets(page_size: int = 2000):
-    """Enable us to stream from the database."""
-    with connection.cursor() as cursor:
-        cursor.execute(MESSAGE_TARGET_QUERY)
-        while page := cursor.fetchmany(page_size):
-            yield from starmap(MessageTarget, page)
+    """Stream pending announcements from the database, ordered by user.
+
+    The PendingAnnouncement table is maintained as studies, families, responses and sent
+    announcements change, so this only reads the current targets. Families who have since
+    deactivated or unsubscribed, and deleted children, are left out even if a change skipped
+    the signals that keep the table up to date."""
+    pending = PendingAnnouncement.objects.filter(
+        user__is_active=True, user__email_new_studies=True, child__deleted=False
+    ).order_by(
+        "user_id", "child_id", "study_id"
+    ).values_list("user_id", "child_id", "study_id")
+    yield from starmap(MessageTarget, pending.iterator(chunk_size=page_size))
 
 
 def _grouped_by_user(potential_targets):
@@ -176,17 +154,31 @@ def _deserialized(user_grouped_targets, number_of_parents: int = 100):
             )
 
 
-def _validated(deserialized_groups):
-    """Yield only groups with targets that satisfy criteria for their respective studies."""
-    for user, child_study_pairs in deserialized_groups:
-        valid_message_targets = []
-        for pair in child_study_pairs:
-            child, study = pair
-            eligible = get_child_eligibility_for_study(child, study)
-            if eligible:
-                valid_message_targets.append(pair)
-        if valid_message_targets:
-            yield user, valid_message_targets
+def _validated(deserialized_groups, number_of_parents: int = 100):
+    """Yield only groups with targets that satisfy criteria for their respective studies.
+
+    Eligibility is evaluated in batches of families with an EligibilityMatrix, so prior
+    participation is loaded once per batch rather than once per child-study pair.
+    """
+    for group_list in chunked(deserialized_groups, n=number_of_parents):
+        children = {
+            child.id: child
+            for _, child_study_pairs in group_list
+            for child, _ in child_study_pairs
+        }
+        studies = {
+            study.id: study
+            for _, child_study_pairs in group_list
+            for _, study in child_study_pairs
+        }
+        eligibility = EligibilityMatrix(children.values(), studies.values())
+
+        for user, child_study_pairs in group_list:
+            valid_message_targets = [
+                pair for pair in child_study_pairs if eligibility.is_eligible(*pair)
+            ]
+            if valid_message_targets:
+                yield user, valid_message_targets
 
 
 def _segmented_by_study(validated_groups):
@@ -207,36 +199,24 @@ def limit_email_targets(
 
     This is done AFTER deserializing to actual model objects so that we've already checked eligibility;
     otherwise we'd have to select a random sample of families to MAYBE email if they turn out to be
-    eligible each time."""
-
-    from studies.models import Study
+    eligible each time. The deserialized objects are kept as-is, so this stage makes no queries."""
 
-    # Iterate through generator with actual models to build a list of IDs
-    all_user_study_children_tuples = []
+    # Choose one study (and its eligible children) per family, grouping families by chosen study
+    targets_by_study = defaultdict(list)
     for user, study_child_mapping in potential_targets_segmented_by_study:
         study, child_list = secrets.choice(list(study_child_mapping.items()))
-        all_user_study_children_tuples.append(
-            (user.id, study.id, [child.id for child in child_list])
-        )
+        targets_by_study[study.id].append((user, study, child_list))
 
-    # Randomly select the first <= N study-user pairs for each study. We don't want to just yield the first N per study
+    # Randomly sample <= N families for each study. We don't want to just yield the first N per study
     # because then we'll always invite some families to participate first, others later
-    random.shuffle(all_user_study_children_tuples)
-    study_counts = Counter()
-    email_user_study_children_tuples = []
-    for user_id, study_id, child_id_list in all_user_study_children_tuples:
-        if study_counts[study_id] >= max_emails_per_study:
-            continue
-        email_user_study_children_tuples.append((user_id, study_id, child_id_list))
-        study_counts[study_id] += 1
-
-    # Now fetch the actual objects again
-    for user_id, study_id, child_id_list in email_user_study_children_tuples:
-        yield (
-            User.objects.get(id=user_id),
-            Study.objects.get(id=study_id),
-            [Child.objects.get(id=child_id) for child_id in child_id_list],
+    email_targets = list(
+        chain.from_iterable(
+            random.sample(targets, min(len(targets), max_emails_per_study))
+            for targets in targets_by_study.values()
         )
+    )
+    random.shuffle(email_targets)
+    yield from email_targets
 
 
 @app.task
@@ -248,15 +228,15 @@ def send_announcement_emails():
     the announcement email is sent, the message is saved down to the database and
     marked in a join table (`accounts_message_children_of_interest`) along with the
     targeted children such that those child-study pairs will be excluded from the next
-    (daily) round of potential targets.
+    (daily) round of potential targets. Families targeted about the same study are sent
+    their emails together, in batched provider requests.
     """
 
     targets = limit_email_targets(
         acquire_potential_announcement_email_targets(), MAX_EMAILS_PER_STUDY
     )
 
-    for user, study, child_list in targets:
-        Message.send_announcement_email(user, study, child_list)
+    Message.send_announcement_emails(targets)
 
 
 @app.task(bind=True, max_retries=10, retry_backoff=10)
@@ -303,6 +283,10 @@ def cleanup_builds(older_than=None):
     logger.debug("Cleaning up builds...")
     deployments = os.path.join(settings.EMBER_BUILD_ROOT_PATH, "deployments")
     cleanup_old_directories(deployments, older_than)
+    # Cached player builds are touched whenever a study build uses them.
+    player_cache = os.path.join(settings.EMBER_BUILD_ROOT_PATH, "player_cache")
+    if os.path.isdir(player_cache):
+        cleanup_old_directories(player_cache, older_than)
 
 
 @app.task
@@ -326,6 +310,83 @@ def cleanup_docker_containers():
     docker_client.containers.prune()
 
 
+@app.task
+def reconcile_study_stats():
+    """Recompute every study's stats, fixing drift from writes that skipped the signals."""
+    from studies.models import StudyStats
+
+    changed = StudyStats.refresh()
+    if changed:
+        logger.warning(f"Reconciled stats for {changed} studies.")
+
+
+def _download_to_spool(url, spool_max_size):
+    body = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+    try:
+        with requests.get(url, stream=True) as file_response:
+            for chunk in file_response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                body.write(chunk)
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return body
+
+
+def _close_download(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def prefetched_downloads(urls, workers, spool_max_size):
+    """Download urls ahead of the caller, yielding each body in the order of urls.
+
+    Up to `workers` downloads run at once. Each body is a file, held in memory up to
+    spool_max_size bytes and spooled to disk after that; the caller closes it. urls is read
+    lazily, so (e.g. signed) urls are only made shortly before they're fetched.
+    """
+    urls = iter(urls)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque(
+            executor.submit(_download_to_spool, url, spool_max_size)
+            for url in islice(urls, workers)
+        )
+        try:
+            while pending:
+                body = pending.popleft().result()
+                for url in islice(urls, 1):
+                    pending.append(
+                        executor.submit(_download_to_spool, url, spool_max_size)
+                    )
+                yield body
+        finally:
+            # Stopped early: don't start the rest, and discard what was already downloaded.
+            for future in pending:
+                future.cancel()
+                future.add_done_callback(_close_download)
+
+
+def videos_for_zip(video_qs):
+    """The videos to add to a zip, oldest first, so that incremental archives of a growing
+    study only add to the end.
+
+    The whole list is held while the zip is built, so each video only carries its name,
+    creation time and what view_url needs to know about its response and study type, rather
+    than its response's (possibly large) data.
+    """
+    return list(
+        video_qs.select_related("response__study_type", "study__study_type")
+        .only(
+            "full_name",
+            "created_at",
+            "response__recording_method",
+            "response__study_type__id",
+            "study__study_type__id",
+        )
+        .order_by("created_at", "pk")
+    )
+
+
 @app.task(bind=True, max_retries=10, retry_backoff=10)
 def build_zipfile_of_videos(
     self, filename, study_uuid, match, requesting_user_uuid, consent_only=False
@@ -344,21 +405,25 @@ def build_zipfile_of_videos(
         study.consent_videos if consent_only else study.videos_for_consented_responses
     )
 
-    if not requesting_user.has_study_perms(
+    can_read_responses = requesting_user.has_study_perms(
         StudyPermission.READ_STUDY_RESPONSE_DATA, study
-    ):
-        video_qs = video_qs.filter(response__is_preview=True)
-    if not requesting_user.has_study_perms(
+    )
+    can_read_previews = requesting_user.has_study_perms(
         StudyPermission.READ_STUDY_PREVIEW_DATA, study
-    ):
+    )
+    if not can_read_responses:
+        video_qs = video_qs.filter(response__is_preview=True)
+    if not can_read_previews:
         video_qs = video_qs.filter(response__is_preview=False)
 
     if match:
-        video_qs = video_qs.filter(full_name__contains=match)
+        video_qs = video_qs.filter(full_name__icontains=match)
+
+    videos = videos_for_zip(video_qs)
 
     m = hashlib.sha256()
 
-    for video in video_qs:
+    for video in videos:
         m.update(video.full_name.encode("utf-8"))
     # create a sha256 of the included filenames
     sha = m.hexdigest()
@@ -372,24 +437,52 @@ def build_zipfile_of_videos(
     gs_blob = gs_private_bucket.blob(zip_filename)
 
     # if the file exists short circuit and send the email with a 30m link
-    if not gs_blob.exists():
+    if gs_blob.exists():
+        pass
+    elif settings.VIDEO_ZIP_INCREMENTAL:
+        from studies.video_archives import VideoArchiveBuilder, archive_prefix
+
+        # Archives with the same videos to choose from share a manifest.
+        kind = hashlib.sha256(
+            json.dumps(
+                [filename, match, can_read_responses, can_read_previews]
+            ).encode()
+        ).hexdigest()[:16]
+        builder = VideoArchiveBuilder(
+            gs_private_bucket,
+            archive_prefix(study_uuid),
+            settings.VIDEO_ZIP_DOWNLOAD_WORKERS,
+            settings.VIDEO_ZIP_SPOOL_MAX_SIZE,
+        )
+        try:
+            builder.build(gs_blob, videos, kind)
+        except NotFound as e:
+            raise self.retry(exc=e)
+    else:
         # if it doesn't exist build the zipfile
-        total_videos = video_qs.count()
+        total_videos = len(videos)
 
         def file_iter():
-            for idx, video in enumerate(video_qs, start=1):
-                logger.info(
-                    f"Adding {video.full_name} to stream: file {idx} of {total_videos}"
-                )
-                file_response = requests.get(video.view_url, stream=True)
-                # file name, modified time, file mode, method, contents (stream)
-                yield (
-                    video.full_name,
-                    datetime.datetime.now(),
-                    stat.S_IFREG | 0o600,
-                    ZIP_64,
-                    file_response.iter_content(64 * 1024),
-                )
+            # Videos are downloaded concurrently, but added to the zip in order.
+            bodies = prefetched_downloads(
+                (video.view_url for video in videos),
+                settings.VIDEO_ZIP_DOWNLOAD_WORKERS,
+                settings.VIDEO_ZIP_SPOOL_MAX_SIZE,
+            )
+            with closing(bodies):
+                for idx, (video, body) in enumerate(zip(videos, bodies), start=1):
+                    logger.info(
+                        f"Adding {video.full_name} to stream: file {idx} of {total_videos}"
+                    )
+                    with body:
+                        # file name, modified time, file mode, method, contents (stream)
+                        yield (
+                            video.full_name,
+                            datetime.datetime.now(),
+                            stat.S_IFREG | 0o600,
+                            ZIP_64,
+                            iter(partial(body.read, DOWNLOAD_CHUNK_SIZE), b""),
+                        )
 
         # Stream zip directly to GCS (no temp file)
         with gs_blob.open("wb") as f:
@@ -491,59 +584,335 @@ def build_framedata_dict(filename, study_uuid, requesting_user_uuid):
     )
 
 
+def video_bucket_name(recording_method_is_pipe, study_type_is_jspsych):
+    if study_type_is_jspsych:
+        # lookit-jspsych bucket
+        return settings.JSPSYCH_S3_BUCKET
+    elif recording_method_is_pipe:
+        # Pipe bucket
+        return settings.BUCKET_NAME
+    else:
+        # RecordRTC bucket
+        return settings.S3_BUCKET_NAME
+
+
 @app.task(bind=True)
 def delete_video_from_cloud(
     task, s3_video_name, recording_method_is_pipe, study_type_is_jspsych
 ):
-    """Delete videos in S3.
+    """Delete a video in S3 right away.
 
-    Meant to have a delay of about 7 days.
+    Deleted Video objects' videos are queued as PendingVideoDeletions instead.
     """
-    if study_type_is_jspsych:
-        # delete from lookit-jspsych bucket
-        S3_RESOURCE.Object(settings.JSPSYCH_S3_BUCKET, s3_video_name).delete()
-    elif recording_method_is_pipe:
-        # delete from Pipe bucket
-        S3_RESOURCE.Object(settings.BUCKET_NAME, s3_video_name).delete()
-    else:
-        # delete from RecordRTC bucket
-        S3_RESOURCE.Object(settings.S3_BUCKET_NAME, s3_video_name).delete()
+    S3_RESOURCE.Object(
+        video_bucket_name(recording_method_is_pipe, study_type_is_jspsych),
+        s3_video_name,
+    ).delete()
+
+
+def video_deletion_retry_delay(attempts):
+    """Wait an hour after the first failure, doubling each time up to a day."""
+    return datetime.timedelta(hours=min(2 ** (attempts - 1), 24))
+
+
+def delete_archived_video_batch(deletions):
+    """Delete the video archive copies of pending deletions' videos, from the private GCS bucket.
+
+    Returns the keys whose copies couldn't be deleted, and their errors.
+    """
+    from studies.video_archives import delete_archived_videos
+
+    prefixes = map_reduce(
+        (deletion for deletion in deletions if deletion.archive_prefix),
+        keyfunc=attrgetter("archive_prefix"),
+        valuefunc=attrgetter("key"),
+    )
+    # Without cloud storage, no archives are built.
+    if not prefixes or not settings.GS_PRIVATE_BUCKET_NAME:
+        return {}
+
+    errors = {}
+    gs_client = gc_storage.client.Client(project=settings.GS_PROJECT_ID)
+    gs_private_bucket = gs_client.bucket(settings.GS_PRIVATE_BUCKET_NAME)
+    for prefix, keys in prefixes.items():
+        try:
+            delete_archived_videos(gs_private_bucket, prefix, keys)
+        except GoogleAPIError as error:
+            logger.error(f"Failed to delete archived videos under {prefix}: {error}")
+            errors.update((key, str(error)) for key in keys)
+    return errors
+
+
+def delete_video_batch(bucket, deletions):
+    """Delete a batch of at most S3_DELETE_BATCH_SIZE pending deletions' objects from bucket.
+
+    Deleted objects' rows are removed; the rest are put off to retry. Returns the failed keys
+    and their errors.
+    """
+    from studies.models import PendingVideoDeletion
+
+    # Delete any copies kept for video archives first, so that they're retried until gone.
+    archive_errors = delete_archived_video_batch(deletions)
+    try:
+        response = S3_CLIENT.delete_objects(
+            Bucket=bucket,
+            Delete={
+                "Objects": [{"Key": deletion.key} for deletion in deletions],
+                "Quiet": True,
+            },
+        )
+        errors = {
+            error["Key"]: f"{error.get('Code')}: {error.get('Message')}"
+            for error in response.get("Errors", [])
+        }
+    except (ClientError, ParamValidationError) as error:
+        logger.error(f"Failed to delete a batch of videos from {bucket}: {error}")
+        errors = {deletion.key: str(error) for deletion in deletions}
+    errors = {**archive_errors, **errors}
+
+    PendingVideoDeletion.objects.filter(
+        id__in=[deletion.id for deletion in deletions if deletion.key not in errors]
+    ).delete()
+    now = timezone.now()
+    for deletion in deletions:
+        if deletion.key in errors:
+            deletion.attempts += 1
+            deletion.last_error = errors[deletion.key]
+            deletion.due_at = now + video_deletion_retry_delay(deletion.attempts)
+    PendingVideoDeletion.objects.bulk_update(
+        [deletion for deletion in deletions if deletion.key in errors],
+        ["attempts", "last_error", "due_at"],
+    )
+    return errors
+
+
+@app.task
+def delete_pending_videos():
+    """Delete the S3 objects of deleted videos that are due, S3_DELETE_BATCH_SIZE per request.
+
+    Returns the number deleted and failed, by bucket.
+    """
+    from studies.models import PendingVideoDeletion
+
+    started_at = timezone.now()
+    due = PendingVideoDeletion.objects.filter(due_at__lte=started_at)
+    report = {}
+    for bucket in due.order_by().values_list("bucket", flat=True).distinct():
+        report[bucket] = {"deleted": 0, "failed": 0}
+        # Deleted rows go away and failed ones are put off, so each batch is new.
+        while deletions := list(
+            due.filter(bucket=bucket).order_by("due_at", "id")[:S3_DELETE_BATCH_SIZE]
+        ):
+            errors = delete_video_batch(bucket, deletions)
+            report[bucket]["deleted"] += len(deletions) - len(errors)
+            report[bucket]["failed"] += len(errors)
+            for key, error in errors.items():
+                logger.warning(f"Failed to delete {key} from {bucket}: {error}")
+
+    logger.info(f"Deleted pending videos: {report}")
+    return report
+
+
+@app.task
+def process_pipe_upload(pipe_upload_id):
+    """Rename a Pipe upload's video and create its Video, unless that's been done already.
+
+    A run claims the upload before processing it, so concurrent runs for the same upload leave
+    it to the first until its claim runs out (PipeUpload.CLAIM_TIMEOUT). The video is copied
+    without holding a transaction or lock open. Failures are recorded on the row for
+    process_pending_pipe_uploads to retry.
+    """
+    from studies.models import PipeUpload, Video
+
+    now = timezone.now()
+    claimed = (
+        PipeUpload.objects.filter(pk=pipe_upload_id, processed_at__isnull=True)
+        .filter(
+            Q(claimed_at__isnull=True)
+            | Q(claimed_at__lt=now - PipeUpload.CLAIM_TIMEOUT)
+        )
+        .update(claimed_at=now)
+    )
+    if not claimed:
+        return
+
+    upload = PipeUpload.objects.filter(pk=pipe_upload_id)
+    try:
+        video = Video.from_pipe_payload(upload.values_list("payload", flat=True).get())
+        upload.update(processed_at=timezone.now(), claimed_at=None)
+    except Exception as error:
+        logger.warning(f"Failed to process Pipe upload {pipe_upload_id}: {error!r}")
+        upload.update(
+            attempts=F("attempts") + 1, last_error=repr(error), claimed_at=None
+        )
+        return
+    return video.full_name
+
+
+@app.task
+def process_pending_pipe_uploads():
+    """Queue Pipe uploads that should have been processed by now to be processed again, and
+    forget those processed long ago.
+
+    Returns the number queued.
+    """
+    from studies.models import PipeUpload
+
+    now = timezone.now()
+    pending = (
+        PipeUpload.objects.filter(
+            processed_at__isnull=True,
+            attempts__lt=PipeUpload.MAX_ATTEMPTS,
+            received_at__lt=now - datetime.timedelta(minutes=5),
+        )
+        .filter(
+            Q(claimed_at__isnull=True)
+            | Q(claimed_at__lt=now - PipeUpload.CLAIM_TIMEOUT)
+        )
+        .values_list("id", flat=True)
+    )
+    queued = 0
+    for pipe_upload_id in pending.iterator():
+        process_pipe_upload.delay(pipe_upload_id)
+        queued += 1
+    PipeUpload.objects.filter(
+        processed_at__lt=now - datetime.timedelta(days=30)
+    ).delete()
+
+    if queued:
+        logger.warning(f"Queued {queued} pending Pipe uploads to be processed again.")
+    return queued
+
+
+class UploadRecoveryReport(NamedTuple):
+    """What happened to one incomplete upload."""
+
+    bucket_name: str
+    completed: bool
+    had_parts: bool
+    seconds: float
+    error: Exception = None
+
+
+def recover_incomplete_upload(bucket_name, video, bucket_slots):
+    """Complete an incomplete upload from its parts, if it has any, holding one of the
+    bucket's slots while talking to S3."""
+    logger.debug(f"Handling incomplete file: {video['Key']}")
+    start = time.perf_counter()
+    completed = had_parts = False
+    error = None
+    with bucket_slots:
+        try:
+            parts = get_file_parts(bucket_name, video["Key"], video["UploadId"])
+            had_parts = bool(parts)
+            if parts:
+                completed = complete_multipart_upload(
+                    bucket_name, video["Key"], video["UploadId"], parts
+                )
+        except Exception as e:
+            logger.error(f"Failed to recover {video['Key']} in {bucket_name}: {e}")
+            error = e
+    return UploadRecoveryReport(
+        bucket_name, bool(completed), had_parts, time.perf_counter() - start, error
+    )
+
+
+def summarize_upload_recovery(reports):
+    """Counts and latencies of recovered uploads, by bucket."""
+    summary = {}
+    for bucket_name, bucket_reports in map_reduce(
+        reports, keyfunc=attrgetter("bucket_name")
+    ).items():
+        seconds = sorted(report.seconds for report in bucket_reports)
+        summary[bucket_name] = {
+            "uploads": len(bucket_reports),
+            "completed": quantify(bucket_reports, attrgetter("completed")),
+            "without_parts": quantify(
+                bucket_reports, lambda report: not report.had_parts
+            ),
+            "failed": quantify(bucket_reports, lambda report: report.error is not None),
+            "median_seconds": round(seconds[len(seconds) // 2], 3),
+            "max_seconds": round(seconds[-1], 3),
+        }
+    return summary
 
 
 @app.task(bind=True)
 def cleanup_incomplete_video_uploads(task, *args, **kwargs):
-    """Check for incomplete multi-part uploads in S3 and try to manually complete the video."""
+    """Check for incomplete multi-part uploads in S3 and try to manually complete the video.
+
+    Uploads are completed on a pool of VIDEO_UPLOAD_RECOVERY_WORKERS threads, with at most
+    VIDEO_UPLOAD_RECOVERY_BUCKET_CONCURRENCY at a time in any one bucket. Returns counts and
+    latencies by bucket; if any upload failed, the first error is raised once the rest are done.
+    """
     # kwargs were added to the task later, so default to the original (hard-coded) S3 bucket name for backwards compatibility
     bucket_names = kwargs.get("bucket_names", ["S3_BUCKET_NAME"])
 
-    for bucket_var_name in bucket_names:
-        try:
-            bucket_name = getattr(settings, bucket_var_name)
-        except AttributeError:
-            logger.error(f"Invalid S3 bucket setting: {bucket_var_name}")
-            continue
+    futures = []
+    with ThreadPoolExecutor(
+        max_workers=settings.VIDEO_UPLOAD_RECOVERY_WORKERS
+    ) as executor:
+        for bucket_var_name in bucket_names:
+            try:
+                bucket_name = getattr(settings, bucket_var_name)
+            except AttributeError:
+                logger.error(f"Invalid S3 bucket setting: {bucket_var_name}")
+                continue
 
-        logger.debug(f"Cleaning up incomplete video uploads in bucket: {bucket_name}")
-        incomplete_video_uploads = get_all_incomplete_video_files(bucket_name)
-        if incomplete_video_uploads:
-            for video in incomplete_video_uploads:
-                logger.debug(f"Handling incomplete file: {video['Key']}")
-                parts = get_file_parts(bucket_name, video["Key"], video["UploadId"])
-                if parts:
-                    complete_multipart_upload(
-                        bucket_name, video["Key"], video["UploadId"], parts
-                    )
+            logger.debug(
+                f"Cleaning up incomplete video uploads in bucket: {bucket_name}"
+            )
+            bucket_slots = threading.BoundedSemaphore(
+                settings.VIDEO_UPLOAD_RECOVERY_BUCKET_CONCURRENCY
+            )
+            futures.extend(
+                executor.submit(
+                    recover_incomplete_upload, bucket_name, video, bucket_slots
+                )
+                for video in get_all_incomplete_video_files(bucket_name)
+            )
+
+    reports = [future.result() for future in futures]
+    summary = summarize_upload_recovery(reports)
+    for bucket_name, bucket_summary in summary.items():
+        logger.info(f"Incomplete video uploads in {bucket_name}: {bucket_summary}")
+    errors = [report.error for report in reports if report.error]
+    if errors:
+        raise errors[0]
+    return summary
 
 
 def get_all_incomplete_video_files(bucket_name):
     """Gets a list of all incomplete multipart uploads from our EFP RecordRTC S3 video bucket.
     Returns an array with 0 or more objects, where each object corresponds to an incomplete multipart upload.
     Each object contains the following keys: UploadId, Key (filename), Initiated (timestamp), StorageClass, Owner (DisplayName and ID), Initiator (DisplayName and ID).
+    S3 lists at most 1,000 uploads per request, so this follows the listing's pages to the end.
     """
     incomplete_uploads = []
+    page_markers = {}
+
+    while page_markers is not None:
+        uploads_response = _list_multipart_uploads_page(bucket_name, page_markers)
+        incomplete_uploads.extend(
+            _uploads_older_than_a_day(bucket_name, uploads_response)
+        )
+        page_markers = (
+            {
+                "KeyMarker": uploads_response["NextKeyMarker"],
+                "UploadIdMarker": uploads_response["NextUploadIdMarker"],
+            }
+            if uploads_response.get("IsTruncated")
+            else None
+        )
+
+    return incomplete_uploads
+
 
+def _list_multipart_uploads_page(bucket_name, page_markers):
     try:
-        uploads_response = S3_CLIENT.list_multipart_uploads(Bucket=bucket_name)
+        uploads_response = S3_CLIENT.list_multipart_uploads(
+            Bucket=bucket_name, **page_markers
+        )
     except ClientError as error:
         logger.error(f"Failed to list multipart uploads due to a ClientError: {error}")
         raise error
@@ -560,7 +929,11 @@ def get_all_incomplete_video_files(bucket_name):
             f"S3 response for multipart uploads for bucket {bucket_name} is None."
         )
         raise ValueError("Received invalid response from S3: None")
+    return uploads_response
+
 
+def _uploads_older_than_a_day(bucket_name, uploads_response):
+    incomplete_uploads = []
     # Using try/except here because there are a number of other ways this could go wrong (Uploads is missing from response, Uploads value is None or not an array, etc.)
     try:
         # Filter out incomplete uploads that might still be actively recording - started in last 24 hours.
@@ -599,11 +972,29 @@ def get_all_incomplete_video_files(bucket_name):
 def get_file_parts(bucket_name, filename, id):
     """Gets the uploaded part list for a particular incomplete video upload.
     Returns an array with 0 or more objects, where each object contains a part number and ETag for all parts that were successfully uploaded.
+    Like the uploads, parts are listed up to 1,000 at a time, so this follows every page.
     """
     parts = []
+    page_marker = {}
+
+    while page_marker is not None:
+        file_parts_response = _list_parts_page(bucket_name, filename, id, page_marker)
+        parts.extend(_parts_to_complete(bucket_name, filename, file_parts_response))
+        page_marker = (
+            {"PartNumberMarker": file_parts_response["NextPartNumberMarker"]}
+            if file_parts_response.get("IsTruncated")
+            else None
+        )
+
+    if parts == []:
+        logger.debug(f"Unable to complete {filename}: Empty Parts array.")
+    return parts
+
+
+def _list_parts_page(bucket_name, filename, id, page_marker):
     try:
         file_parts_response = S3_CLIENT.list_parts(
-            Bucket=bucket_name, Key=filename, UploadId=id
+            Bucket=bucket_name, Key=filename, UploadId=id, **page_marker
         )
     except ClientError as error:
         logger.error(
@@ -626,15 +1017,17 @@ def get_file_parts(bucket_name, filename, id):
             f"S3 response for upload parts for file {filename} in bucket {bucket_name} is None."
         )
         raise ValueError("Received invalid response from S3: None")
+    return file_parts_response
+
 
+def _parts_to_complete(bucket_name, filename, file_parts_response):
+    parts = []
     # Using try/except here because there are a few other ways this could go wrong ("Parts" is None or not an array, no "PartNumber" or "Etag" keys, etc.)
     try:
         parts = [
             {"PartNumber": part["PartNumber"], "ETag": eval(part["ETag"])}
             for part in file_parts_response["Parts"]
         ]
-        if parts == []:
-            logger.debug(f"Unable to complete {filename}: Empty Parts array.")
     except KeyError as error:
         if error.args[0] == "Parts":
             # This is expected and not a problem - no need to re-raise the error.
@@ -658,6 +1051,7 @@ def get_file_parts(bucket_name, filename, id):
 def complete_multipart_upload(bucket_name, filename, id, parts):
     """Attempt to complete the multi-part upload for a given incomplete file.
     Takes the filename, upload ID, and list of parts for the incomplete file.
+    Returns whether the upload was completed.
     """
     try:
         resp = S3_CLIENT.complete_multipart_upload(
@@ -673,6 +1067,7 @@ def complete_multipart_upload(bucket_name, filename, id, parts):
         ):
             if resp["ResponseMetadata"]["HTTPStatusCode"] == 200:
                 logger.debug(f"Completed file {filename}")
+                return True
             else:
                 logger.debug(
                     f"File {filename} returned HTTP Status Code {resp['ResponseMetadata']['HTTPStatusCode']}"
@@ -696,3 +1091,161 @@ def complete_multipart_upload(bucket_name, filename, id, parts):
     except Exception as error:
         logger.error(f"Failed to complete file {filename}: Unknown error type")
         raise error
+    return False
+
+
+# Enough of a video to tell its file type.
+VIDEO_HEADER_RANGE = "bytes=0-31"
+
+
+class EventVideo(NamedTuple):
+    """A video recorded according to the event timings of one of a response's frames."""
+
+    video_id: str
+    pipe_name: str
+    recorded_at: datetime.datetime
+    frame_id: str
+    is_consent_footage: bool
+    response_id: int
+    study_id: int
+
+
+class VideoBackfillReport(NamedTuple):
+    """What backfill_videos_from_events found and did."""
+
+    responses: int
+    event_videos: int
+    duplicates: int
+    existing: int
+    missing: int
+    created: int
+    seconds: float
+
+
+def videos_in_events(response):
+    """Videos that were recorded in each of the response's frames, in order, once each."""
+    seen_ids = set()
+    if not isinstance(response.exp_data, dict):
+        return
+    for frame_id, event_data in response.exp_data.items():
+        if not (event_data.get("videoList") and event_data.get("videoId")):
+            continue
+        for event in event_data.get("eventTimings", []):
+            video_id = event["videoId"]
+            pipe_name = event["pipeId"]  # what we call "ID" they call "name"
+            if video_id not in seen_ids and pipe_name and event["streamTime"] > 0:
+                seen_ids.add(video_id)
+                yield EventVideo(
+                    video_id,
+                    pipe_name,
+                    dateutil_parser.parse(event["timestamp"]),
+                    frame_id,
+                    event_data.get("frameType") == "CONSENT",
+                    response.id,
+                    response.study_id,
+                )
+
+
+def find_event_video(bucket_name, event_video):
+    """An unsaved Video for the event video's file in S3, which is named for its video ID or
+    else its Pipe name, or None if it's under neither.
+
+    Only the file's header is read, to tell its file type.
+    """
+    from studies.models import Video
+
+    for name in (event_video.video_id, event_video.pipe_name):
+        try:
+            response = S3_CLIENT.get_object(
+                Bucket=bucket_name, Key=f"{name}.mp4", Range=VIDEO_HEADER_RANGE
+            )
+        except ClientError:
+            continue
+        with closing(response["Body"]) as body:
+            file_info = fleep.get(body.read())
+        extension = file_info.extension[0] if file_info.extension else "mp4"
+        return Video(
+            pipe_name=event_video.pipe_name,
+            s3_timestamp=event_video.recorded_at,
+            frame_id=event_video.frame_id,
+            full_name=f"{event_video.video_id}.{extension}",
+            study_id=event_video.study_id,
+            response_id=event_video.response_id,
+            is_consent_footage=event_video.is_consent_footage,
+        )
+
+    logger.warning(
+        f"could not find {event_video.video_id} or {event_video.pipe_name} in S3!"
+    )
+    return None
+
+
+def backfill_videos_from_events(
+    responses, bucket_name, workers, batch_size, dry_run=False
+):
+    """Create Videos for the videos in these responses' events that don't have them yet.
+
+    Videos are looked for in S3 batch_size at a time, on a pool of workers threads, and each
+    batch's Videos are created together. A video ID seen in an earlier response isn't looked
+    for again.
+    """
+    from studies.models import Video
+
+    start = time.perf_counter()
+    seen_ids = set()
+    counts = defaultdict(int)
+
+    def new_event_videos():
+        for response in responses:
+            counts["responses"] += 1
+            for event_video in videos_in_events(response):
+                counts["event_videos"] += 1
+                if event_video.video_id in seen_ids:
+                    counts["duplicates"] += 1
+                    continue
+                seen_ids.add(event_video.video_id)
+                yield event_video
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch in chunked(new_event_videos(), batch_size):
+            existing_pipe_names = set(
+                Video.objects.filter(
+                    pipe_name__in=[event_video.pipe_name for event_video in batch]
+                ).values_list("pipe_name", flat=True)
+            )
+            batch = [
+                event_video
+                for event_video in batch
+                if event_video.pipe_name not in existing_pipe_names
+            ]
+            counts["existing"] += len(existing_pipe_names)
+
+            found = [
+                video
+                for video in executor.map(partial(find_event_video, bucket_name), batch)
+                if video
+            ]
+            counts["missing"] += len(batch) - len(found)
+
+            existing_names = set(
+                Video.objects.filter(
+                    full_name__in=[video.full_name for video in found]
+                ).values_list("full_name", flat=True)
+            )
+            new_videos = [
+                video for video in found if video.full_name not in existing_names
+            ]
+            counts["existing"] += len(found) - len(new_videos)
+            if not dry_run:
+                Video.objects.bulk_create(new_videos, ignore_conflicts=True)
+            counts["created"] += len(new_videos)
+
+    return VideoBackfillReport(
+        counts["responses"],
+        counts["event_videos"],
+        counts["duplicates"],
+        counts["existing"],
+        counts["missing"],
+        counts["created"],
+        time.perf_counter() - start,
+    )
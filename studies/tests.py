@@ -1,47 +1,99 @@
+import io
 import json
+import os
 import re
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from contextlib import nullcontext
 from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
 from unittest.mock import patch
 
 from botocore.exceptions import ClientError, ParamValidationError
 from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.core.validators import URLValidator
+from django.template.loader import get_template
 from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils.safestring import mark_safe
+from django.utils.timezone import now as timezone_now
 from django_dynamic_fixture import G, N
+from google.api_core.exceptions import NotFound
 from guardian.shortcuts import assign_perm
 from more_itertools import quantify
 
-from accounts.models import Child, Message, User
+from accounts.models import (
+    Child,
+    Message,
+    PendingAnnouncement,
+    SubstitutionKeys,
+    User,
+    create_string_listing_children,
+)
+from attachment_helpers import S3_CLIENT
+from project.celery import app
+from project.model_cache import cache_stats
+from project.sendgrid_backend import FakeSendGridBackend
+from project.storages import LocalExperimentStorage
+from studies.experiment_builder import (
+    CACHED_BUILD_STUDY_UUID,
+    DirectoryTargets,
+    EmberFrameplayerBuilder,
+    deploy_to_remote,
+    download_repos,
+)
 from studies.helpers import (
     ResponseEligibility,
     get_absolute_url,
     get_experiment_absolute_url,
     send_mail,
+    send_personalized_mail,
 )
 from studies.models import (
+    ACCEPTED,
+    REJECTED,
+    ConsentRuling,
     Lab,
+    PendingVideoDeletion,
     Response,
     Study,
     StudyLog,
+    StudyStats,
     StudyType,
     StudyTypeEnum,
     Video,
+    lab_cache,
+    study_cache,
 )
 from studies.permissions import StudyPermission
+from studies.queries import (
+    _build_study_list_base_qs,
+    accessible_studies_cache_key,
+    get_accessible_study_ids,
+)
 from studies.tasks import (
     MessageTarget,
     acquire_potential_announcement_email_targets,
     cleanup_incomplete_video_uploads,
     complete_multipart_upload,
+    delete_pending_videos,
     get_all_incomplete_video_files,
     get_file_parts,
     limit_email_targets,
     potential_message_targets,
+    prefetched_downloads,
+    reconcile_study_stats,
+    videos_for_zip,
 )
+from studies.video_archives import VideoArchiveBuilder, delete_archived_videos
 
 TARGET_EMAIL_TEMPLATE = """
 Dear Charlie,
@@ -367,6 +419,64 @@ class TestAnnouncementEmailFunctionality(TestCase):
             any(m.child_id == child.id for m in potential_message_targets())
         )
 
+    def test_pending_announcements_follow_study_and_family_changes(self):
+        targets = set(potential_message_targets())
+        study_two_target = MessageTarget(
+            user_id=self.participant_two.id,
+            child_id=self.child_two.id,
+            study_id=self.study_two.id,
+        )
+        self.assertIn(study_two_target, targets)
+
+        # Rebuilding from scratch gives the same targets as incremental maintenance
+        PendingAnnouncement.refresh()
+        self.assertEqual(set(potential_message_targets()), targets)
+
+        self.study_two.state = "paused"
+        self.study_two.save()
+        self.assertFalse(
+            any(mt.study_id == self.study_two.id for mt in potential_message_targets())
+        )
+
+        self.study_two.state = "active"
+        self.study_two.save()
+        self.assertIn(study_two_target, potential_message_targets())
+
+        self.participant_two.email_new_studies = False
+        self.participant_two.save()
+        self.assertFalse(
+            any(
+                mt.user_id == self.participant_two.id
+                for mt in potential_message_targets()
+            )
+        )
+
+    def test_unsubscribed_family_gets_no_announcements(self):
+        unsubscribe = reverse(
+            "web:email-unsubscribe-link",
+            kwargs={
+                "username": self.participant_two.username,
+                "token": self.participant_two.generate_token(),
+            },
+        )
+        self.client.post(unsubscribe)
+
+        self.assertFalse(
+            PendingAnnouncement.objects.filter(user=self.participant_two).exists()
+        )
+        self.assertEqual(list(acquire_potential_announcement_email_targets()), [])
+
+    def test_targets_skip_families_unsubscribed_without_signals(self):
+        User.objects.filter(pk=self.participant_two.pk).update(
+            email_new_studies=False
+        )
+        self.assertFalse(
+            any(
+                mt.user_id == self.participant_two.id
+                for mt in potential_message_targets()
+            )
+        )
+
     def test_target_creation_e2e(self):
         targets = list(acquire_potential_announcement_email_targets())
 
@@ -447,6 +557,20 @@ class TestAnnouncementEmailFunctionality(TestCase):
             self.study_one in target_studies or self.study_two in target_studies
         )
 
+    def test_limit_email_targets_makes_no_queries(self):
+        potential_targets = list(acquire_potential_announcement_email_targets())
+
+        with self.assertNumQueries(0):
+            targets = list(
+                limit_email_targets(iter(potential_targets), len(potential_targets))
+            )
+
+        self.assertEqual(len(targets), len(potential_targets))
+        for user, study, child_list in targets:
+            self.assertIsInstance(user, User)
+            self.assertIsInstance(study, Study)
+            self.assertTrue(all(isinstance(child, Child) for child in child_list))
+
     def test_correct_message_structure(self):
         token = self.participant_two.generate_token()
         username = self.participant_two.username
@@ -499,6 +623,82 @@ class TestAnnouncementEmailFunctionality(TestCase):
             'Larry, Moe, and Curly are invited to take part in "The Most Fake Study Ever" on Lookit (Children Helping Science)!',
         )
 
+    @patch.object(User, "generate_token", return_value="t0k3n:a.b-c_d=")
+    def test_batched_announcements_match_individual_emails(self, mock_token):
+        awkward_parent = G(
+            User,
+            username="o'brien+lookit@example.com",
+            nickname="Mary & Joe",
+            is_active=True,
+        )
+        awkward_child = G(
+            Child, user=awkward_parent, given_name="Zoë <3", birthday=date.today()
+        )
+        targets = [
+            (self.participant_two, self.study_two, [self.child_two, self.child_three]),
+            (awkward_parent, self.study_two, [awkward_child]),
+            (self.participant_two, self.study_one, [self.child_three]),
+        ]
+
+        message_objects = Message.send_announcement_emails(targets)
+
+        self.assertEqual(len(mail.outbox), 3)
+        for (user, study, children), message_object, email in zip(
+            targets, message_objects, mail.outbox
+        ):
+            context = {
+                "user": user,
+                "study": study,
+                "children": children,
+                "children_string": create_string_listing_children(children),
+                "username": user.username,
+                "token": user.generate_token(),
+            }
+            self.assertEqual(
+                message_object.body,
+                get_template("emails/study_announcement.txt").render(context),
+            )
+            self.assertEqual(email.body, message_object.body)
+            self.assertEqual(
+                email.alternatives[0][0],
+                get_template("emails/study_announcement.html").render(context),
+            )
+            self.assertEqual(email.to, [user.username])
+            self.assertEqual(email.subject, message_object.subject)
+            self.assertEqual(set(message_object.recipients.all()), {user})
+            self.assertEqual(
+                set(message_object.children_of_interest.all()), set(children)
+            )
+            self.assertIsNotNone(message_object.email_sent_timestamp)
+
+    @override_settings(EMAIL_BACKEND="project.sendgrid_backend.FakeSendGridBackend")
+    def test_batched_announcements_use_one_request_per_study(self):
+        FakeSendGridBackend.requests.clear()
+        other_parent = G(User, is_active=True)
+        other_child = G(Child, user=other_parent, birthday=date.today())
+
+        Message.send_announcement_emails(
+            [
+                (self.participant_two, self.study_two, [self.child_two]),
+                (other_parent, self.study_two, [other_child]),
+            ]
+        )
+
+        self.assertEqual(len(FakeSendGridBackend.requests), 1)
+        personalizations = FakeSendGridBackend.requests[0]["personalizations"]
+        self.assertEqual(
+            [personalization["to"] for personalization in personalizations],
+            [
+                [{"email": self.participant_two.username}],
+                [{"email": other_parent.username}],
+            ],
+        )
+        for personalization, user in zip(
+            personalizations, [self.participant_two, other_parent]
+        ):
+            self.assertIn(user.username, personalization["substitutions"].values())
+            self.assertIn(user.username, personalization["headers"]["List-Unsubscribe"])
+
     def test_email_contains_valid_urls(self):
         validator = URLValidator()
         # The validator should catch various malformed URLs
@@ -717,6 +917,65 @@ class TestSendMail(TestCase):
             "Email image attachment does not have expected headers",
         )
 
+    @override_settings(EMAIL_BACKEND="project.sendgrid_backend.FakeSendGridBackend")
+    @patch("project.sendgrid_backend.MAX_PERSONALIZATIONS_PER_REQUEST", 2)
+    def test_send_personalized_mail_batches_requests(self):
+        FakeSendGridBackend.requests.clear()
+        keys = SubstitutionKeys.new()
+        personalizations = [
+            {
+                "to": f"parent{i}@example.com",
+                "substitutions": {keys.username: f"parent{i}@example.com"},
+            }
+            for i in range(5)
+        ]
+
+        send_personalized_mail(
+            "custom_email",
+            "Test email",
+            personalizations,
+            reply_to=["lab@example.com"],
+            custom_message=mark_safe(f"<p>Hello {keys.username}</p>"),
+            username=keys.username,
+            token=self.context["token"],
+        )
+
+        self.assertEqual(
+            [
+                len(request["personalizations"])
+                for request in FakeSendGridBackend.requests
+            ],
+            [2, 2, 1],
+        )
+        self.assertIn(
+            f"<p>Hello {keys.username}</p>",
+            FakeSendGridBackend.requests[0]["content"][1]["value"],
+        )
+
+    def test_send_personalized_mail_without_sendgrid(self):
+        keys = SubstitutionKeys.new()
+        send_personalized_mail(
+            "custom_email",
+            "Test email",
+            [
+                {
+                    "to": f"parent{i}@example.com",
+                    "substitutions": {keys.username: f"parent{i}@example.com"},
+                }
+                for i in range(2)
+            ],
+            custom_message=mark_safe(f"<p>Hello {keys.username}</p>"),
+            username=keys.username,
+            token=self.context["token"],
+        )
+
+        self.assertEqual(len(mail.outbox), 2)
+        for i, email in enumerate(mail.outbox):
+            self.assertEqual(email.to, [f"parent{i}@example.com"])
+            self.assertIn(
+                f"<p>Hello parent{i}@example.com</p>", email.alternatives[0][0]
+            )
+
     def test_empty_reply_to(self):
         reply_to = []
         email = send_mail(
@@ -848,6 +1107,11 @@ class StudyTypeModelTestCase(TestCase):
         self.assertFalse(StudyType.get_jspsych().is_ember_frame_player)
         self.assertFalse(StudyType.get_jspsych().is_external)
 
+    def test_get_study_type_is_cached(self):
+        StudyType.get_jspsych()
+        with self.assertNumQueries(0):
+            self.assertTrue(StudyType.get_jspsych().is_jspsych)
+
 
 class StudyModelTestCase(TestCase):
     def test_responses_for_researcher_external_studies(self):
@@ -870,6 +1134,274 @@ class StudyModelTestCase(TestCase):
         self.assertIn(response, study.responses_for_researcher(user))
 
 
+class StudyGroupLabelsTestCase(TestCase):
+    def setUp(self):
+        self.study = G(Study, study_type=StudyType.get_ember_frame_player())
+        self.admin = G(User, is_active=True, is_researcher=True)
+        self.previewer = G(User, is_active=True, is_researcher=True)
+        self.outsider = G(User, is_active=True, is_researcher=True)
+        self.study.admin_group.user_set.add(self.admin)
+        self.study.preview_group.user_set.add(self.admin, self.previewer)
+
+    def test_get_group_of_researcher(self):
+        self.assertEqual(self.study.get_group_of_researcher(self.admin), "Admin")
+        self.assertEqual(self.study.get_group_of_researcher(self.previewer), "Preview")
+        self.assertIsNone(self.study.get_group_of_researcher(self.outsider))
+
+    def test_researchers_with_study_groups(self):
+        study = Study.objects.get(pk=self.study.pk)
+        with self.assertNumQueries(1):
+            labels = {
+                user.pk: study.group_label(user.study_group_ids)
+                for user in study.researchers_with_study_groups()
+            }
+        self.assertEqual(labels, {self.admin.pk: "Admin", self.previewer.pk: "Preview"})
+
+
+class ModelCacheTestCase(TestCase):
+    def test_cached_rows_are_read_once(self):
+        study = G(
+            Study, name="Cached study", study_type=StudyType.get_ember_frame_player()
+        )
+        hits = cache_stats()["studies.Study"]["hits"]
+
+        study_cache.get(uuid=study.uuid)
+        with self.assertNumQueries(0):
+            self.assertEqual(study_cache.get(uuid=study.uuid).name, "Cached study")
+            self.assertEqual(study_cache.get(uuid=study.uuid).pk, study.pk)
+
+        self.assertEqual(cache_stats()["studies.Study"]["hits"], hits + 2)
+
+    def test_save_and_delete_invalidate_cached_rows(self):
+        lab = G(Lab, name="Old name", slug="cached-lab")
+        self.assertEqual(lab_cache.get(slug="cached-lab").name, "Old name")
+
+        lab.name = "New name"
+        lab.save()
+        self.assertEqual(lab_cache.get(slug="cached-lab").name, "New name")
+        self.assertEqual(lab_cache.get(pk=lab.pk).name, "New name")
+
+        lab.delete()
+        with self.assertRaises(Lab.DoesNotExist):
+            lab_cache.get(slug="cached-lab")
+
+    def test_only_declared_lookups_are_cached(self):
+        with self.assertRaises(ValueError):
+            study_cache.get(name="Cached study")
+
+
+class AccessibleStudiesTestCase(TestCase):
+    def setUp(self):
+        self.lab = G(Lab, name="MIT")
+        self.study = G(
+            Study, lab=self.lab, study_type=StudyType.get_ember_frame_player()
+        )
+        self.researcher = G(User, is_active=True, is_researcher=True)
+
+    def test_accessible_study_ids_are_cached(self):
+        self.study.researcher_group.user_set.add(self.researcher)
+        perm = StudyPermission.READ_STUDY_RESPONSE_DATA
+
+        self.assertEqual(
+            get_accessible_study_ids(self.researcher, perm), {self.study.pk}
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                get_accessible_study_ids(self.researcher, perm), {self.study.pk}
+            )
+
+    def test_group_changes_invalidate_accessible_study_ids(self):
+        perm = StudyPermission.READ_STUDY_PREVIEW_DATA
+        self.assertEqual(get_accessible_study_ids(self.researcher, perm), set())
+
+        self.study.preview_group.user_set.add(self.researcher)
+        self.assertEqual(
+            get_accessible_study_ids(self.researcher, perm), {self.study.pk}
+        )
+
+        self.study.preview_group.user_set.remove(self.researcher)
+        self.assertEqual(get_accessible_study_ids(self.researcher, perm), set())
+
+    def test_ids_cached_before_commit_are_invalidated_on_commit(self):
+        perm = StudyPermission.READ_STUDY_PREVIEW_DATA
+        self.study.preview_group.user_set.add(self.researcher)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.study.preview_group.user_set.remove(self.researcher)
+            # A concurrent request, which can't see the removal yet, caches the old ids.
+            cache.set(
+                accessible_studies_cache_key(self.researcher.pk, perm),
+                frozenset({self.study.pk}),
+            )
+
+        self.assertEqual(get_accessible_study_ids(self.researcher, perm), set())
+
+    def test_new_lab_studies_invalidate_accessible_study_ids(self):
+        self.lab.admin_group.user_set.add(self.researcher)
+        perm = StudyPermission.READ_STUDY_DETAILS
+        self.assertEqual(
+            get_accessible_study_ids(self.researcher, perm), {self.study.pk}
+        )
+
+        new_study = G(Study, lab=self.lab, study_type=self.study.study_type)
+        self.assertEqual(
+            get_accessible_study_ids(self.researcher, perm),
+            {self.study.pk, new_study.pk},
+        )
+
+    def test_revoking_superuser_invalidates_accessible_study_ids(self):
+        perm = StudyPermission.READ_STUDY_RESPONSE_DATA
+        self.researcher.is_superuser = True
+        self.researcher.save()
+        self.assertEqual(
+            get_accessible_study_ids(self.researcher, perm), {self.study.pk}
+        )
+
+        self.researcher.is_superuser = False
+        self.researcher.save()
+        self.assertEqual(get_accessible_study_ids(self.researcher, perm), set())
+
+    def test_deactivating_user_invalidates_accessible_study_ids(self):
+        self.study.researcher_group.user_set.add(self.researcher)
+        perm = StudyPermission.READ_STUDY_RESPONSE_DATA
+        self.assertEqual(
+            get_accessible_study_ids(self.researcher, perm), {self.study.pk}
+        )
+
+        self.researcher.is_active = False
+        self.researcher.save()
+        self.assertEqual(get_accessible_study_ids(self.researcher, perm), set())
+
+
+class StudyStatsTestCase(TestCase):
+    def setUp(self):
+        self.study = G(Study, lab=G(Lab), study_type=StudyType.get_ember_frame_player())
+        self.parent = G(User, is_active=True)
+        self.child = G(Child, user=self.parent, birthday=date.today())
+
+    def create_response(self, **kwargs):
+        return Response.objects.create(
+            study=self.study,
+            child=self.child,
+            study_type=self.study.study_type,
+            demographic_snapshot=self.parent.latest_demographics,
+            **kwargs,
+        )
+
+    def assertStats(self, **expected):
+        stats = StudyStats.objects.get(study=self.study)
+        self.assertEqual({field: getattr(stats, field) for field in expected}, expected)
+
+    def test_new_study_has_empty_stats(self):
+        self.assertStats(
+            completed_responses_count=0,
+            incomplete_responses_count=0,
+            valid_consent_count=0,
+            pending_consent_count=0,
+            starting_date=None,
+            ending_date=None,
+        )
+
+    def test_response_counts_follow_response_changes(self):
+        self.create_response(completed_consent_frame=True, is_preview=True)
+        response = self.create_response()
+        self.assertStats(incomplete_responses_count=0, pending_consent_count=0)
+
+        response.completed_consent_frame = True
+        response.save()
+        self.assertStats(incomplete_responses_count=1, pending_consent_count=1)
+
+        response = Response.objects.get(pk=response.pk)
+        response.completed = True
+        response.save()
+        response.save()
+        self.assertStats(
+            completed_responses_count=1,
+            incomplete_responses_count=0,
+            pending_consent_count=1,
+        )
+
+        response.delete()
+        self.assertStats(completed_responses_count=0, pending_consent_count=0)
+
+    def test_consent_counts_follow_rulings(self):
+        response = self.create_response(completed_consent_frame=True)
+        response.consent_rulings.create(action="accepted")
+        self.assertStats(valid_consent_count=1, pending_consent_count=0)
+
+        rejection = response.consent_rulings.create(action="rejected")
+        self.assertStats(valid_consent_count=0, pending_consent_count=0)
+
+        rejection.delete()
+        self.assertStats(valid_consent_count=1, pending_consent_count=0)
+
+    def test_drifted_counts_stop_at_zero(self):
+        response = self.create_response(completed_consent_frame=True)
+        StudyStats.objects.filter(study=self.study).update(
+            incomplete_responses_count=0, pending_consent_count=0
+        )
+
+        response.completed = True
+        response.save()
+        self.assertStats(
+            completed_responses_count=1,
+            incomplete_responses_count=0,
+            pending_consent_count=0,
+        )
+
+    def test_deleting_uncounted_responses_skips_recount(self):
+        preview = self.create_response(completed_consent_frame=True, is_preview=True)
+        preview.consent_rulings.create(action="accepted")
+        unconsented = self.create_response()
+
+        with patch.object(StudyStats, "refresh") as refresh:
+            preview.delete()
+            unconsented.delete()
+        refresh.assert_not_called()
+
+    def test_reconcile_is_routed_to_a_worker_queue(self):
+        self.assertEqual(
+            app.amqp.router.route({}, "studies.tasks.reconcile_study_stats")[
+                "queue"
+            ].name,
+            "cleanup",
+        )
+
+    def test_dates_follow_study_logs(self):
+        log = StudyLog.objects.create(study=self.study, action="active")
+        self.assertStats(starting_date=log.created_at, ending_date=None)
+
+        log = StudyLog.objects.create(study=self.study, action="deactivated")
+        self.assertStats(ending_date=log.created_at)
+
+    def test_study_list_counts_come_from_stats(self):
+        self.create_response(completed_consent_frame=True, completed=True)
+        StudyStats.objects.filter(study=self.study).update(valid_consent_count=5)
+        researcher = G(User, is_active=True, is_researcher=True)
+        self.study.admin_group.user_set.add(researcher)
+        Study.objects.filter(pk=self.study.pk).update(creator=researcher)
+
+        study = _build_study_list_base_qs(researcher).get(pk=self.study.pk)
+
+        self.assertEqual(study.completed_responses_count, 1)
+        self.assertEqual(study.valid_consent_count, 5)
+
+    def test_reconcile_fixes_drift(self):
+        self.create_response(completed_consent_frame=True)
+        Response.objects.filter(study=self.study).update(completed=True)
+        StudyStats.objects.filter(study=self.study).delete()
+        other_study = G(Study, lab=G(Lab), study_type=self.study.study_type)
+
+        reconcile_study_stats()
+
+        self.assertStats(
+            completed_responses_count=1,
+            incomplete_responses_count=0,
+            pending_consent_count=1,
+        )
+        self.assertEqual(StudyStats.refresh(study_ids=[other_study.pk]), 0)
+
+
 class DaysSubmittedTestCase(TestCase):
     def setUp(self):
         self.study = G(
@@ -1096,6 +1628,31 @@ class VideoModelTestCase(TestCase):
         self.assertFalse(self.videos[2].recording_method_is_recordrtc)
         self.assertFalse(self.videos[6].recording_method_is_recordrtc)
 
+    @patch.object(S3_CLIENT, "generate_presigned_url")
+    def test_videos_for_zip_only_load_what_urls_need(self, mock_url):
+        videos = videos_for_zip(Video.objects.filter(study=self.study))
+        self.assertEqual(
+            [video.full_name for video in videos],
+            [video.full_name for video in self.videos],
+        )
+        with self.assertNumQueries(0):
+            for video in videos:
+                video.view_url
+        self.assertEqual(
+            [call.kwargs["Params"] for call in mock_url.call_args_list],
+            [
+                {
+                    "Bucket": settings.BUCKET_NAME
+                    if video.recording_method_is_pipe
+                    else settings.S3_BUCKET_NAME,
+                    "Key": video.full_name,
+                }
+                for video in self.videos
+            ],
+        )
+        self.assertIn("exp_data", videos[0].response.get_deferred_fields())
+        self.assertIn("metadata", videos[0].study.get_deferred_fields())
+
 
 class ResponseEligibilityTestCase(TestCase):
     def setUp(self):
@@ -1618,6 +2175,436 @@ test_bucket_var_name_2 = "FAKE_BUCKET_VAR_2"
 test_bucket_name_2 = "another-fake-bucket"
 
 
+class FakeDownload:
+    def __init__(self, url, stream=False):
+        self.url = url
+
+    def __enter__(self):
+        # Later videos finish first, so the order they're yielded in isn't download order.
+        time.sleep(0.05 / int(self.url.rsplit("/", 1)[1]))
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield self.url.encode()
+
+
+@patch("studies.tasks.requests.get", FakeDownload)
+class PrefetchedDownloadsTestCase(TestCase):
+    def test_bodies_are_yielded_in_url_order(self):
+        urls = [f"https://bucket/{n}" for n in range(1, 11)]
+        bodies = [
+            body.read() for body in prefetched_downloads(urls, 4, spool_max_size=1)
+        ]
+        self.assertEqual(bodies, [url.encode() for url in urls])
+
+    def test_urls_are_read_as_they_are_needed(self):
+        read = []
+
+        def urls():
+            for n in range(1, 11):
+                read.append(n)
+                yield f"https://bucket/{n}"
+
+        bodies = prefetched_downloads(urls(), 3, spool_max_size=1024)
+        self.assertEqual(next(bodies).read(), b"https://bucket/1")
+        self.assertEqual(read, [1, 2, 3, 4])
+        bodies.close()
+        self.assertEqual(read, [1, 2, 3, 4])
+
+
+class CurrentConsentRulingTestCase(TestCase):
+    def test_newest_ruling_is_current(self):
+        study = G(Study, study_type=StudyType.get_ember_frame_player())
+        response = G(
+            Response,
+            study=study,
+            child=G(Child, user=G(User), birthday=date.today()),
+            completed_consent_frame=True,
+        )
+        video = G(Video, study=study, response=response, s3_timestamp=timezone_now())
+        accepted = G(ConsentRuling, response=response, action=ACCEPTED)
+        self.assertEqual(list(study.videos_for_consented_responses), [video])
+
+        rejected = G(ConsentRuling, response=response, action=REJECTED)
+        self.assertEqual(
+            list(response.consent_rulings.filter(is_current=True)), [rejected]
+        )
+        self.assertFalse(study.videos_for_consented_responses.exists())
+
+        rejected.delete()
+        self.assertEqual(
+            list(response.consent_rulings.filter(is_current=True)), [accepted]
+        )
+        self.assertEqual(list(study.videos_for_consented_responses), [video])
+
+
+class PendingVideoDeletionTestCase(TestCase):
+    def setUp(self):
+        self.now = timezone_now()
+        self.due = self.now - timedelta(minutes=1)
+
+    def pending(self, key, bucket="pipe-bucket", due_at=None):
+        return PendingVideoDeletion.objects.create(
+            bucket=bucket, key=key, due_at=due_at or self.due
+        )
+
+    @override_settings(BUCKET_NAME="pipe-bucket")
+    def test_deleting_video_queues_its_object(self):
+        study = G(Study, study_type=StudyType.get_ember_frame_player())
+        response = G(
+            Response,
+            study=study,
+            child=G(Child, user=G(User), birthday=date.today()),
+            recording_method="pipe",
+        )
+        video = G(
+            Video,
+            s3_timestamp=self.now,
+            full_name="pipe0",
+            study=study,
+            response=response,
+        )
+
+        with patch("studies.tasks.S3_RESOURCE") as s3_resource:
+            response.delete()
+
+        s3_resource.Object.assert_not_called()
+        deletion = PendingVideoDeletion.objects.get()
+        self.assertEqual(
+            (deletion.bucket, deletion.key, deletion.archive_prefix),
+            ("pipe-bucket", video.full_name, f"video-archives/{study.uuid}"),
+        )
+        self.assertGreaterEqual(deletion.due_at, self.now + timedelta(days=7))
+
+    @patch("studies.tasks.S3_DELETE_BATCH_SIZE", 2)
+    @patch("studies.tasks.S3_CLIENT")
+    def test_due_deletions_are_batched_by_bucket(self, s3_client):
+        s3_client.delete_objects.return_value = {}
+        for key in ("a", "b", "c"):
+            self.pending(key)
+        self.pending("d", bucket="rtc-bucket")
+        later = self.pending("e", due_at=self.now + timedelta(days=1))
+
+        report = delete_pending_videos()
+
+        self.assertEqual(
+            report,
+            {
+                "pipe-bucket": {"deleted": 3, "failed": 0},
+                "rtc-bucket": {"deleted": 1, "failed": 0},
+            },
+        )
+        self.assertEqual(
+            sorted(
+                (
+                    call.kwargs["Bucket"],
+                    [item["Key"] for item in call.kwargs["Delete"]["Objects"]],
+                )
+                for call in s3_client.delete_objects.call_args_list
+            ),
+            [
+                ("pipe-bucket", ["a", "b"]),
+                ("pipe-bucket", ["c"]),
+                ("rtc-bucket", ["d"]),
+            ],
+        )
+        self.assertQuerySetEqual(PendingVideoDeletion.objects.all(), [later])
+
+    @patch("studies.tasks.S3_CLIENT")
+    def test_failed_deletions_are_retried_later(self, s3_client):
+        s3_client.delete_objects.return_value = {
+            "Errors": [{"Key": "b", "Code": "AccessDenied", "Message": "Denied"}]
+        }
+        self.pending("a")
+        self.pending("b")
+
+        report = delete_pending_videos()
+
+        self.assertEqual(report, {"pipe-bucket": {"deleted": 1, "failed": 1}})
+        failed = PendingVideoDeletion.objects.get()
+        self.assertEqual(failed.key, "b")
+        self.assertEqual(failed.attempts, 1)
+        self.assertEqual(failed.last_error, "AccessDenied: Denied")
+        self.assertGreater(failed.due_at, self.now + timedelta(minutes=59))
+
+    @override_settings(GS_PRIVATE_BUCKET_NAME="private-bucket")
+    @patch("studies.tasks.gc_storage")
+    @patch("studies.tasks.S3_CLIENT")
+    def test_archived_copies_are_deleted(self, s3_client, gc_storage):
+        s3_client.delete_objects.return_value = {}
+        bucket = FakeBucket()
+        gc_storage.client.Client.return_value.bucket.return_value = bucket
+        for name in ("a", "b"):
+            bucket.blob(f"video-archives/study/members/{name}").upload_from_string(name)
+        PendingVideoDeletion.objects.create(
+            bucket="pipe-bucket",
+            key="a",
+            due_at=self.due,
+            archive_prefix="video-archives/study",
+        )
+
+        report = delete_pending_videos()
+
+        self.assertEqual(report, {"pipe-bucket": {"deleted": 1, "failed": 0}})
+        self.assertEqual(list(bucket.objects), ["video-archives/study/members/b"])
+
+    @patch("studies.tasks.delete_archived_video_batch")
+    @patch("studies.tasks.S3_CLIENT")
+    def test_failed_archived_copy_deletions_are_retried_later(
+        self, s3_client, delete_archived_video_batch
+    ):
+        s3_client.delete_objects.return_value = {}
+        delete_archived_video_batch.return_value = {"a": "Service unavailable"}
+        self.pending("a")
+
+        report = delete_pending_videos()
+
+        self.assertEqual(report, {"pipe-bucket": {"deleted": 0, "failed": 1}})
+        failed = PendingVideoDeletion.objects.get()
+        self.assertEqual(failed.last_error, "Service unavailable")
+
+    @patch("studies.tasks.S3_CLIENT")
+    def test_failed_batches_are_retried_later(self, s3_client):
+        s3_client.delete_objects.side_effect = ClientError(
+            {"Error": {"Code": "SlowDown", "Message": "Slow down"}}, "DeleteObjects"
+        )
+        self.pending("a", due_at=self.due)
+        PendingVideoDeletion.objects.update(attempts=5)
+
+        report = delete_pending_videos()
+
+        self.assertEqual(report, {"pipe-bucket": {"deleted": 0, "failed": 1}})
+        failed = PendingVideoDeletion.objects.get()
+        self.assertEqual(failed.attempts, 6)
+        self.assertGreater(failed.due_at, self.now + timedelta(hours=23))
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = None
+        self.content_type = None
+
+    @property
+    def size(self):
+        return len(self.bucket.objects[self.name])
+
+    def open(self, mode):
+        blob = self
+
+        class Writer(io.BytesIO):
+            def close(self):
+                blob.bucket.objects[blob.name] = self.getvalue()
+                blob.bucket.metadata[blob.name] = blob.metadata
+                super().close()
+
+        return Writer()
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = (
+            data.encode() if isinstance(data, str) else data
+        )
+
+    def download_as_bytes(self):
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        return self.bucket.objects[self.name]
+
+    def compose(self, sources):
+        self.bucket.compose_calls += 1
+        self.bucket.objects[self.name] = b"".join(
+            source.download_as_bytes() for source in sources
+        )
+
+    def delete(self):
+        if self.bucket.objects.pop(self.name, None) is None:
+            raise NotFound(self.name)
+
+
+class FakeBucket:
+    def __init__(self):
+        self.objects = {}
+        self.metadata = {}
+        self.compose_calls = 0
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix, delimiter=None):
+        for name in list(self.objects):
+            if not name.startswith(prefix):
+                continue
+            if delimiter and delimiter in name[len(prefix) :]:
+                continue
+            blob = FakeBlob(self, name)
+            blob.metadata = {
+                key: str(value)
+                for key, value in (self.metadata.get(name) or {}).items()
+            }
+            yield blob
+
+
+@patch("studies.tasks.requests.get", FakeDownload)
+class VideoArchiveBuilderTestCase(TestCase):
+    def setUp(self):
+        self.bucket = FakeBucket()
+        self.builder = VideoArchiveBuilder(
+            self.bucket, "video-archives/study", workers=2, spool_max_size=1024
+        )
+        self.videos = [self.video(n) for n in range(1, 6)]
+
+    def video(self, n):
+        return SimpleNamespace(
+            full_name=f"videoStream_{n}.mp4",
+            created_at=datetime(2024, 1, n, 12, 30, tzinfo=timezone.utc),
+            view_url=f"https://bucket/{n}",
+        )
+
+    def archive(self, name):
+        with zipfile.ZipFile(io.BytesIO(self.bucket.objects[name])) as archive:
+            self.assertIsNone(archive.testzip())
+            return {info.filename: archive.read(info) for info in archive.infolist()}
+
+    def test_archive_has_videos_in_order(self):
+        self.builder.build(self.bucket.blob("first.zip"), self.videos, "all")
+
+        self.assertEqual(
+            list(self.archive("first.zip").items()),
+            [(video.full_name, video.view_url.encode()) for video in self.videos],
+        )
+
+    def test_empty_archive(self):
+        self.builder.build(self.bucket.blob("empty.zip"), [], "all")
+
+        self.assertEqual(self.archive("empty.zip"), {})
+
+    @patch("studies.video_archives.COMPOSE_LIMIT", 3)
+    def test_new_archive_only_adds_new_videos(self):
+        self.builder.build(self.bucket.blob("first.zip"), self.videos[:4], "all")
+        data_objects = [name for name in self.bucket.objects if name.endswith(".data")]
+        self.bucket.compose_calls = 0
+
+        with patch("studies.tasks.requests.get", wraps=FakeDownload) as get:
+            self.builder.build(self.bucket.blob("second.zip"), self.videos, "all")
+
+        get.assert_called_once_with("https://bucket/5", stream=True)
+        # Previous data and the new member, then the data and the central directory.
+        self.assertEqual(self.bucket.compose_calls, 2)
+        self.assertEqual(
+            list(self.archive("second.zip")),
+            [video.full_name for video in self.videos],
+        )
+        self.assertFalse(set(data_objects) & set(self.bucket.objects))
+
+    @patch("studies.video_archives.COMPOSE_LIMIT", 3)
+    def test_changed_archive_is_composed_from_stored_members(self):
+        self.builder.build(self.bucket.blob("first.zip"), self.videos, "all")
+
+        with patch("studies.tasks.requests.get", wraps=FakeDownload) as get:
+            self.builder.build(self.bucket.blob("second.zip"), self.videos[::-1], "all")
+
+        get.assert_not_called()
+        self.assertEqual(
+            list(self.archive("second.zip")),
+            [video.full_name for video in self.videos[::-1]],
+        )
+
+    def test_deleting_videos_deletes_archives_including_them(self):
+        self.builder.build(self.bucket.blob("all.zip"), self.videos, "all")
+        self.builder.build(self.bucket.blob("some.zip"), self.videos[:2], "some")
+        self.builder.build(self.bucket.blob("others.zip"), self.videos[3:], "others")
+
+        delete_archived_videos(
+            self.bucket, "video-archives/study", [self.videos[0].full_name]
+        )
+
+        self.assertEqual(
+            sorted(
+                name
+                for name in self.bucket.objects
+                if name.startswith("video-archives/study/")
+            ),
+            sorted(
+                [
+                    *(
+                        f"video-archives/study/members/{video.full_name}"
+                        for video in self.videos[1:]
+                    ),
+                    "video-archives/study/others.json",
+                    json.loads(self.bucket.objects["video-archives/study/others.json"])[
+                        "data"
+                    ],
+                ]
+            ),
+        )
+
+        # Building the archive again uploads the videos it still has from their members.
+        with patch("studies.tasks.requests.get", wraps=FakeDownload) as get:
+            self.builder.build(self.bucket.blob("all-2.zip"), self.videos[1:], "all")
+        get.assert_not_called()
+        self.assertEqual(
+            list(self.archive("all-2.zip")),
+            [video.full_name for video in self.videos[1:]],
+        )
+
+
+class FakePagedS3Client:
+    """Lists multipart uploads and parts a page at a time, like S3 does 1,000 at a time."""
+
+    page_size = 2
+
+    def __init__(self, uploads, parts_per_upload=3):
+        initiated = datetime.now(timezone.utc) - timedelta(days=2)
+        self.uploads = [
+            {"Key": key, "UploadId": f"{key}-id", "Initiated": initiated}
+            for key in uploads
+        ]
+        self.parts_per_upload = parts_per_upload
+        self.completed = []
+        self.in_progress = 0
+        self.most_in_progress = 0
+        self.lock = threading.Lock()
+
+    def list_multipart_uploads(self, Bucket, KeyMarker=None, UploadIdMarker=None):
+        start = 0
+        if KeyMarker:
+            start = [upload["Key"] for upload in self.uploads].index(KeyMarker) + 1
+        page = self.uploads[start : start + self.page_size]
+        truncated = start + self.page_size < len(self.uploads)
+        response = {"Uploads": page, "IsTruncated": truncated}
+        if truncated:
+            response["NextKeyMarker"] = page[-1]["Key"]
+            response["NextUploadIdMarker"] = page[-1]["UploadId"]
+        return response
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0):
+        numbers = range(PartNumberMarker + 1, self.parts_per_upload + 1)[
+            : self.page_size
+        ]
+        truncated = bool(numbers) and numbers[-1] < self.parts_per_upload
+        response = {
+            "Parts": [{"PartNumber": n, "ETag": f'"etag{n}"'} for n in numbers],
+            "IsTruncated": truncated,
+        }
+        if truncated:
+            response["NextPartNumberMarker"] = numbers[-1]
+        return response
+
+    def complete_multipart_upload(self, Bucket, Key, MultipartUpload, UploadId):
+        with self.lock:
+            self.in_progress += 1
+            self.most_in_progress = max(self.most_in_progress, self.in_progress)
+        time.sleep(0.02)
+        with self.lock:
+            self.in_progress -= 1
+            self.completed.append((Key, MultipartUpload["Parts"]))
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
 class TestListIncompleteVideoUploads(TestCase):
     # Patch the S3_CLIENT directly (instead of boto3) because it has already been created globally in the module
     @patch("studies.tasks.S3_CLIENT")
@@ -1801,6 +2788,14 @@ class TestListIncompleteVideoUploads(TestCase):
         with self.assertRaises(ValueError):
             get_all_incomplete_video_files(test_bucket_name)
 
+    def test_follows_pages_of_uploads(self):
+        s3_client = FakePagedS3Client([f"file{n}" for n in range(5)])
+
+        with patch("studies.tasks.S3_CLIENT", s3_client):
+            result = get_all_incomplete_video_files(test_bucket_name)
+
+        self.assertEqual(result, s3_client.uploads)
+
 
 class TestListFilePartsFromIncompleteUpload(TestCase):
     # Patch the S3_CLIENT directly (instead of boto3) because it has already been created globally in the module
@@ -1905,6 +2900,13 @@ class TestListFilePartsFromIncompleteUpload(TestCase):
         with self.assertRaises(ValueError):
             get_file_parts(test_bucket_name, "example_video.webm", "upload-id-123")
 
+    def test_follows_pages_of_parts(self):
+        with patch("studies.tasks.S3_CLIENT", FakePagedS3Client([], 5)):
+            result = get_file_parts(test_bucket_name, "example_video.webm", "id")
+
+        self.assertEqual([part["PartNumber"] for part in result], [1, 2, 3, 4, 5])
+        self.assertEqual(result[0]["ETag"], "etag1")
+
 
 class TestCompleteMultipartUpload(TestCase):
     # Patch the logger from studies.tasks to test execution in logs, because this function doesn't return anything
@@ -2212,6 +3214,28 @@ class TestVideoCleanupTaskWithMultipleBuckets(TestCase):
             f"Cleaning up incomplete video uploads in bucket: {test_bucket_name_2}"
         )
 
+    @override_settings(
+        VIDEO_UPLOAD_RECOVERY_WORKERS=8, VIDEO_UPLOAD_RECOVERY_BUCKET_CONCURRENCY=2
+    )
+    def test_cleanup_videos_task_limits_concurrency_per_bucket(self):
+        s3_client = FakePagedS3Client([f"video{n}.webm" for n in range(6)])
+
+        with patch("studies.tasks.S3_CLIENT", s3_client):
+            summary = cleanup_incomplete_video_uploads(
+                bucket_names=[test_bucket_var_name]
+            )
+
+        self.assertEqual(len(s3_client.completed), 6)
+        self.assertEqual(s3_client.most_in_progress, 2)
+        self.assertEqual(
+            {
+                key: value
+                for key, value in summary[test_bucket_name].items()
+                if not key.endswith("seconds")
+            },
+            {"uploads": 6, "completed": 6, "without_parts": 0, "failed": 0},
+        )
+
     @patch("studies.tasks.get_all_incomplete_video_files")
     @patch("studies.tasks.logger")
     def test_cleanup_videos_task_skips_invalid_bucket(
@@ -2242,6 +3266,314 @@ class TestVideoCleanupTaskWithMultipleBuckets(TestCase):
         self.override.disable()
 
 
+class PlayerBuildCacheTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.local_paths = DirectoryTargets(
+            checkouts=os.path.join(self.root.name, "checkouts"),
+            deployments=os.path.join(self.root.name, "deployments"),
+        )
+        self.player_cache_path = os.path.join(self.root.name, "player_cache")
+        self.compiled = 0
+
+    def fake_container(self, checkout_directory, build_directory):
+        self.compiled += 1
+        output = os.path.join(self.player_cache_path, build_directory, "assets")
+        os.makedirs(output)
+        with open(os.path.join(output, "app.js"), "w") as f:
+            f.write(f'prepend: "/studies/{CACHED_BUILD_STUDY_UUID}/"')
+        with open(os.path.join(output, "logo.png"), "wb") as f:
+            f.write(b"\x89PNG")
+        return "compiled"
+
+    def build(self, study_uuid):
+        builder = EmberFrameplayerBuilder(
+            build_stages=("get_player_build", "prepare_deployment"),
+            study_uuid=study_uuid,
+            player_repo_url="https://github.com/lookit/ember-lookit-frameplayer",
+            player_sha="a" * 40,
+            local_paths=self.local_paths,
+            player_cache_path=self.player_cache_path,
+        )
+        for stage in builder.build_stages:
+            builder._do_stage(stage)
+        with open(
+            os.path.join(self.local_paths.deployments, str(study_uuid), "assets/app.js")
+        ) as f:
+            return f.read()
+
+    def test_player_is_compiled_once_per_sha(self):
+        first_uuid, second_uuid = uuid.uuid4(), uuid.uuid4()
+        with (
+            patch.object(EmberFrameplayerBuilder, "build_docker_image") as build_image,
+            patch(
+                "studies.experiment_builder.download_repos",
+                return_value=("a" * 40, "a" * 40),
+            ),
+            patch.object(
+                EmberFrameplayerBuilder, "run_docker_container", self.fake_container
+            ),
+        ):
+            self.assertEqual(
+                self.build(first_uuid), f'prepend: "/studies/{first_uuid}/"'
+            )
+            self.assertEqual(
+                self.build(second_uuid), f'prepend: "/studies/{second_uuid}/"'
+            )
+
+        self.assertEqual(self.compiled, 1)
+        build_image.assert_called_once()
+        self.assertEqual(len(os.listdir(self.player_cache_path)), 1)
+        with open(
+            os.path.join(
+                self.local_paths.deployments, str(second_uuid), "assets/logo.png"
+            ),
+            "rb",
+        ) as f:
+            self.assertEqual(f.read(), b"\x89PNG")
+
+
+class DownloadReposTestCase(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.checkouts = os.path.join(root.name, "checkouts")
+        self.sha = "b" * 40
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            zip_file.writestr(f"ember-lookit-frameplayer-{self.sha}/", "")
+            zip_file.writestr(
+                f"ember-lookit-frameplayer-{self.sha}/package.json",
+                '{"name": "player"}',
+            )
+        self.archive = archive.getvalue()
+        self.downloads = 0
+
+    def fake_get(self, url, stream=False):
+        self.assertTrue(stream)
+        self.downloads += 1
+        # Give other builds a chance to start checking out the same sha.
+        time.sleep(0.05)
+        response = SimpleNamespace(
+            raise_for_status=lambda: None,
+            iter_content=lambda chunk_size: (
+                self.archive[i : i + 10] for i in range(0, len(self.archive), 10)
+            ),
+        )
+        return nullcontext(response)
+
+    def download(self):
+        return download_repos(
+            "https://github.com/lookit/ember-lookit-frameplayer",
+            player_sha=self.sha,
+            checkouts_path=self.checkouts,
+        )
+
+    def test_concurrent_builds_download_a_sha_once(self):
+        results = []
+        with patch("studies.experiment_builder.requests.get", self.fake_get):
+            threads = [
+                threading.Thread(target=lambda: results.append(self.download()))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(self.downloads, 1)
+        self.assertEqual(results, [(self.sha, self.sha)] * 4)
+        with open(os.path.join(self.checkouts, self.sha, "package.json")) as f:
+            self.assertEqual(f.read(), '{"name": "player"}')
+        self.assertEqual(
+            sorted(os.listdir(self.checkouts)), [self.sha, f"{self.sha}.lock"]
+        )
+
+    def test_failed_download_leaves_no_checkout(self):
+        archive, self.archive = self.archive, self.archive[: len(self.archive) // 2]
+        with (
+            patch("studies.experiment_builder.requests.get", self.fake_get),
+            self.assertRaises(zipfile.BadZipFile),
+        ):
+            self.download()
+        self.assertEqual(os.listdir(self.checkouts), [f"{self.sha}.lock"])
+
+        # The next build downloads it again.
+        self.archive = archive
+        with patch("studies.experiment_builder.requests.get", self.fake_get):
+            self.download()
+        self.assertEqual(self.downloads, 2)
+        self.assertTrue(os.path.isdir(os.path.join(self.checkouts, self.sha)))
+
+
+class DeployToRemoteTestCase(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.deployment = os.path.join(root.name, "deployments", "study-uuid")
+        self.storage = LocalExperimentStorage(
+            location=os.path.join(root.name, "remote")
+        )
+        self.write("index.html", "<html></html>")
+        self.write("assets/app.js", "app")
+        self.write("assets/vendor.js", "vendor")
+
+    def write(self, path, contents):
+        path = os.path.join(self.deployment, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(contents)
+
+    def remote(self, path):
+        with self.storage.open(f"study-uuid/{path}") as f:
+            return f.read().decode()
+
+    def test_only_changes_are_deployed(self):
+        self.assertEqual(
+            deploy_to_remote(self.deployment, self.storage, workers=4),
+            {"uploaded": 3, "unchanged": 0, "deleted": 0},
+        )
+        self.assertEqual(self.remote("assets/app.js"), "app")
+
+        self.write("assets/app.js", "new app")
+        self.write("assets/extra.js", "extra")
+        os.remove(os.path.join(self.deployment, "assets/vendor.js"))
+        with patch.object(self.storage, "save", wraps=self.storage.save) as save:
+            self.assertEqual(
+                deploy_to_remote(self.deployment, self.storage, workers=4),
+                {"uploaded": 2, "unchanged": 1, "deleted": 1},
+            )
+        self.assertEqual(
+            sorted(call.args[0] for call in save.call_args_list),
+            [
+                "study-uuid/.deployment-manifest.json",
+                "study-uuid/assets/app.js",
+                "study-uuid/assets/extra.js",
+            ],
+        )
+        self.assertEqual(self.remote("assets/app.js"), "new app")
+        self.assertEqual(self.remote("assets/extra.js"), "extra")
+        self.assertFalse(self.storage.exists("study-uuid/assets/vendor.js"))
+
+        self.assertEqual(
+            deploy_to_remote(self.deployment, self.storage),
+            {"uploaded": 0, "unchanged": 3, "deleted": 0},
+        )
+
+
+MP4_HEADER = b"\x00\x00\x00\x20ftypisom\x00\x00\x02\x00isomiso2avc1mp41"
+
+
+class FakeHeaderS3Client:
+    """Serves the ranges of the objects it has that get_object asks for."""
+
+    def __init__(self, keys):
+        self.keys = set(keys)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key, Range):
+        with self.lock:
+            self.requests.append((Bucket, Key, Range))
+        if Key not in self.keys:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        start, end = map(int, Range.removeprefix("bytes=").split("-"))
+        return {"Body": io.BytesIO(MP4_HEADER[start : end + 1])}
+
+
+class BackfillVideosFromEventsTestCase(TestCase):
+    def setUp(self):
+        self.study = G(Study, study_type=StudyType.get_ember_frame_player())
+        self.child = G(Child, user=G(User), birthday=date.today())
+
+    def create_response(self, *video_ids, frame_type="DEFAULT"):
+        return G(
+            Response,
+            study=self.study,
+            child=self.child,
+            study_type=self.study.study_type,
+            exp_data={
+                "1-video-frame": {
+                    "frameType": frame_type,
+                    "videoId": video_ids[0],
+                    "videoList": list(video_ids),
+                    "eventTimings": [
+                        {
+                            "videoId": video_id,
+                            "pipeId": f"pipe-{video_id}",
+                            "streamTime": 1.5,
+                            "timestamp": "2024-05-01T12:00:00Z",
+                        }
+                        for video_id in video_ids
+                    ],
+                }
+            },
+        )
+
+    @override_settings(BUCKET_NAME="pipe-bucket")
+    def test_backfill_creates_missing_videos(self):
+        first = self.create_response("a", "b", frame_type="CONSENT")
+        second = self.create_response("a", "c", "d", "e")
+        G(
+            Video,
+            pipe_name="pipe-e",
+            full_name="e.mp4",
+            study=self.study,
+            response=second,
+            s3_timestamp=timezone_now(),
+        )
+        client = FakeHeaderS3Client(["a.mp4", "pipe-b.mp4", "c.mp4"])
+
+        out = io.StringIO()
+        with patch("studies.tasks.S3_CLIENT", client):
+            call_command(
+                "backfill_videos_from_events",
+                "--workers=4",
+                "--batch-size=2",
+                stdout=out,
+            )
+
+        videos = {video.full_name: video for video in Video.objects.all()}
+        self.assertEqual(set(videos), {"a.mp4", "b.mp4", "c.mp4", "e.mp4"})
+        self.assertEqual(videos["a.mp4"].response, first)
+        self.assertTrue(videos["b.mp4"].is_consent_footage)
+        self.assertEqual(videos["b.mp4"].pipe_name, "pipe-b")
+        self.assertEqual(
+            videos["c.mp4"].s3_timestamp, datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+        )
+        self.assertFalse(videos["c.mp4"].is_consent_footage)
+
+        # "a" is looked for once, and "e" not at all.
+        self.assertEqual(
+            sorted(key for _, key, _ in client.requests),
+            ["a.mp4", "b.mp4", "c.mp4", "d.mp4", "pipe-b.mp4", "pipe-d.mp4"],
+        )
+        self.assertEqual(
+            {(bucket, range) for bucket, _, range in client.requests},
+            {("pipe-bucket", "bytes=0-31")},
+        )
+        self.assertIn("2 responses with 6 videos", out.getvalue())
+        self.assertIn("Created 3 Videos; 1 videos weren't in S3", out.getvalue())
+        self.assertIn("videos/s", out.getvalue())
+
+    def test_dry_run_creates_nothing(self):
+        response = self.create_response("a")
+        with patch("studies.tasks.S3_CLIENT", FakeHeaderS3Client(["a.mp4"])):
+            call_command(
+                "backfill_videos_from_events",
+                "--dry-run",
+                f"--study={self.study.uuid}",
+                stdout=io.StringIO(),
+            )
+            self.assertFalse(Video.objects.exists())
+
+            self.assertEqual(
+                [video.full_name for video in response.generate_videos_from_events()],
+                ["a.mp4"],
+            )
+
+
 fake_website = "https://fakedomain.asdf/"
 exp_fake_website = "https://experimentfakedomain.asdf/"
 
@@ -0,0 +1,291 @@
+"""Zip archives of study videos, built incrementally in Google Cloud Storage.
+
+Each video is uploaded once as a zip member: its local file header followed by the video,
+stored without compression (the videos are already compressed). Archives are composed from
+those member objects on the GCS side and followed by a central directory written for that
+archive, so building one only downloads and uploads the videos no earlier archive included.
+
+Every kind of archive (e.g. a study's consent videos matching some filter) also keeps a
+manifest naming the object that holds its members' data, in order. When a new archive's
+members begin with the previous archive's, its data is composed from that object and the
+new members alone.
+
+Deleting a video deletes its member object and the data and manifests of archives composed
+from it (see delete_archived_videos), so the next build of those archives starts over.
+"""
+
+import hashlib
+import json
+import shutil
+import stat
+import struct
+import zlib
+from contextlib import closing
+from functools import partial
+from typing import NamedTuple
+
+from google.api_core.exceptions import NotFound
+
+from studies.tasks import DOWNLOAD_CHUNK_SIZE, prefetched_downloads
+
+# Most objects a single GCS compose request can combine.
+COMPOSE_LIMIT = 32
+
+ZIP64_VERSION = 45
+UNIX_VERSION_MADE_BY = 3 << 8 | ZIP64_VERSION
+UTF8_NAMES_FLAG = 0x800
+STORED = 0
+ZIP64_PLACEHOLDER = 0xFFFFFFFF
+FILE_ATTRIBUTES = (stat.S_IFREG | 0o600) << 16
+
+
+def archive_prefix(study_uuid) -> str:
+    """Where a study's archive members, data and manifests are kept."""
+    return f"video-archives/{study_uuid}"
+
+
+class ArchiveMember(NamedTuple):
+    name: str
+    crc32: int
+    size: int
+    modified: int  # MS-DOS date in the high 16 bits, time in the low 16 bits.
+    object_size: int  # Size of the member object: local file header and data.
+
+
+def dos_datetime(dt) -> int:
+    date = (dt.year - 1980) << 9 | dt.month << 5 | dt.day
+    time = dt.hour << 11 | dt.minute << 5 | dt.second // 2
+    return date << 16 | time
+
+
+def local_file_header(name, crc32, size, modified) -> bytes:
+    encoded_name = name.encode("utf-8")
+    extra = struct.pack("<HHQQ", 0x0001, 16, size, size)
+    return (
+        struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50,
+            ZIP64_VERSION,
+            UTF8_NAMES_FLAG,
+            STORED,
+            modified & 0xFFFF,
+            modified >> 16,
+            crc32,
+            ZIP64_PLACEHOLDER,
+            ZIP64_PLACEHOLDER,
+            len(encoded_name),
+            len(extra),
+        )
+        + encoded_name
+        + extra
+    )
+
+
+def central_directory(members) -> bytes:
+    """The central directory and end records for an archive of these members, which follows
+    their member objects."""
+    records = []
+    offset = 0
+    for member in members:
+        encoded_name = member.name.encode("utf-8")
+        extra = struct.pack("<HHQQQ", 0x0001, 24, member.size, member.size, offset)
+        records.append(
+            struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014B50,
+                UNIX_VERSION_MADE_BY,
+                ZIP64_VERSION,
+                UTF8_NAMES_FLAG,
+                STORED,
+                member.modified & 0xFFFF,
+                member.modified >> 16,
+                member.crc32,
+                ZIP64_PLACEHOLDER,
+                ZIP64_PLACEHOLDER,
+                len(encoded_name),
+                len(extra),
+                0,
+                0,
+                0,
+                FILE_ATTRIBUTES,
+                ZIP64_PLACEHOLDER,
+            )
+            + encoded_name
+            + extra
+        )
+        offset += member.object_size
+
+    directory = b"".join(records)
+    zip64_end = struct.pack(
+        "<IQHHIIQQQQ",
+        0x06064B50,
+        44,
+        UNIX_VERSION_MADE_BY,
+        ZIP64_VERSION,
+        0,
+        0,
+        len(members),
+        len(members),
+        len(directory),
+        offset,
+    )
+    zip64_locator = struct.pack("<IIQI", 0x07064B50, 0, offset + len(directory), 1)
+    end = struct.pack(
+        "<IHHHHIIH",
+        0x06054B50,
+        0,
+        0,
+        0xFFFF,
+        0xFFFF,
+        ZIP64_PLACEHOLDER,
+        ZIP64_PLACEHOLDER,
+        0,
+    )
+    return directory + zip64_end + zip64_locator + end
+
+
+def compose(destination, sources):
+    """Compose any number of objects into destination, COMPOSE_LIMIT at a time."""
+    destination.compose(sources[:COMPOSE_LIMIT])
+    sources = sources[COMPOSE_LIMIT:]
+    while sources:
+        batch, sources = sources[: COMPOSE_LIMIT - 1], sources[COMPOSE_LIMIT - 1 :]
+        destination.compose([destination, *batch])
+
+
+class VideoArchiveBuilder:
+    """Builds archives of one study's videos from member objects stored under prefix."""
+
+    def __init__(self, bucket, prefix, workers, spool_max_size):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.members_prefix = f"{prefix}/members/"
+        self.workers = workers
+        self.spool_max_size = spool_max_size
+
+    def members(self, videos):
+        """Archive members for these videos, uploading those not stored yet."""
+        stored = {
+            blob.name[len(self.members_prefix) :]: blob
+            for blob in self.bucket.list_blobs(prefix=self.members_prefix)
+        }
+        members = {
+            name: ArchiveMember(
+                name,
+                int(blob.metadata["crc32"]),
+                int(blob.metadata["size"]),
+                int(blob.metadata["modified"]),
+                blob.size,
+            )
+            for name, blob in stored.items()
+        }
+
+        missing = [video for video in videos if video.full_name not in members]
+        bodies = prefetched_downloads(
+            (video.view_url for video in missing), self.workers, self.spool_max_size
+        )
+        with closing(bodies):
+            for video, body in zip(missing, bodies):
+                with body:
+                    members[video.full_name] = self.upload_member(video, body)
+
+        return [members[video.full_name] for video in videos]
+
+    def upload_member(self, video, body):
+        crc32 = size = 0
+        for chunk in iter(partial(body.read, DOWNLOAD_CHUNK_SIZE), b""):
+            crc32 = zlib.crc32(chunk, crc32)
+            size += len(chunk)
+        body.seek(0)
+
+        modified = dos_datetime(video.created_at)
+        header = local_file_header(video.full_name, crc32, size, modified)
+        blob = self.bucket.blob(self.members_prefix + video.full_name)
+        blob.metadata = {"crc32": crc32, "size": size, "modified": modified}
+        with blob.open("wb") as f:
+            f.write(header)
+            shutil.copyfileobj(body, f, DOWNLOAD_CHUNK_SIZE)
+        return ArchiveMember(video.full_name, crc32, size, modified, len(header) + size)
+
+    def build(self, archive_blob, videos, kind):
+        """Write the archive of these videos, in order, to archive_blob.
+
+        Raises:
+            NotFound: Another build of this kind of archive replaced the data this one was
+                composing from; building again will use the newer data.
+        """
+        members = self.members(videos)
+        manifest_blob = self.bucket.blob(f"{self.prefix}/{kind}.json")
+        try:
+            manifest = json.loads(manifest_blob.download_as_bytes())
+        except NotFound:
+            manifest = {"data": None, "members": []}
+        previous_members = [ArchiveMember(*member) for member in manifest["members"]]
+
+        names_digest = hashlib.sha256(
+            "\n".join(member.name for member in members).encode("utf-8")
+        ).hexdigest()
+        data_blob = self.bucket.blob(f"{self.prefix}/{kind}-{names_digest}.data")
+        if previous_members and members[: len(previous_members)] == previous_members:
+            base = [self.bucket.blob(manifest["data"])]
+            new_members = members[len(previous_members) :]
+        else:
+            base, new_members = [], members
+        new_objects = [
+            self.bucket.blob(self.members_prefix + member.name)
+            for member in new_members
+        ]
+        if base and not new_objects:
+            data_blob = base[0]
+        elif members:
+            compose(data_blob, base + new_objects)
+
+        directory_blob = self.bucket.blob(f"{archive_blob.name}.directory")
+        directory_blob.upload_from_string(central_directory(members))
+        archive_blob.content_type = "application/zip"
+        archive_blob.compose(
+            [data_blob, directory_blob] if members else [directory_blob]
+        )
+        directory_blob.delete()
+
+        manifest_blob.upload_from_string(
+            json.dumps(
+                {"data": data_blob.name if members else None, "members": members}
+            ),
+            content_type="application/json",
+        )
+        if manifest["data"] and manifest["data"] != data_blob.name:
+            try:
+                self.bucket.blob(manifest["data"]).delete()
+            except NotFound:
+                pass
+
+
+def _delete_if_exists(blob):
+    try:
+        blob.delete()
+    except NotFound:
+        pass
+
+
+def delete_archived_videos(bucket, prefix, names):
+    """Delete these videos' member objects under prefix, along with the data and manifest of
+    every kind of archive that includes any of them, so that no copy of the videos is kept."""
+    names = set(names)
+    for name in names:
+        _delete_if_exists(bucket.blob(f"{prefix}/members/{name}"))
+
+    for manifest_blob in bucket.list_blobs(prefix=f"{prefix}/", delimiter="/"):
+        if not manifest_blob.name.endswith(".json"):
+            continue
+        try:
+            manifest = json.loads(manifest_blob.download_as_bytes())
+        except NotFound:
+            continue
+        if names.isdisjoint(
+            ArchiveMember(*member).name for member in manifest["members"]
+        ):
+            continue
+        if manifest["data"]:
+            _delete_if_exists(bucket.blob(manifest["data"]))
+        _delete_if_exists(manifest_blob)
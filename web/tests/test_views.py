@@ -5,7 +5,9 @@ from unittest.mock import MagicMock, PropertyMock, patch, sentinel
 
 from django.contrib.sites.models import Site
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.views.generic.list import MultipleObjectMixin
 from django_dynamic_fixture import G
@@ -13,11 +15,13 @@ from parameterized import parameterized
 from rest_framework import status
 
 from accounts.models import Child, DemographicData, User
+from project.query_profiling import QueryBudgetTestMixin
 from studies.models import Lab, Response, Study, StudyType
 from web.views import (
     ChildrenListView,
     DemographicDataUpdateView,
     LabStudiesListView,
+    StudiesHistoryView,
     StudiesListView,
     StudyDetailView,
 )
@@ -458,7 +462,7 @@ class StudiesListViewTestCase(TestCase):
 
     @patch.object(StudiesListView, "sort_fn")
     @patch.object(MultipleObjectMixin, "get_queryset")
-    @patch("web.views.get_child_eligibility_for_study")
+    @patch("web.views.get_eligible_study_ids")
     @patch.object(StudiesListView, "studies_without_completed_consent_frame")
     @patch("accounts.models.Child.objects")
     @patch.object(StudiesListView, "request", create=True)
@@ -467,12 +471,13 @@ class StudiesListViewTestCase(TestCase):
         mock_request,
         mock_child_objects,
         mock_studies_without_completed_consent_frame,
-        mock_get_child_eligibility_for_study,
+        mock_get_eligible_study_ids,
         mock_super_get_queryset,
         mock_sort_fn,
     ):
         mock_study = MagicMock(name="study")
         mock_studies = [mock_study]
+        mock_get_eligible_study_ids.return_value = {mock_study.id}
 
         type(mock_request).session = PropertyMock(
             return_value={
@@ -498,9 +503,7 @@ class StudiesListViewTestCase(TestCase):
         mock_studies_without_completed_consent_frame.assert_called_once_with(
             mock_studies, mock_child_objects.get()
         )
-        mock_get_child_eligibility_for_study.assert_called_once_with(
-            mock_child_objects.get(), mock_study
-        )
+        mock_get_eligible_study_ids.assert_called_once_with(mock_child_objects.get())
         mock_sort_fn.assert_called_once_with()
 
         self.assertListEqual(studies, mock_studies)
@@ -694,6 +697,7 @@ class StudiesListViewTestCase(TestCase):
         """
 
         type(mock_request.user).is_anonymous = PropertyMock(return_value=False)
+        type(mock_request.user).id = PropertyMock(return_value=1)
         type(mock_request.user).uuid = PropertyMock(
             return_value=uuid.UUID("{12345678-1234-5678-1234-567812345678}")
         )
@@ -839,7 +843,7 @@ class OneClickUnsubcribeTestCase(TestCase):
         )
 
 
-class StudiesHistoryViewTestCase(TestCase):
+class StudiesHistoryViewTestCase(QueryBudgetTestMixin, TestCase):
     def setUp(self):
         self.participant = G(User, is_active=True, is_researcher=False)
         self.child = G(Child, user=self.participant)
@@ -949,6 +953,54 @@ class StudiesHistoryViewTestCase(TestCase):
         studies_p2 = list(response_p2.context["object_list"])
         self.assertEqual(len(list(studies_p2[0].response_page)), 1)
 
+    def test_full_page_within_query_budget(self):
+        """A full page of studies, each with responses from both children, stays within budget."""
+        self.client.force_login(self.participant)
+        for i in range(10):
+            study = self._make_study(f"Study {i}")
+            self._make_response(child=self.child, study=study)
+            self._make_response(child=self.second_child, study=study)
+
+        response = self.assertWithinQueryBudget(self.url)
+        self.assertEqual(len(list(response.context["object_list"])), 10)
+
+    def test_queries_independent_of_study_count(self):
+        """The query count doesn't grow with the number of studies or responses on the page."""
+        self.client.force_login(self.participant)
+        self._make_response()
+        with CaptureQueriesContext(connection) as few_studies:
+            self.client.get(self.url)
+
+        for i in range(5):
+            study = self._make_study(f"Study {i}")
+            self._make_response(child=self.child, study=study)
+            self._make_response(child=self.second_child, study=study)
+        with CaptureQueriesContext(connection) as more_studies:
+            self.client.get(self.url)
+
+        self.assertEqual(len(more_studies), len(few_studies))
+
+    @override_settings(QUERY_PROFILING=True)
+    def test_query_profiling_headers(self):
+        self.client.force_login(self.participant)
+        self._make_response(child=self.child)
+        self._make_response(child=self.second_child)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response["X-Query-Count"]), 0)
+        self.assertGreaterEqual(float(response["X-Query-Time-Ms"]), 0)
+        self.assertIn("X-Query-Repeated", response)
+        self.assertEqual(
+            response["X-Query-Budget"], str(StudiesHistoryView.query_budget)
+        )
+
+    def test_no_query_profiling_headers_by_default(self):
+        self.client.force_login(self.participant)
+        response = self.client.get(self.url)
+        self.assertNotIn("X-Query-Count", response)
+
 
 # TODO: StudyDetailView
 # - check can see for public or private active study, unauthenticated or authenticated
@@ -1,5 +1,6 @@
 import logging
 import re
+from collections import defaultdict
 from hashlib import sha256
 from typing import Any, Dict, Text
 from urllib.parse import parse_qs, urlencode, urlparse
@@ -10,6 +11,7 @@ from botocore.exceptions import ClientError
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, signals
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core.cache import cache
 from django.db.models import Prefetch
 from django.db.models.query import QuerySet
 from django.db.models.query_utils import Q
@@ -32,27 +34,63 @@ from accounts.forms import (
     PastStudiesFormTabChoices,
     StudyListSearchForm,
 )
-from accounts.models import Child, DemographicData, User
+from accounts.models import Child, DemographicData, PendingAnnouncement, User
 from accounts.queries import (
     age_range_eligibility_for_study,
-    get_child_eligibility_for_study,
+    get_eligible_study_ids,
+    get_study_list_version,
 )
 from accounts.utils import hash_id
 from exp.mixins.paginator_mixin import PaginatorMixin
 from project import settings
 from studies.helpers import get_experiment_absolute_url
-from studies.models import Lab, Response, Study, StudyType, StudyTypeEnum, Video
+from studies.models import (
+    Lab,
+    Response,
+    Study,
+    StudyType,
+    StudyTypeEnum,
+    Video,
+    lab_cache,
+    study_cache,
+)
 from web.mixins import AuthenticatedRedirectMixin
 from web.models import Institution, InstitutionSection
 
 logger = logging.getLogger(__name__)
 
+STUDY_SHUFFLE_KEYS_CACHE_TIMEOUT = 60 * 60 * 24
+
 
 @receiver(signals.user_logged_out)
 def on_user_logged_out(sender, request, **kwargs):
     messages.success(request, "You've successfully logged out.")
 
 
+def get_study_shuffle_keys(user: User) -> Dict[int, Text]:
+    """Per-user sort keys for the active, public studies, keyed by study id.
+
+    Cached until any study changes.
+
+    Args:
+        user (User): authenticated user
+
+    Returns:
+        Dict[int, Text]: study id -> hash of the user's and study's UUIDs
+    """
+    key = f"study-shuffle-keys:user:{user.id}:{get_study_list_version()}"
+    shuffle_keys = cache.get(key)
+    if shuffle_keys is None:
+        shuffle_keys = {
+            study_id: sha256(user.uuid.bytes + study_uuid.bytes).hexdigest()
+            for study_id, study_uuid in Study.objects.filter(
+                state="active", public=True
+            ).values_list("id", "uuid")
+        }
+        cache.set(key, shuffle_keys, STUDY_SHUFFLE_KEYS_CACHE_TIMEOUT)
+    return shuffle_keys
+
+
 def create_external_response(study: Study, child_uuid: UUID, preview=False) -> Response:
     """Creates a response object for an external study.
 
@@ -187,7 +225,7 @@ class ParticipantSignupView(generic.CreateView):
             m = p.match(study_url)
             if m:
                 study_uuid = m.group(1)
-                study = Study.objects.only("name").get(uuid=study_uuid)
+                study = study_cache.get(uuid=study_uuid)
                 self.request.session["study_name"] = study.name
                 self.request.session["study_uuid"] = study_uuid
 
@@ -398,6 +436,8 @@ class ParticipantEmailUnsubscribeView(generic.View):
                 email_study_updates=False,
                 email_response_questions=False,
             )
+            # update() skips the signals that keep these up to date.
+            PendingAnnouncement.refresh(user_ids=[user.id])
             messages.info(request, f"{username} has been unsubscribed.")
         else:
             email_pref_url = reverse("web:email-preferences")
@@ -519,9 +559,8 @@ class StudiesListView(generic.ListView, FormView):
                         studies, child
                     )
 
-                studies = [
-                    s for s in studies if get_child_eligibility_for_study(child, s)
-                ]
+                eligible_study_ids = get_eligible_study_ids(child)
+                studies = [s for s in studies if s.id in eligible_study_ids]
             # filter for unauthenticated users that have selected a child age range
             else:
                 age_range = [int(c) for c in child_value.split(",")]
@@ -570,7 +609,11 @@ class StudiesListView(generic.ListView, FormView):
         if user.is_anonymous:
             return lambda s: s.uuid.bytes
         else:
-            return lambda s: sha256(user.uuid.bytes + s.uuid.bytes).hexdigest()
+            shuffle_keys = get_study_shuffle_keys(user)
+            return lambda s: (
+                shuffle_keys.get(s.id)
+                or sha256(user.uuid.bytes + s.uuid.bytes).hexdigest()
+            )
 
     def clear_form_and_session(self, form_kwargs):
         session = self.request.session
@@ -633,7 +676,10 @@ class LabStudiesListView(StudiesListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["lab"] = Lab.objects.filter(slug=self.kwargs.get("lab_slug")).first()
+        try:
+            context["lab"] = lab_cache.get(slug=self.kwargs.get("lab_slug"))
+        except Lab.DoesNotExist:
+            context["lab"] = None
         return context
 
     def sort_fn(self):
@@ -649,9 +695,11 @@ class LabStudiesListView(StudiesListView):
                 s.uuid.bytes,
             )
         else:
+            shuffle_keys = get_study_shuffle_keys(user)
             return lambda s: (
                 s.priority * -1,
-                sha256(user.uuid.bytes + s.uuid.bytes).hexdigest(),
+                shuffle_keys.get(s.id)
+                or sha256(user.uuid.bytes + s.uuid.bytes).hexdigest(),
             )
 
 
@@ -666,6 +714,7 @@ class StudiesHistoryView(
     model = Study
     form_class = PastStudiesForm
     responses_per_study = 10
+    query_budget = 15
 
     def post(self, request, *args, **kwargs):
         form = self.get_form()
@@ -700,35 +749,45 @@ class StudiesHistoryView(
             Q(child__id__in=self._children_ids) & self._response_query
         ).values_list("study_id", flat=True)
 
-        return Study.objects.filter(Q(id__in=study_ids) & study_query)
+        return Study.objects.filter(Q(id__in=study_ids) & study_query).select_related(
+            "study_type"
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         page = self.request.GET.get("page", 1)
         studies_page = self.paginated_queryset(context["object_list"], page, 10)
 
+        # Get the responses to every study on the page at once, rather than a query (and its
+        # prefetches) per study, and page through each study's responses in memory.
+        responses_by_study = defaultdict(list)
+        page_responses = (
+            Response.objects.filter(
+                Q(child__id__in=self._children_ids) & self._response_query,
+                study__in=list(studies_page),
+            )
+            .select_related("child", "study_type")
+            .prefetch_related(
+                Prefetch(
+                    "videos",
+                    queryset=Video.objects.select_related(
+                        "study__study_type"
+                    ).order_by("pipe_numeric_id", "s3_timestamp"),
+                ),
+                "consent_rulings",
+                "feedback",
+            )
+            .order_by("-date_created")
+        )
+        for response in page_responses:
+            responses_by_study[response.study_id].append(response)
+
         for study in studies_page:
             response_page_num = self.request.GET.get(f"response_page_{study.pk}", 1)
-            study_responses = (
-                Response.objects.filter(
-                    Q(child__id__in=self._children_ids) & self._response_query,
-                    study=study,
-                )
-                .select_related("child")
-                .prefetch_related(
-                    Prefetch(
-                        "videos",
-                        queryset=Video.objects.order_by(
-                            "pipe_numeric_id", "s3_timestamp"
-                        ),
-                    ),
-                    "consent_rulings",
-                    "feedback",
-                )
-                .order_by("-date_created")
-            )
             study.response_page = self.paginated_queryset(
-                study_responses, response_page_num, self.responses_per_study
+                responses_by_study[study.pk],
+                response_page_num,
+                self.responses_per_study,
             )
 
         context["object_list"] = studies_page
@@ -765,7 +824,7 @@ class StudyDetailView(generic.DetailView):
         study by uuid.
         """
         uuid = self.kwargs.get("uuid")
-        return get_object_or_404(Study, uuid=uuid)
+        return study_cache.get_or_404(uuid=uuid)
 
     def get_context_data(self, **kwargs):
         """